@@ -1,7 +1,9 @@
 from django.contrib import admin
 from .models import (
     Store, Product, ProductStoreData, ProductGlobalData, Sale, ProductOrder, Backlog, 
-    Demand, Inventory, WorkingDays, ProductStoreStatistics, ProductStatistics, Region,
+    Demand, Inventory, WorkingDays, ProductStoreStatistics, ProductStatistics, Region, DailySales,
+    CurrentInventory, Job, ProductSalesRanking, ProductClassification, ProductSeasonality,
+    DemandForecast,
     )
 
 @admin.register(Region)
@@ -39,6 +41,12 @@ class InventoryAdmin(admin.ModelAdmin):
     list_filter = ('store', 'product', 'date')
     search_fields = ('product__name', 'store__name')
 
+@admin.register(CurrentInventory)
+class CurrentInventoryAdmin(admin.ModelAdmin):
+    list_display = ('product', 'store', 'inventory_level', 'date')
+    list_filter = ('store',)
+    search_fields = ('product__sku', 'product__name', 'store__name')
+
 @admin.register(Sale)
 class SaleAdmin(admin.ModelAdmin):
     list_display = ('product', 'store', 'client_type', 'category', 'manager', 'quantity', 'sale_date')
@@ -46,6 +54,13 @@ class SaleAdmin(admin.ModelAdmin):
     search_fields = ('product__name', 'store__name', 'client_type', 'category', 'manager')
 
 
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    list_display = ('product', 'store', 'date', 'quantity', 'sale_value', 'cost')
+    list_filter = ('store', 'date')
+    search_fields = ('product__sku', 'store__name')
+
+
 @admin.register(ProductOrder)
 class ProductOrderAdmin(admin.ModelAdmin):
     list_display = ('product', 'store', 'quantity', 'order_date', 'expected_delivery_date')
@@ -87,3 +102,36 @@ class ProductStatisticsAdmin(admin.ModelAdmin):
     list_filter = ('product',)
     search_fields = ('product__sku',)
 
+
+@admin.register(ProductSalesRanking)
+class ProductSalesRankingAdmin(admin.ModelAdmin):
+    list_display = ('product', 'year', 'month', 'location', 'quantity', 'sale_value', 'weight_quantity')
+    list_filter = ('year', 'month', 'location')
+    search_fields = ('product__sku',)
+
+
+@admin.register(ProductClassification)
+class ProductClassificationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'store', 'abc_class', 'xyz_class', 'value_share', 'cv', 'window_end')
+    list_filter = ('store', 'abc_class', 'xyz_class')
+    search_fields = ('product__sku',)
+
+
+@admin.register(ProductSeasonality)
+class ProductSeasonalityAdmin(admin.ModelAdmin):
+    list_display = ('product', 'location', 'kruskal_stat', 'p_value', 'first_year', 'last_year')
+    list_filter = ('location',)
+    search_fields = ('product__sku',)
+
+
+@admin.register(DemandForecast)
+class DemandForecastAdmin(admin.ModelAdmin):
+    list_display = ('product', 'store', 'level', 'last_month', 'forecast_start', 'fitted_at')
+    list_filter = ('store', 'last_month')
+    search_fields = ('product__sku',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'message', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from im.quaries import get_latest_sales_date
+from im.utils_seasonality import SEASONALITY_YEARS, analyse_seasonality, get_seasonality_years
+
+
+class Command(BaseCommand):
+    help = "Kruskal-Wallis seasonality test and seasonal indices of every product and location, saved to ProductSeasonality."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years', type=int, nargs='+',
+            help=f"Consecutive years to analyse, the last {SEASONALITY_YEARS} whole years of sales by default",
+        )
+
+    def handle(self, *args, **options):
+        years = sorted(options['years'] or get_seasonality_years(get_latest_sales_date()))
+        start = time.perf_counter()
+        result = analyse_seasonality(years)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{result['series']} series analysed over {years[0]}-{years[-1]} in {elapsed:.2f} s, "
+            f"{result['seasonal']} significantly seasonal"
+        )
@@ -0,0 +1,45 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from im.models import Product
+from im.quaries import get_latest_sales_date
+from im.utils_backtest import BACKTEST_SOURCES, backtest_oracle
+
+
+class Command(BaseCommand):
+    help = "Backtest the order policy over historical or simulated demand and report service and cost per city."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day (YYYY-MM-DD), one year before --end by default")
+        parser.add_argument('--end', help="Last day (YYYY-MM-DD), the latest sales date by default")
+        parser.add_argument('--source', choices=BACKTEST_SOURCES, default='history')
+        parser.add_argument('--scenarios', type=int, default=1, help="Scenarios of the simulated source")
+        parser.add_argument('--review-days', type=int, default=1, help="Working days between two order reviews")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--skus', nargs='+', help="SKUs to backtest, the whole catalogue by default")
+        parser.add_argument('--output', help="CSV file for the per product results")
+
+    def handle(self, *args, **options):
+        end_date = datetime.strptime(options['end'], "%Y-%m-%d").date() if options['end'] else get_latest_sales_date()
+        if options['start']:
+            start_date = datetime.strptime(options['start'], "%Y-%m-%d").date()
+        else:
+            start_date = end_date - timedelta(days=364)
+        products = Product.objects.order_by('id')
+        if options['skus']:
+            products = products.filter(sku__in=options['skus'])
+
+        start = time.perf_counter()
+        summary, details = backtest_oracle(
+            start_date, end_date, products, source=options['source'], n_scenarios=options['scenarios'],
+            review_days=options['review_days'], seed=options['seed'],
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{len(details)} products from {start_date} to {end_date} in {elapsed:.2f} s")
+        for city, metrics in summary.items():
+            self.stdout.write(f"{city}: " + ", ".join(f"{key} {value:,.2f}" for key, value in metrics.items()))
+        if options['output']:
+            details.to_csv(options['output'], index=False)
+            self.stdout.write(f"Per product results written to {options['output']}")
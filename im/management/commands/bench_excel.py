@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from im.process_excel import (
+    make_flat_table, make_flat_table_inv, read_inventory_report, SALES_STORES, INVENTORY_STORES, INVENTORY_COLUMNS,
+)
+
+
+def make_sales_report(n_rows, seed=0):
+    """
+    Synthetic 1C sales report in the shape returned by pd.read_excel:
+    3 header rows, then store headers, SKU headers and sale rows.
+    """
+    rng = np.random.default_rng(seed)
+    stores = list(SALES_STORES)
+    kind = rng.choice(3, size=n_rows, p=[0.001, 0.05, 0.949])  # 0 - store, 1 - SKU, 2 - sale
+    kind[0] = 0
+
+    name = np.full(n_rows, None, dtype=object)
+    art = np.full(n_rows, None, dtype=object)
+    sale_date = np.full(n_rows, None, dtype=object)
+    client_type = np.full(n_rows, None, dtype=object)
+
+    is_store, is_sku, is_sale = kind == 0, kind == 1, kind == 2
+    name[is_store] = rng.choice(stores, size=is_store.sum())
+    name[is_sku] = 'Товар'
+    art[is_sku] = rng.integers(1000, 9999, size=is_sku.sum()).astype(str)
+    days = pd.to_datetime('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, size=is_sale.sum()), unit='D')
+    sale_date[is_sale] = days.strftime('%d.%m.%Y  0:00:00')
+    client_type[is_sale] = rng.choice(['Опт', 'Розница'], size=is_sale.sum())
+
+    report = pd.DataFrame({
+        'name': name,
+        'art': art,
+        'sale_date': sale_date,
+        'client_type': client_type,
+        'quantity': rng.integers(1, 50, size=n_rows),
+        'sale_value': rng.uniform(10, 5000, size=n_rows).round(2),
+        'cost': rng.uniform(10, 4000, size=n_rows).round(2),
+    })
+    report.index += 3
+    report = report.reindex(range(n_rows + 3))  # three empty header rows
+    report.iloc[-1, 0] = 'Итого'
+    return report
+
+
+def write_inventory_report(path, n_rows, seed=0):
+    """
+    Synthetic 1C inventory workbook: SKU headers, store headers and dated
+    stock rows, written with openpyxl in write-only mode.
+    """
+    rng = np.random.default_rng(seed)
+    stores = list(INVENTORY_STORES)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('TDSheet')
+    sheet.append(['Ведомость по товарам на складах'])
+    sheet.append(['Период'])
+    sheet.append([])
+    sheet.append(['Номенклатура', 'Артикул', 'Нач. остаток', 'Приход', 'Расход', 'Кон. остаток'])
+
+    rows, sku = 0, 1000
+    while rows < n_rows:
+        sheet.append(['Товар', str(sku), 0, 0, 0, 0])
+        rows += 1
+        for store in rng.choice(stores, size=3, replace=False):
+            sheet.append([store, None, 0, 0, 0, 0])
+            rows += 1
+            level = int(rng.integers(0, 500))
+            for day in sorted(rng.choice(365, size=20, replace=False)):
+                date = (pd.Timestamp('2024-01-01') + pd.Timedelta(days=int(day))).strftime('%d.%m.%Y')
+                incoming, outgoing = int(rng.integers(0, 50)), int(rng.integers(0, 50))
+                sheet.append([date, None, level, incoming, outgoing, level + incoming - outgoing])
+                level += incoming - outgoing
+                rows += 1
+        sku += 1
+    sheet.append(['Итого', None, 0, 0, 0, 0])
+    workbook.save(path)
+
+
+def legacy_fill(data, column, target, headers):
+    """Row by row forward fill used by the parsers before vectorisation."""
+    for item in range(data.index[-1]):
+        if data.loc[item, column] in headers:
+            data.loc[item, target] = data.loc[item, column]
+        else:
+            if item != 0:
+                data.loc[item, target] = data.loc[item - 1, target]
+
+
+def _parse_inventory(variant, path, queue):
+    start = time.perf_counter()
+    if variant == 'streaming':
+        flat = read_inventory_report(path)
+    elif variant == 'read_excel':
+        flat = make_flat_table_inv(pd.read_excel(path, engine='openpyxl'))
+    else:  # legacy: whole frame in memory and row by row forward fill
+        data = pd.read_excel(path, engine='openpyxl').dropna(axis=1, how="all").iloc[3:].reset_index(drop=True)
+        data.columns = INVENTORY_COLUMNS
+        data['store'], data['SKU'] = "", ""
+        legacy_fill(data, 'art', 'SKU', list(data.art.dropna().unique()))
+        legacy_fill(data, 'name', 'store', list(INVENTORY_STORES))
+        flat = data
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((len(flat), elapsed, peak_mb))
+
+
+class Command(BaseCommand):
+    help = "Time the 1C report parsers on a synthetic report."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--report', choices=['sales', 'inventory'], default='sales')
+        parser.add_argument('--rows', type=int, default=500_000, help="Rows in the synthetic report")
+        parser.add_argument('--legacy-rows', type=int, default=0,
+                            help="Sales: also time the row by row forward fill on the first N rows")
+        parser.add_argument('--legacy', action='store_true',
+                            help="Inventory: also run the row by row parser (slow)")
+
+    def handle(self, *args, **options):
+        if options['report'] == 'inventory':
+            self.bench_inventory(options)
+        else:
+            self.bench_sales(options)
+
+    def bench_inventory(self, options):
+        """Each parser runs in a fresh process so that peak RSS is measured separately."""
+        variants = ['read_excel', 'streaming'] + (['legacy'] if options['legacy'] else [])
+        context = multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'inventory.xlsx')
+            write_inventory_report(path, options['rows'])
+            size_mb = os.path.getsize(path) / 2 ** 20
+            self.stdout.write(f"synthetic inventory report: {options['rows']} rows, {size_mb:.1f} MB")
+            for variant in variants:
+                queue = context.Queue()
+                process = context.Process(target=_parse_inventory, args=(variant, path, queue))
+                process.start()
+                n_rows, elapsed, peak_mb = queue.get()
+                process.join()
+                self.stdout.write(f"{variant:>10}: {n_rows} rows in {elapsed:.2f} s, peak RSS {peak_mb:.0f} MB")
+
+    def bench_sales(self, options):
+        report = make_sales_report(options['rows'])
+
+        start = time.perf_counter()
+        flat = make_flat_table(report)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"make_flat_table: {len(report)} rows -> {len(flat)} sales in {elapsed:.2f} s")
+
+        if options['legacy_rows']:
+            data = report.iloc[3:3 + options['legacy_rows']].reset_index(drop=True)
+            data['store'] = ""
+            start = time.perf_counter()
+            legacy_fill(data, 'name', 'store', list(SALES_STORES))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"legacy store fill: {len(data)} rows in {elapsed:.2f} s "
+                              f"(~{elapsed * len(report) / len(data):.0f} s extrapolated to the full report, per column)")
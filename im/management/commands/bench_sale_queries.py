@@ -0,0 +1,176 @@
+import os
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Sum
+
+from im.models import Sale
+from im.quaries import month_range
+
+
+SCHEMA = [
+    "CREATE TABLE im_store (id INTEGER PRIMARY KEY, name TEXT, location TEXT)",
+    "CREATE TABLE im_product (id INTEGER PRIMARY KEY, sku TEXT, weight REAL)",
+    "CREATE TABLE im_sale (id INTEGER PRIMARY KEY AUTOINCREMENT, product_id INTEGER, store_id INTEGER, "
+    "client_type TEXT, category TEXT, manager TEXT, region_id INTEGER, quantity INTEGER, cost REAL, "
+    "sale_value REAL, sale_date DATE)",
+    # foreign key indexes that Django creates for every ForeignKey
+    "CREATE INDEX im_sale_product_id ON im_sale (product_id)",
+    "CREATE INDEX im_sale_store_id ON im_sale (store_id)",
+]
+STORES = [
+    (1, 'Novosibirsk Main', 'novosibirsk'), (2, 'Novosibirsk Reserve', 'novosibirsk'),
+    (3, 'Novosibirsk Transit', 'novosibirsk'), (4, 'Kemerovo Main', 'kemerovo'), (5, 'Kemerovo Transit', 'kemerovo'),
+]
+FIRST_DAY = date(2022, 1, 1)
+# Database alias of the synthetic SQLite file, registered while the benchmark runs
+BENCH_ALIAS = 'bench'
+
+
+def sale_index_sql():
+    """CREATE INDEX statements of the indexes declared in Sale.Meta."""
+    return [
+        f"CREATE INDEX {index.name} ON im_sale "
+        f"({', '.join(Sale._meta.get_field(field).column for field in index.fields)})"
+        for index in Sale._meta.indexes
+    ]
+
+
+def open_bench_database(path):
+    """
+    Django connection to a new SQLite file under BENCH_ALIAS, so that the
+    querysets compile and run exactly as on an SQLite default database.
+    """
+    connections.settings[BENCH_ALIAS] = {
+        **connections['default'].settings_dict,
+        'ENGINE': 'django.db.backends.sqlite3', 'NAME': path, 'OPTIONS': {},
+    }
+    return connections[BENCH_ALIAS]
+
+
+def close_bench_database():
+    connections[BENCH_ALIAS].close()
+    del connections[BENCH_ALIAS]
+    del connections.settings[BENCH_ALIAS]
+
+
+def fill_sales(cursor, n_rows, n_products, n_days, seed=0, chunk_rows=200_000):
+    """Synthetic Sale rows, inserted in date order like monthly imports."""
+    rng = np.random.default_rng(seed)
+    cursor.executemany("INSERT INTO im_store VALUES (%s, %s, %s)", STORES)
+    cursor.executemany(
+        "INSERT INTO im_product VALUES (%s, %s, %s)",
+        [(i, str(1000 + i), float(w)) for i, w in enumerate(rng.uniform(0.5, 5, n_products), start=1)],
+    )
+    days = np.sort(rng.integers(0, n_days, n_rows))
+    for start in range(0, n_rows, chunk_rows):
+        chunk = days[start:start + chunk_rows]
+        n = len(chunk)
+        sale_dates = (np.datetime64(FIRST_DAY) + chunk).astype(str)
+        quantity = rng.integers(1, 50, n)
+        rows = zip(
+            rng.integers(1, n_products + 1, n).tolist(),
+            rng.choice([1, 4], n, p=[0.7, 0.3]).tolist(),
+            quantity.tolist(),
+            (quantity * 7.0).tolist(),
+            (quantity * 10.0).tolist(),
+            sale_dates.tolist(),
+        )
+        cursor.executemany(
+            "INSERT INTO im_sale (product_id, store_id, quantity, cost, sale_value, sale_date) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rows,
+        )
+
+
+def dashboard_queries(year, month, product_id):
+    """
+    (name, before, after) querysets of the Sale hot paths: __year/__month
+    lookups as they were written before, half-open date ranges after.
+    """
+    start, end = month_range(year, month)
+    return [
+        (
+            'month sales by location',
+            Sale.objects.filter(sale_date__year=year, sale_date__month=month)
+            .values('product__sku', 'store__location').annotate(total_sales=Sum('quantity')),
+            Sale.objects.filter(sale_date__gte=start, sale_date__lt=end)
+            .values('product__sku', 'store__location').annotate(total_sales=Sum('quantity')),
+        ),
+        (
+            'product month sales',
+            Sale.objects.filter(product_id=product_id, sale_date__year=year, sale_date__month=month)
+            .values('product').annotate(total_sales=Sum('quantity')),
+            Sale.objects.filter(product_id=product_id, sale_date__gte=start, sale_date__lt=end)
+            .values('product').annotate(total_sales=Sum('quantity')),
+        ),
+        (
+            'daily rollup refresh',
+            Sale.objects.filter(sale_date__year=year, sale_date__month=month, store_id__in=[1, 4])
+            .values('product', 'store', 'sale_date')
+            .annotate(total=Sum('quantity'), total_value=Sum('sale_value'), total_cost=Sum('cost')),
+            Sale.objects.filter(sale_date__gte=start, sale_date__lt=end, store_id__in=[1, 4])
+            .values('product', 'store', 'sale_date')
+            .annotate(total=Sum('quantity'), total_value=Sum('sale_value'), total_cost=Sum('cost')),
+        ),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Query plans and timings of the Sale hot paths on a synthetic SQLite table, before and after the indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2_000_000, help="Rows in the synthetic Sale table")
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per query, the best is reported")
+
+    def handle(self, *args, **options):
+        n_days = 3 * 365
+        queries = dashboard_queries(2023, 6, product_id=7)
+        with tempfile.TemporaryDirectory() as tmp:
+            connection = open_bench_database(os.path.join(tmp, 'bench.sqlite3'))
+            try:
+                with connection.cursor() as cursor:
+                    for statement in SCHEMA:
+                        cursor.execute(statement)
+                    start = time.perf_counter()
+                    with transaction.atomic(using=BENCH_ALIAS):
+                        fill_sales(cursor, options['rows'], options['products'], n_days)
+                    self.stdout.write(
+                        f"synthetic Sale table: {options['rows']} rows in {time.perf_counter() - start:.1f} s"
+                    )
+
+                    self.stdout.write("\n== before: foreign key indexes only ==")
+                    self.run_queries(cursor, queries, options['repeat'])
+
+                    start = time.perf_counter()
+                    for statement in sale_index_sql():
+                        cursor.execute(statement)
+                    cursor.execute("ANALYZE")
+                    self.stdout.write(f"\n== after: Sale.Meta indexes (built in {time.perf_counter() - start:.1f} s) ==")
+                    self.run_queries(cursor, queries, options['repeat'])
+            finally:
+                close_bench_database()
+
+    def run_queries(self, cursor, queries, repeat):
+        """Both forms of every query: the __year/__month lookups and the date range."""
+        for name, *querysets in queries:
+            for label, queryset in zip(('year/month', 'date range'), querysets):
+                sql, params = queryset.query.get_compiler(using=BENCH_ALIAS).as_sql()
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                plan = cursor.fetchall()
+                best = min(self.time_query(cursor, sql, params) for _ in range(repeat))
+                self.stdout.write(f"{name} [{label}]: {best * 1000:.1f} ms")
+                for row in plan:
+                    self.stdout.write(f"    {row[-1]}")
+
+    @staticmethod
+    def time_query(cursor, sql, params):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        return time.perf_counter() - start
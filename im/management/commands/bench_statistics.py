@@ -0,0 +1,55 @@
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from im.utils_parallel import STATISTICS_KEYS, parallel_row_statistics, row_statistics, shared_zeros
+
+
+class Command(BaseCommand):
+    help = "Timings of the per-store sales statistics in every execution mode on a synthetic sales matrix."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20_000)
+        parser.add_argument('--stores', type=int, default=5)
+        parser.add_argument('--days', type=int, default=750, help="Working days in the statistics window")
+        parser.add_argument('--workers', default=None, help="Comma separated pool sizes, e.g. 1,2,4,8,16")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per configuration, the best is reported")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        shape = (options['products'], options['stores'], options['days'])
+        sales = rng.poisson(3.0, size=shape).astype(np.int64)
+        self.stdout.write(f"sales matrix {shape}: {sales.nbytes / 2**20:.0f} MB, {os.cpu_count()} CPUs")
+
+        if options['workers']:
+            pool_sizes = [int(n) for n in options['workers'].split(',')]
+        else:
+            pool_sizes = [n for n in (1, 2, 4, 8, 16) if n <= (os.cpu_count() or 1)] or [1]
+
+        expected = row_statistics(sales)
+        # calculate_sales_statistics builds the matrix of the process mode in shared memory
+        shared = shared_zeros(shape)
+        shared[...] = sales
+        serial = self.best_time(sales, 'serial', 1, options['repeat'], expected)
+        self.stdout.write(f"serial: {serial * 1000:.0f} ms")
+        for mode, label, matrix in (
+            ('thread', 'thread', sales), ('process', 'process', shared), ('process', 'process, copied', sales),
+        ):
+            for workers in pool_sizes:
+                elapsed = self.best_time(matrix, mode, workers, options['repeat'], expected)
+                self.stdout.write(
+                    f"{label} x{workers}: {elapsed * 1000:.0f} ms, speedup {serial / elapsed:.2f}"
+                )
+
+    @staticmethod
+    def best_time(sales, mode, workers, repeat, expected):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = parallel_row_statistics(sales, mode=mode, workers=workers)
+            best = min(best, time.perf_counter() - start)
+        for key in STATISTICS_KEYS:
+            np.testing.assert_array_equal(result[key], expected[key])
+        return best
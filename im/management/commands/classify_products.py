@@ -0,0 +1,31 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from im.quaries import get_latest_sales_date
+from im.utils_classification import classify_products
+
+
+class Command(BaseCommand):
+    help = "ABC/XYZ classification of every product in every store, saved to ProductClassification."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day of the window (YYYY-MM-DD), one year before --end by default")
+        parser.add_argument('--end', help="Last day of the window (YYYY-MM-DD), the latest sales date by default")
+
+    def handle(self, *args, **options):
+        end_date = datetime.strptime(options['end'], "%Y-%m-%d").date() if options['end'] else get_latest_sales_date()
+        if options['start']:
+            start_date = datetime.strptime(options['start'], "%Y-%m-%d").date()
+        else:
+            start_date = end_date - timedelta(days=364)
+
+        start = time.perf_counter()
+        counts = classify_products(start_date, end_date)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{sum(counts.values())} products classified from {start_date} to {end_date} in {elapsed:.2f} s"
+        )
+        for label, count in sorted(counts.items()):
+            self.stdout.write(f"    {label}: {count}")
@@ -0,0 +1,31 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from im.models import Store
+from im.utils_forecast import FORECAST_HORIZON_DAYS, refit_forecasts
+
+
+class Command(BaseCommand):
+    help = (
+        "Fit the seasonal exponential smoothing demand forecast of every product and store, "
+        "incrementally from the stored states unless --full."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Latest sales date to fit up to (YYYY-MM-DD), the latest in DailySales by default")
+        parser.add_argument('--stores', nargs='+', help="Store names, every store with sales by default")
+        parser.add_argument('--full', action='store_true', help="Refit from the whole history")
+        parser.add_argument('--horizon', type=int, default=FORECAST_HORIZON_DAYS, help="Days to forecast")
+
+    def handle(self, *args, **options):
+        reference_date = datetime.strptime(options['date'], "%Y-%m-%d").date() if options['date'] else None
+        stores = Store.objects.filter(name__in=options['stores']) if options['stores'] else None
+        start = time.perf_counter()
+        result = refit_forecasts(reference_date, stores, full=options['full'], horizon=options['horizon'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Forecasts up to {result['last_month']} in {elapsed:.2f} s: {result['fitted']} fitted, "
+            f"{result['updated']} carried forward over {result['months']} months"
+        )
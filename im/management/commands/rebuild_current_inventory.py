@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from im.utils_cache import bump_data_generation
+from im.utils_rollup import rebuild_current_inventory
+
+
+class Command(BaseCommand):
+    help = "Rebuild the CurrentInventory table from the Inventory table."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        n_rows = rebuild_current_inventory()
+        bump_data_generation()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"CurrentInventory rebuilt: {n_rows} rows in {elapsed:.2f} s")
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from im.utils_cache import bump_data_generation
+from im.utils_rollup import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailySales rollup from the Sale table."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        n_rows = rebuild_daily_sales()
+        bump_data_generation()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"DailySales rebuilt: {n_rows} rows in {elapsed:.2f} s")
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from im.utils_cache import bump_data_generation
+from im.utils_ranking import rebuild_sales_ranking
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ProductSalesRanking table from the DailySales rollup."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        n_rows = rebuild_sales_ranking()
+        bump_data_generation()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"ProductSalesRanking rebuilt: {n_rows} rows in {elapsed:.2f} s")
@@ -0,0 +1,32 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from im.utils_jobs import JOB_TIMEOUT, claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Worker of the background job queue: runs queued statistics, order and import jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+        parser.add_argument('--poll', type=float, default=2.0, help="Seconds between checks of an empty queue")
+        parser.add_argument(
+            '--timeout', type=float, default=JOB_TIMEOUT.total_seconds() / 3600,
+            help="Hours after which a running job is considered abandoned by a killed worker and marked failed",
+        )
+
+    def handle(self, *args, **options):
+        timeout = timedelta(hours=options['timeout'])
+        while True:
+            job = claim_next_job(timeout)
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+                continue
+            start = time.perf_counter()
+            job = run_job(job)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{job}: {job.message} in {elapsed:.1f} s")
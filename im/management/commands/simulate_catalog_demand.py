@@ -0,0 +1,43 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from im.utils import DEMAND_DISTRIBUTIONS, SIMULATION_CHUNK_VALUES, iter_demand_scenarios
+from im.utils_stat import get_demand_parameters
+
+
+class Command(BaseCommand):
+    help = "Monte Carlo demand of every SKU-store pair with sales statistics, simulated in bounded memory chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', type=int, default=100)
+        parser.add_argument('--periods', type=int, default=30, help="Days per scenario")
+        parser.add_argument('--distribution', choices=DEMAND_DISTRIBUTIONS, default='negative_binomial')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--max-values', type=int, default=SIMULATION_CHUNK_VALUES,
+                            help="Largest number of simulated values in memory at a time")
+
+    def handle(self, *args, **options):
+        parameters = get_demand_parameters()
+        means, stds = parameters['means'], parameters['stds']
+        self.stdout.write(f"{len(means)} SKU-store pairs, {options['scenarios']} scenarios of {options['periods']} days")
+
+        start = time.perf_counter()
+        totals = np.zeros(options['scenarios'])
+        sku_totals = np.zeros(len(means))
+        for first, demand in iter_demand_scenarios(
+            means, stds, options['periods'], options['scenarios'], options['distribution'], options['seed'],
+            max_values=options['max_values'],
+        ):
+            totals[first:first + len(demand)] = demand.sum(axis=(1, 2))
+            sku_totals += demand.sum(axis=(0, 2))
+        elapsed = time.perf_counter() - start
+
+        n_values = options['scenarios'] * len(means) * options['periods']
+        self.stdout.write(f"{n_values} values in {elapsed:.2f} s ({n_values / max(elapsed, 1e-9) / 1e6:.1f} M/s)")
+        p5, p50, p95 = np.percentile(totals, [5, 50, 95])
+        self.stdout.write(f"catalogue demand per scenario: P5 {p5:.0f}, P50 {p50:.0f}, P95 {p95:.0f} "
+                          f"(expected {means.sum() * options['periods']:.0f})")
+        simulated_means = sku_totals / (options['scenarios'] * options['periods'])
+        self.stdout.write(f"largest deviation of a simulated daily mean: {np.abs(simulated_means - means).max(initial=0):.3f}")
@@ -0,0 +1,58 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from im.models import Product
+from im.quaries import get_latest_sales_date
+from im.utils_backtest import BACKTEST_SOURCES
+from im.utils_sweep import (
+    DEFAULT_MIN_FILL_RATE, DEFAULT_S_DAYS_GRID, DEFAULT_THRESHOLD_GRID, SWEEP_BATCH_SIZE, run_policy_sweep,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Tune S_days and the pack rounding threshold of every product on a grid by backtesting "
+        "the order policy, and save the cheapest settings meeting the fill rate target."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day (YYYY-MM-DD), one year before --end by default")
+        parser.add_argument('--end', help="Last day (YYYY-MM-DD), the latest sales date by default")
+        parser.add_argument('--source', choices=BACKTEST_SOURCES, default='history')
+        parser.add_argument('--scenarios', type=int, default=1, help="Scenarios of the simulated source")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--s-days', type=float, nargs='+', default=list(DEFAULT_S_DAYS_GRID))
+        parser.add_argument('--thresholds', type=float, nargs='+', default=list(DEFAULT_THRESHOLD_GRID))
+        parser.add_argument('--min-fill-rate', type=float, default=DEFAULT_MIN_FILL_RATE)
+        parser.add_argument('--review-days', type=int, default=1, help="Working days between two order reviews")
+        parser.add_argument('--workers', type=int, default=None, help="Process pool size, the number of CPUs by default")
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE, help="Products per pool task")
+        parser.add_argument('--checkpoint', help="Directory of finished batches; rerun with the same one to resume")
+        parser.add_argument('--skus', nargs='+', help="SKUs to tune, the whole catalogue by default")
+        parser.add_argument('--dry-run', action='store_true', help="Report the results without saving them")
+
+    def handle(self, *args, **options):
+        end_date = datetime.strptime(options['end'], "%Y-%m-%d").date() if options['end'] else get_latest_sales_date()
+        if options['start']:
+            start_date = datetime.strptime(options['start'], "%Y-%m-%d").date()
+        else:
+            start_date = end_date - timedelta(days=364)
+        products = Product.objects.order_by('id')
+        if options['skus']:
+            products = products.filter(sku__in=options['skus'])
+
+        start = time.perf_counter()
+        result = run_policy_sweep(
+            start_date, end_date, products, source=options['source'], n_scenarios=options['scenarios'],
+            seed=options['seed'], S_days_grid=options['s_days'], threshold_grid=options['thresholds'],
+            min_fill_rate=options['min_fill_rate'], review_days=options['review_days'], workers=options['workers'],
+            batch_size=options['batch_size'], checkpoint_dir=options['checkpoint'], apply=not options['dry_run'],
+            progress=lambda share, message: self.stdout.write(f"{share:.0%} {message}"),
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{result['products']} products, {result['batches']} batches swept in {elapsed:.2f} s: "
+            f"{result['updated']} updated, mean fill rate {result['fill_rate']:.3f}, cost {result['cost']:,.2f}"
+        )
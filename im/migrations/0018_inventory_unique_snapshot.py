@@ -0,0 +1,38 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:16
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def merge_duplicate_snapshots(apps, schema_editor):
+    """
+    Keep the latest row of every (product, store, date): duplicates are copies of
+    the same snapshot left by uploading an overlapping report again.
+    Warehouses aliased to one Store are summed by import_inventory, so the months
+    of such stores must be imported again after this migration.
+    """
+    Inventory = apps.get_model("im", "Inventory")
+    duplicates = (
+        Inventory.objects.values("product", "store", "date")
+        .annotate(rows=Count("id"), last_id=Max("id"))
+        .filter(rows__gt=1)
+        .values_list("product", "store", "date", "last_id")
+    )
+    for product_id, store_id, day, last_id in list(duplicates):
+        Inventory.objects.filter(product_id=product_id, store_id=store_id, date=day).exclude(id=last_id).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("im", "0017_alter_product_sku_alter_store_name"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_snapshots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="inventory",
+            constraint=models.UniqueConstraint(
+                fields=("product", "store", "date"), name="unique_inventory_snapshot"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:40
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_statistics(apps, schema_editor):
+    """Keep the most recent row of every (product, store)."""
+    ProductStoreStatistics = apps.get_model("im", "ProductStoreStatistics")
+    keep = (
+        ProductStoreStatistics.objects.values("product", "store")
+        .annotate(last_id=Max("id"))
+        .values("last_id")
+    )
+    ProductStoreStatistics.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("im", "0018_inventory_unique_snapshot"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_statistics, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="productstorestatistics",
+            constraint=models.UniqueConstraint(
+                fields=("product", "store"), name="unique_product_store_statistics"
+            ),
+        ),
+    ]
@@ -0,0 +1,148 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_statistics(apps, schema_editor):
+    """Keep the most recent row of every product."""
+    ProductStatistics = apps.get_model("im", "ProductStatistics")
+    keep = (
+        ProductStatistics.objects.values("product")
+        .annotate(last_id=Max("id"))
+        .values("last_id")
+    )
+    ProductStatistics.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0019_productstorestatistics_unique"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailySales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(help_text="Date of the sales")),
+                (
+                    "quantity",
+                    models.IntegerField(
+                        default=0, help_text="Total quantity sold on the date"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="productstatistics",
+            name="n_days",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Working days in the window"
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstatistics",
+            name="sales_sum",
+            field=models.FloatField(
+                default=0, help_text="Sum of daily sales over the window"
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstatistics",
+            name="sales_sumsq",
+            field=models.FloatField(
+                default=0, help_text="Sum of squared daily sales over the window"
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstatistics",
+            name="window_end",
+            field=models.DateField(
+                blank=True, help_text="Last day of the statistics window", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstatistics",
+            name="window_start",
+            field=models.DateField(
+                blank=True, help_text="First day of the statistics window", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstorestatistics",
+            name="n_days",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Working days in the window"
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstorestatistics",
+            name="sales_sum",
+            field=models.FloatField(
+                default=0, help_text="Sum of daily sales over the window"
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstorestatistics",
+            name="sales_sumsq",
+            field=models.FloatField(
+                default=0, help_text="Sum of squared daily sales over the window"
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstorestatistics",
+            name="window_end",
+            field=models.DateField(
+                blank=True, help_text="Last day of the statistics window", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="productstorestatistics",
+            name="window_start",
+            field=models.DateField(
+                blank=True, help_text="First day of the statistics window", null=True
+            ),
+        ),
+        migrations.RunPython(remove_duplicate_statistics, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="productstatistics",
+            constraint=models.UniqueConstraint(
+                fields=("product",), name="unique_product_statistics"
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailysales",
+            name="product",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="daily_sales",
+                to="im.product",
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailysales",
+            name="store",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="daily_sales",
+                to="im.store",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailysales",
+            constraint=models.UniqueConstraint(
+                fields=("product", "store", "date"), name="unique_daily_sales"
+            ),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:22
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_daily_sales(apps, schema_editor):
+    """
+    Fill the rollup from one grouped query over Sale, once its columns all exist.
+    Rows written by an earlier version of 0020 are completed in place.
+    """
+    Sale = apps.get_model("im", "Sale")
+    DailySales = apps.get_model("im", "DailySales")
+    totals = (
+        Sale.objects.values("product", "store", "sale_date")
+        .annotate(
+            total=Sum("quantity"), total_value=Sum("sale_value"), total_cost=Sum("cost")
+        )
+        .values_list(
+            "product", "store", "sale_date", "total", "total_value", "total_cost"
+        )
+    )
+    DailySales.objects.bulk_create(
+        (
+            DailySales(
+                product_id=product_id,
+                store_id=store_id,
+                date=day,
+                quantity=total or 0,
+                sale_value=total_value or 0,
+                cost=total_cost or 0,
+            )
+            for product_id, store_id, day, total, total_value, total_cost in totals.iterator()
+        ),
+        batch_size=5000,
+        update_conflicts=True,
+        unique_fields=["product", "store", "date"],
+        update_fields=["quantity", "sale_value", "cost"],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0020_dailysales_statistics_window"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dailysales",
+            name="cost",
+            field=models.FloatField(
+                default=0, help_text="Total cost of the sales on the date"
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailysales",
+            name="sale_value",
+            field=models.FloatField(
+                default=0, help_text="Total value of the sales on the date"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dailysales",
+            index=models.Index(fields=["date"], name="daily_sales_date_idx"),
+        ),
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
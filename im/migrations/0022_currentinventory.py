@@ -0,0 +1,89 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_current_inventory(apps, schema_editor):
+    """Copy the latest Inventory row of every (product, store)."""
+    Inventory = apps.get_model("im", "Inventory")
+    CurrentInventory = apps.get_model("im", "CurrentInventory")
+    latest_date = (
+        Inventory.objects.filter(product=OuterRef("product"), store=OuterRef("store"))
+        .order_by("-date")
+        .values("date")[:1]
+    )
+    latest = Inventory.objects.filter(date=Subquery(latest_date)).values_list(
+        "product", "store", "date", "inventory_level"
+    )
+    CurrentInventory.objects.bulk_create(
+        (
+            CurrentInventory(
+                product_id=product_id,
+                store_id=store_id,
+                date=day,
+                inventory_level=inventory_level,
+            )
+            for product_id, store_id, day, inventory_level in latest.iterator()
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0021_dailysales_value_cost"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CurrentInventory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date",
+                    models.DateField(help_text="Date of the latest inventory record"),
+                ),
+                (
+                    "inventory_level",
+                    models.FloatField(
+                        help_text="Latest stock level of the product in the store"
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="current_inventory",
+                        to="im.product",
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="current_inventory",
+                        to="im.store",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "store"), name="unique_current_inventory"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_current_inventory, migrations.RunPython.noop),
+    ]
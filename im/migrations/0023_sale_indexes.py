@@ -0,0 +1,34 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0022_currentinventory"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="sale",
+            index=models.Index(
+                fields=["product", "store", "sale_date"],
+                name="sale_product_store_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="sale",
+            index=models.Index(
+                fields=[
+                    "sale_date",
+                    "store",
+                    "product",
+                    "quantity",
+                    "sale_value",
+                    "cost",
+                ],
+                name="sale_date_covering_idx",
+            ),
+        ),
+    ]
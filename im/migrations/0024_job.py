@@ -0,0 +1,103 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0023_sale_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("statistics", "Statistics recalculation"),
+                            ("order", "Order generation"),
+                            ("import_sales", "Sales import"),
+                            ("import_inventory", "Inventory import"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "params",
+                    models.JSONField(
+                        blank=True, default=dict, help_text="Arguments of the job"
+                    ),
+                ),
+                (
+                    "progress",
+                    models.FloatField(
+                        default=0, help_text="Share of the work done, from 0 to 1"
+                    ),
+                ),
+                (
+                    "message",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        help_text="Current step of the job",
+                        max_length=200,
+                    ),
+                ),
+                (
+                    "result",
+                    models.JSONField(
+                        blank=True, help_text="Summary of the finished job", null=True
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default="")),
+                (
+                    "input_file",
+                    models.FileField(
+                        blank=True,
+                        help_text="Uploaded file to import",
+                        upload_to="jobs/uploads/",
+                    ),
+                ),
+                (
+                    "output_file",
+                    models.FileField(
+                        blank=True,
+                        help_text="Workbook produced by the job",
+                        upload_to="jobs/results/",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,145 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:43
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def populate_sales_ranking(apps, schema_editor):
+    """Totals of every product per month and year (month 0), per location and for all locations ("")."""
+    DailySales = apps.get_model("im", "DailySales")
+    Product = apps.get_model("im", "Product")
+    ProductSalesRanking = apps.get_model("im", "ProductSalesRanking")
+    totals = (
+        DailySales.objects.annotate(
+            year=ExtractYear("date"), month=ExtractMonth("date")
+        )
+        .values("product_id", "store__location", "year", "month")
+        .annotate(total=Sum("quantity"), total_value=Sum("sale_value"))
+        .values_list(
+            "product_id", "store__location", "year", "month", "total", "total_value"
+        )
+    )
+    rows = defaultdict(lambda: [0, 0.0])
+    for product_id, location, year, month, total, total_value in totals.iterator():
+        for period in (month, 0):
+            for place in (location, "") if location else ("",):
+                row = rows[(product_id, year, period, place)]
+                row[0] += total or 0
+                row[1] += total_value or 0
+    weights = dict(Product.objects.values_list("id", "weight"))
+    ProductSalesRanking.objects.bulk_create(
+        (
+            ProductSalesRanking(
+                product_id=product_id,
+                year=year,
+                month=month,
+                location=location,
+                quantity=quantity,
+                sale_value=sale_value,
+                weight_quantity=quantity * weights[product_id],
+            )
+            for (product_id, year, month, location), (
+                quantity,
+                sale_value,
+            ) in rows.items()
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0024_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductSalesRanking",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "year",
+                    models.PositiveSmallIntegerField(help_text="Year of the sales"),
+                ),
+                (
+                    "month",
+                    models.PositiveSmallIntegerField(
+                        default=0,
+                        help_text="Month of the sales (1-12), 0 for the whole year",
+                    ),
+                ),
+                (
+                    "location",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        help_text="Store location, empty for all locations",
+                        max_length=50,
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.IntegerField(
+                        default=0, help_text="Total quantity sold in the period"
+                    ),
+                ),
+                (
+                    "sale_value",
+                    models.FloatField(
+                        default=0, help_text="Total value of the sales in the period"
+                    ),
+                ),
+                (
+                    "weight_quantity",
+                    models.FloatField(
+                        default=0,
+                        help_text="Total weight sold in the period: quantity times product weight",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sales_ranking",
+                        to="im.product",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["year", "month", "location", "-sale_value"],
+                        name="ranking_value_idx",
+                    ),
+                    models.Index(
+                        fields=["year", "month", "location", "-quantity"],
+                        name="ranking_quantity_idx",
+                    ),
+                    models.Index(
+                        fields=["year", "month", "location", "-weight_quantity"],
+                        name="ranking_weight_idx",
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "year", "month", "location"),
+                        name="unique_product_sales_ranking",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_sales_ranking, migrations.RunPython.noop),
+    ]
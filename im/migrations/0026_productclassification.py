@@ -0,0 +1,90 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0025_productsalesranking"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductClassification",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "abc_class",
+                    models.CharField(
+                        help_text="A, B or C by cumulative share of the store sales value",
+                        max_length=1,
+                    ),
+                ),
+                (
+                    "xyz_class",
+                    models.CharField(
+                        help_text="X, Y or Z by coefficient of variation of the daily sales",
+                        max_length=1,
+                    ),
+                ),
+                (
+                    "value_share",
+                    models.FloatField(
+                        default=0, help_text="Share of the store sales value"
+                    ),
+                ),
+                (
+                    "cv",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Coefficient of variation of the daily sales over working days",
+                        null=True,
+                    ),
+                ),
+                (
+                    "window_start",
+                    models.DateField(
+                        help_text="First day of the classification window"
+                    ),
+                ),
+                (
+                    "window_end",
+                    models.DateField(help_text="Last day of the classification window"),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="classifications",
+                        to="im.product",
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="classifications",
+                        to="im.store",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "store"),
+                        name="unique_product_classification",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0026_productclassification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="pack_round_threshold",
+            field=models.FloatField(
+                default=0.4,
+                help_text="Share of a pack above which an order is rounded up to one more pack",
+            ),
+        ),
+    ]
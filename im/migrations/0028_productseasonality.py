@@ -0,0 +1,93 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0027_product_pack_round_threshold"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductSeasonality",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "location",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        help_text="Store location, empty for all locations",
+                        max_length=50,
+                    ),
+                ),
+                (
+                    "kruskal_stat",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Kruskal-Wallis H of the calendar months",
+                        null=True,
+                    ),
+                ),
+                (
+                    "p_value",
+                    models.FloatField(
+                        blank=True,
+                        help_text="p-value of H0: no monthly seasonality",
+                        null=True,
+                    ),
+                ),
+                (
+                    "seasonal_indices",
+                    models.JSONField(
+                        default=list,
+                        help_text="Seasonal component of January to December, sales per working day",
+                    ),
+                ),
+                (
+                    "first_year",
+                    models.PositiveSmallIntegerField(
+                        help_text="First year of the window"
+                    ),
+                ),
+                (
+                    "last_year",
+                    models.PositiveSmallIntegerField(
+                        help_text="Last year of the window"
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="seasonality",
+                        to="im.product",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["location", "p_value"], name="seasonality_p_value_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "location"),
+                        name="unique_product_seasonality",
+                    )
+                ],
+            },
+        ),
+    ]
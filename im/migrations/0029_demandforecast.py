@@ -0,0 +1,83 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("im", "0028_productseasonality"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DemandForecast",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "level",
+                    models.FloatField(
+                        default=0,
+                        help_text="Smoothed sales per working day without the seasonal component",
+                    ),
+                ),
+                (
+                    "seasonal",
+                    models.JSONField(
+                        default=list,
+                        help_text="Additive seasonal component of January to December",
+                    ),
+                ),
+                (
+                    "last_month",
+                    models.DateField(
+                        help_text="First day of the last month included in the fit"
+                    ),
+                ),
+                (
+                    "forecast_start",
+                    models.DateField(help_text="Date of the first forecast day"),
+                ),
+                (
+                    "forecast",
+                    models.JSONField(
+                        default=list,
+                        help_text="Forecast sales of every horizon day from forecast_start",
+                    ),
+                ),
+                ("fitted_at", models.DateTimeField(auto_now=True)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="forecasts",
+                        to="im.product",
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="forecasts",
+                        to="im.store",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "store"), name="unique_demand_forecast"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -31,6 +31,9 @@ class Product(models.Model):
     volume = models.FloatField(help_text="Volume of the product in cubic units")
     order_pack = models.PositiveIntegerField(blank=False, default=1)
     S_days = models.FloatField(default=30, help_text="For how many days should I order a product")
+    pack_round_threshold = models.FloatField(
+        default=0.4, help_text="Share of a pack above which an order is rounded up to one more pack"
+    )
 
     def __str__(self):
         return self.sku
@@ -77,9 +80,29 @@ class Inventory(models.Model):
     date = models.DateField(help_text="Date of the inventory record", db_index=True)
     inventory_level = models.FloatField(help_text="Current stock level of the product in the store")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store', 'date'], name='unique_inventory_snapshot'),
+        ]
+
     def __str__(self):
         return f"Inventory of {self.product.sku} at {self.store.name} on {self.date}"
 
+class CurrentInventory(models.Model):
+    """Latest Inventory snapshot of every (product, store), maintained by the inventory import."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='current_inventory')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='current_inventory')
+    date = models.DateField(help_text="Date of the latest inventory record")
+    inventory_level = models.FloatField(help_text="Latest stock level of the product in the store")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store'], name='unique_current_inventory'),
+        ]
+
+    def __str__(self):
+        return f"Current inventory of {self.product.sku} at {self.store.name} on {self.date}"
+
 class Region(models.Model):
     title     = models.CharField(max_length=50)
     title_rus = models.CharField(max_length=50)
@@ -99,6 +122,17 @@ class Sale(models.Model):
     sale_value  = models.FloatField(null=True, blank=True)
     sale_date   = models.DateField(help_text="Date of the sale")
 
+    class Meta:
+        indexes = [
+            # per product history: product pages, rollup refresh of a product
+            models.Index(fields=['product', 'store', 'sale_date'], name='sale_product_store_date_idx'),
+            # date range scans of all products, covering the summed columns
+            models.Index(
+                fields=['sale_date', 'store', 'product', 'quantity', 'sale_value', 'cost'],
+                name='sale_date_covering_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Sale of {self.quantity} {self.product.name} at {self.store.name} on {self.sale_date}"
 
@@ -134,6 +168,125 @@ class Demand(models.Model):
         return f"Demand of {self.quantity} {self.product.name} at {self.store.name} on {self.demand_date}"
 
 
+class DailySales(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField(help_text="Date of the sales")
+    quantity = models.IntegerField(default=0, help_text="Total quantity sold on the date")
+    sale_value = models.FloatField(default=0, help_text="Total value of the sales on the date")
+    cost = models.FloatField(default=0, help_text="Total cost of the sales on the date")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store', 'date'], name='unique_daily_sales'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='daily_sales_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Sales of {self.quantity} {self.product.sku} at {self.store.name} on {self.date}"
+
+
+class ProductSalesRanking(models.Model):
+    """
+    Sales totals of a product per period and location, kept up to date by the
+    sales import so that top-N lists read a few index-ordered rows.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_ranking')
+    year = models.PositiveSmallIntegerField(help_text="Year of the sales")
+    month = models.PositiveSmallIntegerField(default=0, help_text="Month of the sales (1-12), 0 for the whole year")
+    location = models.CharField(max_length=50, blank=True, default="", help_text="Store location, empty for all locations")
+    quantity = models.IntegerField(default=0, help_text="Total quantity sold in the period")
+    sale_value = models.FloatField(default=0, help_text="Total value of the sales in the period")
+    weight_quantity = models.FloatField(default=0, help_text="Total weight sold in the period: quantity times product weight")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'year', 'month', 'location'], name='unique_product_sales_ranking'),
+        ]
+        indexes = [
+            models.Index(fields=['year', 'month', 'location', '-sale_value'], name='ranking_value_idx'),
+            models.Index(fields=['year', 'month', 'location', '-quantity'], name='ranking_quantity_idx'),
+            models.Index(fields=['year', 'month', 'location', '-weight_quantity'], name='ranking_weight_idx'),
+        ]
+
+    def __str__(self):
+        return f"Sales of {self.product.sku} in {self.year}/{self.month} ({self.location or 'all'})"
+
+
+class ProductClassification(models.Model):
+    """
+    ABC class (share of the sales value) and XYZ class (variability of the daily
+    sales) of a product in a store, see im/utils_classification.py.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='classifications')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='classifications')
+    abc_class = models.CharField(max_length=1, help_text="A, B or C by cumulative share of the store sales value")
+    xyz_class = models.CharField(max_length=1, help_text="X, Y or Z by coefficient of variation of the daily sales")
+    value_share = models.FloatField(default=0, help_text="Share of the store sales value")
+    cv = models.FloatField(null=True, blank=True, help_text="Coefficient of variation of the daily sales over working days")
+    window_start = models.DateField(help_text="First day of the classification window")
+    window_end = models.DateField(help_text="Last day of the classification window")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store'], name='unique_product_classification'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.sku} at {self.store.name}: {self.abc_class}{self.xyz_class}"
+
+
+class ProductSeasonality(models.Model):
+    """
+    Monthly seasonality of a product per location over a window of whole years:
+    Kruskal-Wallis test of the calendar months and additive seasonal indices,
+    see im/utils_seasonality.py.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='seasonality')
+    location = models.CharField(max_length=50, blank=True, default="", help_text="Store location, empty for all locations")
+    kruskal_stat = models.FloatField(null=True, blank=True, help_text="Kruskal-Wallis H of the calendar months")
+    p_value = models.FloatField(null=True, blank=True, help_text="p-value of H0: no monthly seasonality")
+    seasonal_indices = models.JSONField(default=list, help_text="Seasonal component of January to December, sales per working day")
+    first_year = models.PositiveSmallIntegerField(help_text="First year of the window")
+    last_year = models.PositiveSmallIntegerField(help_text="Last year of the window")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'location'], name='unique_product_seasonality'),
+        ]
+        indexes = [
+            models.Index(fields=['location', 'p_value'], name='seasonality_p_value_idx'),
+        ]
+
+    def __str__(self):
+        return f"Seasonality of {self.product.sku} ({self.location or 'all'}): p = {self.p_value}"
+
+
+class DemandForecast(models.Model):
+    """
+    Seasonal exponential smoothing state of the monthly sales per working day of a
+    product in a store, and the daily forecast it gives, see im/utils_forecast.py.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='forecasts')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='forecasts')
+    level = models.FloatField(default=0, help_text="Smoothed sales per working day without the seasonal component")
+    seasonal = models.JSONField(default=list, help_text="Additive seasonal component of January to December")
+    last_month = models.DateField(help_text="First day of the last month included in the fit")
+    forecast_start = models.DateField(help_text="Date of the first forecast day")
+    forecast = models.JSONField(default=list, help_text="Forecast sales of every horizon day from forecast_start")
+    fitted_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store'], name='unique_demand_forecast'),
+        ]
+
+    def __str__(self):
+        return f"Forecast of {self.product.sku} at {self.store.name} from {self.forecast_start}"
+
+
 class ProductStoreStatistics(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
@@ -141,9 +294,78 @@ class ProductStoreStatistics(models.Model):
     sales_std = models.FloatField(null=True, blank=True, help_text="Sales standard deviation for the product at the store")
     S = models.FloatField(null=True, blank=True, help_text="S: max threshold")
 
+    # Running totals over the statistics window, for incremental updates
+    window_start = models.DateField(null=True, blank=True, help_text="First day of the statistics window")
+    window_end = models.DateField(null=True, blank=True, help_text="Last day of the statistics window")
+    n_days = models.PositiveIntegerField(default=0, help_text="Working days in the window")
+    sales_sum = models.FloatField(default=0, help_text="Sum of daily sales over the window")
+    sales_sumsq = models.FloatField(default=0, help_text="Sum of squared daily sales over the window")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store'], name='unique_product_store_statistics'),
+        ]
+
 
 class ProductStatistics(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     sales_mean = models.FloatField(null=True, blank=True, help_text="Mean sales for the product at the store")
     sales_std = models.FloatField(null=True, blank=True, help_text="Sales standard deviation for the product at the store")
-    S = models.FloatField(null=True, blank=True, help_text="S: max threshold")
\ No newline at end of file
+    S = models.FloatField(null=True, blank=True, help_text="S: max threshold")
+
+    # Running totals over the statistics window, for incremental updates
+    window_start = models.DateField(null=True, blank=True, help_text="First day of the statistics window")
+    window_end = models.DateField(null=True, blank=True, help_text="Last day of the statistics window")
+    n_days = models.PositiveIntegerField(default=0, help_text="Working days in the window")
+    sales_sum = models.FloatField(default=0, help_text="Sum of daily sales over the window")
+    sales_sumsq = models.FloatField(default=0, help_text="Sum of squared daily sales over the window")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product'], name='unique_product_statistics'),
+        ]
+
+class Job(models.Model):
+    """
+    Background task run by the `run_jobs` worker instead of inside an HTTP request.
+    """
+    STATISTICS = 'statistics'
+    ORDER = 'order'
+    IMPORT_SALES = 'import_sales'
+    IMPORT_INVENTORY = 'import_inventory'
+    KIND_CHOICES = [
+        (STATISTICS, 'Statistics recalculation'),
+        (ORDER, 'Order generation'),
+        (IMPORT_SALES, 'Sales import'),
+        (IMPORT_INVENTORY, 'Inventory import'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    params = models.JSONField(default=dict, blank=True, help_text="Arguments of the job")
+    progress = models.FloatField(default=0, help_text="Share of the work done, from 0 to 1")
+    message = models.CharField(max_length=200, blank=True, default="", help_text="Current step of the job")
+    result = models.JSONField(null=True, blank=True, help_text="Summary of the finished job")
+    error = models.TextField(blank=True, default="")
+    input_file = models.FileField(upload_to='jobs/uploads/', blank=True, help_text="Uploaded file to import")
+    output_file = models.FileField(upload_to='jobs/results/', blank=True, help_text="Workbook produced by the job")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.status})"
@@ -1,5 +1,44 @@
+import itertools
+
+import openpyxl
 import pandas as pd
-import re
+
+
+SALES_STORES = {
+    'Склад Новосибирск': 'Novosibirsk Main',
+    'Склад Новосибирск Брак': 'Novosibirsk Defect',
+    'Оптовый Кемерово': 'Kemerovo Main',
+    'Оптовый': 'Kemerovo Main',
+    'Брак Кемерово': 'Kemerovo Defect',
+}
+
+
+INVENTORY_STORES = {
+    'Склад Новосибирск': 'Novosibirsk Main',
+    'Склад Новосибирск Транзит': 'Novosibirsk Transit',
+    'Склад Новосибирск Резерв': 'Novosibirsk Reserve',
+    'Оптовый Кемерово': 'Kemerovo Main',
+    'Оптовый': 'Kemerovo Main',
+    'Склад транзит Кемерово-Новосибирск': 'Kemerovo Transit',
+}
+INVENTORY_COLUMNS = ['name', 'art', 'beg', 'in', 'out', 'end']
+INVENTORY_CHUNK_ROWS = 50000
+
+
+def fill_down(column, is_header, carry="", last_row=True):
+    """
+    Carry header values down to the rows below them.
+    Args:
+        column (pd.Series): column holding the header values
+        is_header (pd.Series): boolean mask of the header rows
+        carry (str): header in effect before the first row (when a report is parsed in blocks)
+        last_row (bool): the block ends the report; the last row of a report gets ""
+    """
+    with pd.option_context('future.no_silent_downcasting', True):  # keep SKUs such as 1005 as int
+        filled = column.where(is_header).ffill().fillna(carry)
+    if last_row and len(filled):
+        filled.iloc[-1] = ""
+    return filled
 
 
 def make_flat_table(data):
@@ -8,27 +47,11 @@ def make_flat_table(data):
     data.index = range(len(data.index)) # После удаления строк удаляются и индексы, поэтому сбивается нумерация, исправляем
     data.columns = ['name', 'art', 'sale_date', 'client_type', 'quantity', 'sale_value', 'cost']
     data['art'] = data['art'].apply(lambda x: str(x) if pd.notnull(x) else x)  # convert all sku to str
-    stores = ["Склад Новосибирск", "Оптовый Кемерово", "Склад Новосибирск Брак", "Брак Кемерово", "Оптовый"]
-    skus = list(data.art.dropna().unique())
-
-    data['store'] = ""
-    data['SKU'] = ""
-    for item in range(data.index[-1]):
-        #print(item)
-        if data.loc[item, 'name'] in stores:
-            data.loc[item, "store"] = data.loc[item, "name"]
-        else:
-            if item != 0:
-                data.loc[item, "store"] = data.loc[item - 1, "store"]
-            
-    # Заполняем колонку "регион", 'клиент'
-    for item in range(data.index[-1]):
-        #print(item)
-        if data.loc[item, 'art'] in skus:
-            data.loc[item, "SKU"] = data.loc[item, "art"]
-        else:
-            if item != 0:
-                data.loc[item, "SKU"] = data.loc[item - 1, "SKU"]
+    skus = data.art.dropna().unique()
+
+    # Заполняем колонки "склад" и "SKU" значениями из строк-заголовков
+    data['store'] = fill_down(data['name'], data['name'].isin(SALES_STORES))
+    data['SKU'] = fill_down(data['art'], data['art'].isin(skus))
 
     data = data[['sale_date', 'quantity', 'store', 'SKU', 'cost', 'sale_value', 'client_type']]
     data['cost'] = data['cost'].fillna(0) 
@@ -36,11 +59,7 @@ def make_flat_table(data):
     data = data.dropna()
     data["sale_date"] = pd.to_datetime(data['sale_date'], errors='coerce', format='%d.%m.%Y  %H:%M:%S').dt.date
     data.index = range(len(data.index)) # После удаления строк удаляются и индексы, поэтому сбивается нумерация, исправляем
-    data = data.replace('Оптовый Кемерово', 'Kemerovo Main')
-    data = data.replace('Оптовый', 'Kemerovo Main')
-    data = data.replace('Склад Новосибирск', 'Novosibirsk Main')
-    data = data.replace('Склад Новосибирск Брак', 'Novosibirsk Defect')
-    data = data.replace('Брак Кемерово', 'Kemerovo Defect')
+    data['store'] = data['store'].replace(SALES_STORES)
     data['quantity']   = data['quantity'].astype('Int32')
     data['cost']       = data['cost'].astype('float64')
     data['sale_value'] = data['sale_value'].astype('float64')
@@ -48,86 +67,147 @@ def make_flat_table(data):
     return data
 
 
-def make_flat_table_inv(data):
-    data = data.dropna(axis=1, how="all")
-    data = data.drop(index=data.index[:3])
-    data.index = range(len(data.index)) # После удаления строк удаляются и индексы, поэтому сбивается нумерация, исправляем
-    data.columns = ['name', 'art', 'beg', 'in', 'out', 'end']
-    skus = list(data.art.dropna().unique())
-    data['store'] = ""
-    data['SKU'] = ""
-    stores = ["Склад Новосибирск", "Оптовый Кемерово", "Оптовый", "Склад Новосибирск Транзит", "Склад Новосибирск Резерв" , "Склад транзит Кемерово-Новосибирск"]
-
-    ##### Find the most recent date
-    # column_with_dates = list(data.name.dropna().unique())
-    # data_str = " ".join(column_with_dates)
-    # dates = re.findall(r"\d{2}\.\d{2}\.\d{4}", data_str)
-
-    # # Convert dates to pandas datetime
-    # dates = pd.to_datetime(dates, format="%d.%m.%Y")
-
-    # # Find the most recent date
-    # most_recent_date = dates.max().strftime('%d.%m.%Y')
-    #####################################################
-
-    # fill sku
-    for item in range(data.index[-1]):
-        if data.loc[item, 'art'] in skus:
-            data.loc[item, "SKU"] = data.loc[item, "art"]
-        else:
-            if item != 0:
-                data.loc[item, "SKU"] = data.loc[item - 1, "SKU"]
-                
-    for item in range(data.index[-1]):
-        if data.loc[item, 'name'] in stores:
-            data.loc[item, "store"] = data.loc[item, "name"]
-        else:
-            if item != 0:
-                data.loc[item, "store"] = data.loc[item - 1, "store"]
-
-    data['in']  = data['in'].fillna(0)
-    data['out'] = data['out'].fillna(0)
-
-    # for item in range(1, data.index[-1]):
-    #     is_next_item_date = False
-    #     next_item = str(data.loc[item+1, 'name'])
-    #     pattern = r"\d{2}\.\d{2}\.\d{4}"
-    #     if re.fullmatch(pattern, next_item):
-    #         is_next_item_date = True          
-
-    #     if pd.isna(data.loc[item, 'name']) and data.loc[item-1, 'name'] in stores and is_next_item_date == False:
-    #         data.loc[item, 'name'] = most_recent_date
-    #     elif pd.isna(data.loc[item, 'name']) and data.loc[item-1, 'name'] in stores:
-    #         if pd.isna(data.loc[item, 'beg']):
-    #             data.loc[item+1, 'beg'] = 0
-    #         else:
-    #             data.loc[item+1, 'beg'] = data.loc[item, 'beg']
-    #     elif not pd.isna(data.loc[item, 'name']) and data.loc[item-1, 'name'] in stores:
-    #         data.loc[item, 'beg'] = 0
-    #         data.loc[item, 'end'] = data.loc[item, 'beg'] + data.loc[item, 'in'] - data.loc[item, 'out']        
-    #     else:
-    #         data.loc[item, 'end'] = data.loc[item, 'beg'] + data.loc[item, 'in'] - data.loc[item, 'out']
-
-    # for item in range(data.index[-1]):
-    #     if pd.isna(data.loc[item, 'beg']):
-    #         data.loc[item, 'beg'] = data.loc[item-1, 'end']
-    #         data.loc[item, 'end'] = data.loc[item, 'beg'] + data.loc[item, 'in'] - data.loc[item, 'out']
-
-    data = data.dropna(subset=['name'])
-    df = data[~data['art'].isin(skus)]
-    df = df[~df['name'].isin(stores)]
-    df = df[~df['name'].isin(["Итого"])]
-    df = df[['name', 'beg', 'end', 'store', 'SKU']]
+def _inventory_block(data, store="", sku="", last_row=True):
+    """
+    Fill store and SKU of a block of inventory report rows and keep the dated rows.
+    Returns:
+        (pd.DataFrame, str, str): dated rows, store and SKU headers in effect after the block.
+    """
+    data['SKU'] = fill_down(data['art'], data['art'].notna(), carry=sku, last_row=False)
+    data['store'] = fill_down(data['name'], data['name'].isin(INVENTORY_STORES), carry=store, last_row=False)
+    if len(data):
+        store, sku = data['store'].iloc[-1], data['SKU'].iloc[-1]
+        if last_row:
+            data.iloc[-1, data.columns.get_loc('SKU')] = ""
+            data.iloc[-1, data.columns.get_loc('store')] = ""
+
+    is_dated = (
+        data['name'].notna()
+        & data['art'].isna()
+        & ~data['name'].isin(INVENTORY_STORES)
+        & ~data['name'].isin(["Итого"])
+    )
+    return data.loc[is_dated, ['name', 'beg', 'end', 'store', 'SKU']], store, sku
+
+
+def _finish_inventory_table(df):
     df = df.rename(columns={'name': 'date'})
     df["date"] = pd.to_datetime(df['date'], errors='coerce', format='%d.%m.%Y').dt.date
-    df = df.replace('Оптовый Кемерово', 'Kemerovo Main')
-    df = df.replace('Оптовый', 'Kemerovo Main')
-    df = df.replace('Склад Новосибирск', 'Novosibirsk Main')
-    df = df.replace('Склад Новосибирск Транзит', 'Novosibirsk Transit')
-    df = df.replace('Склад Новосибирск Резерв', 'Novosibirsk Reserve')
-    df = df.replace('Склад транзит Кемерово-Новосибирск', 'Kemerovo Transit')
+    df['store'] = df['store'].replace(INVENTORY_STORES)
+    df = df.infer_objects()
+    df['beg'] = pd.to_numeric(df['beg'], errors='coerce')
     df['end'] = df['end'].astype('Int32')  
-    data.index = range(len(data.index)) # После удаления строк удаляются и индексы, поэтому сбивается нумерация, исправляем
     df = df.query('store != ""')
     df = df.fillna(0)
-    return df
\ No newline at end of file
+    return df
+
+
+def make_flat_table_inv(data):
+    data = data.dropna(axis=1, how="all")
+    data = data.drop(index=data.index[:3])
+    data.index = range(len(data.index)) # После удаления строк удаляются и индексы, поэтому сбивается нумерация, исправляем
+    data.columns = INVENTORY_COLUMNS
+    df, _, _ = _inventory_block(data)
+    return _finish_inventory_table(df)
+
+
+def _cell_value(value):
+    # Same conversions pd.read_excel applies to openpyxl cells
+    if value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _sheet_rows(sheet):
+    """Rows below the header row, as pd.read_excel sees them."""
+    for row in sheet.iter_rows(min_row=2, values_only=True):
+        yield [_cell_value(value) for value in row]
+
+
+def _used_columns(rows):
+    used = set()
+    for row in rows:
+        used.update(i for i, value in enumerate(row) if value is not None)
+    return sorted(used)
+
+
+class _ColumnsChanged(Exception):
+    pass
+
+
+def _parse_inventory_rows(rows, used_columns, chunk_rows):
+    """
+    Parse report rows in blocks of chunk_rows rows; every block is reduced to
+    its final rows straight away.
+    Raises _ColumnsChanged when a row has data outside used_columns.
+    """
+    if len(used_columns) != len(INVENTORY_COLUMNS):
+        raise ValueError(
+            f"Length mismatch: Expected axis has {len(used_columns)} elements, "
+            f"new values have {len(INVENTORY_COLUMNS)} elements"
+        )
+    blocks = []
+    store, sku = "", ""
+    chunk, empty_rows, position = [], [], 0
+    width = used_columns[-1] + 1
+
+    def flush(block_rows, first_position, last_row):
+        nonlocal store, sku
+        data = pd.DataFrame(
+            block_rows, columns=INVENTORY_COLUMNS, index=range(first_position, first_position + len(block_rows)),
+            dtype=object,
+        )
+        block, store, sku = _inventory_block(data, store=store, sku=sku, last_row=last_row)
+        blocks.append(_finish_inventory_table(block))
+
+    for n, row in enumerate(rows):
+        if any(value is not None for value in row[width:]) or any(
+            row[i] is not None for i in range(min(width, len(row))) if i not in used_columns
+        ):
+            raise _ColumnsChanged
+        if n < 3:  # data.drop(index=data.index[:3])
+            continue
+        values = [row[i] if i < len(row) else None for i in used_columns]
+        if all(value is None for value in values):
+            empty_rows.append(values)  # trailing empty rows are dropped, as pd.read_excel does
+            continue
+        chunk.extend(empty_rows)
+        empty_rows = []
+        chunk.append(values)
+        if len(chunk) > chunk_rows:
+            # keep the last row back: it may turn out to be the last row of the report
+            flush(chunk[:-1], position, last_row=False)
+            position += len(chunk) - 1
+            chunk = chunk[-1:]
+    flush(chunk, position, last_row=True)
+    return blocks
+
+
+def read_inventory_report(file, chunk_rows=INVENTORY_CHUNK_ROWS):
+    """
+    Stream a 1C inventory workbook and return the same table as
+    make_flat_table_inv(pd.read_excel(file)).
+
+    The workbook is opened in openpyxl read-only mode and parsed in blocks of
+    chunk_rows rows, so only the dated rows of the report are kept in memory.
+    Empty columns are detected on the first block; if a later row turns out to
+    use another column the sheet is read a second time with the exact column set.
+    """
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = _sheet_rows(sheet)
+        head = list(itertools.islice(rows, chunk_rows))
+        used_columns = _used_columns(head)
+        try:
+            if len(used_columns) < len(INVENTORY_COLUMNS):
+                raise _ColumnsChanged  # a column may be empty in the first block only
+            blocks = _parse_inventory_rows(itertools.chain(head, rows), used_columns, chunk_rows)
+        except _ColumnsChanged:
+            blocks = _parse_inventory_rows(_sheet_rows(sheet), _used_columns(_sheet_rows(sheet)), chunk_rows)
+    finally:
+        workbook.close()
+
+    return pd.concat([block for block in blocks if len(block)] or blocks[:1])
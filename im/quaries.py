@@ -1,69 +1,88 @@
-from django.db.models import Sum, F, Avg
-from datetime import date
-from .models import Sale, Inventory, WorkingDays, Product
+from django.db.models import Sum, F, Avg, Count, Max
+from django.db.models.functions import ExtractMonth
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from .models import Sale, Inventory, WorkingDays, Product, DailySales, ProductSalesRanking
+from .utils_inventory import get_weighted_av_inventory, DEFAULT_STORE_GROUPS
+
+
+def year_range(year: int) -> tuple:
+    """Half-open [first day, first day of the next year) range, usable by date indexes."""
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+def month_range(year: int, month: int) -> tuple:
+    """Half-open [first day, first day of the next month) range, usable by date indexes."""
+    if month == 12:
+        return date(year, 12, 1), date(year + 1, 1, 1)
+    return date(year, month, 1), date(year, month + 1, 1)
+
+def get_working_days_per_month(year: int) -> list:
+    """
+    Number of working days in every month of the year, from one grouped query.
+    Example return:
+        [17, 20, 20, 22, 18, 19, 23, 22, 21, 23, 20, 22]
+    """
+    start, end = year_range(year)
+    counts = dict(
+        WorkingDays.objects.filter(date__gte=start, date__lt=end)
+        .annotate(month=ExtractMonth('date'))
+        .values('month')
+        .annotate(n_days=Count('id'))
+        .values_list('month', 'n_days')
+    )
+    return [counts.get(month, 0) for month in range(1, 13)]
 
 
-def get_top_products_by_sales(n_top=10):
-    start_date = date(2024, 1, 1)
-    end_date   = date(2024, 11, 30)
+def get_latest_sales_date():
+    """Last day with sales in the DailySales rollup, today when there are none."""
+    return DailySales.objects.aggregate(latest=Max('date'))['latest'] or date.today()
+
+def get_top_products_by_sales(n_top=10, start_date=None, end_date=None):
+    """
+    Best selling products by sales value over a period. Without dates they are read
+    from the precomputed ranking of the year of the latest sales, otherwise
+    aggregated from the DailySales rollup.
+    Args:
+        n_top (int): number of products
+        start_date (date): first day of the period, one year before end_date by default
+        end_date (date): last day of the period, the latest sales date by default
+    Returns:
+        QuerySet: dicts with 'product__id', 'product__sku' and 'total_sales_volume'.
+    """
+    if start_date is None and end_date is None:
+        return (
+            ProductSalesRanking.objects.filter(year=get_latest_sales_date().year, month=0, location='')
+            .order_by('-sale_value', 'product_id')
+            .values('product__id', 'product__sku', total_sales_volume=F('sale_value'))[:n_top]
+        )
+    end_date = end_date or get_latest_sales_date()
+    start_date = start_date or end_date - timedelta(days=364)
     top_products = (
-        Sale.objects.filter(sale_date__range=(start_date, end_date))
-        #Sale.objects.filter(sale_date__year=year, sale_date__month=month)
+        DailySales.objects.filter(date__range=(start_date, end_date))
         .values('product__id', 'product__sku')
         .annotate(
             #total_sales_volume=Sum(F('quantity') * F('product__volume'))  # Multiply quantity by product volume
             total_sales_volume=Sum('sale_value')  # Multiply quantity by product volume
         )
         .order_by('-total_sales_volume')[:n_top]  # Order by total sales volume
-        # to extract only a list of SKUs
-        #.values_list('product__sku', flat=True)  # Extract only the SKU values
     )
     return top_products
 
 def get_product_sales(product, year, month=0):
-    if month != 0:
-        # Aggregate total sales across all stores
-        total_sales = Sale.objects.filter(
-            product=product,
-            sale_date__year=year,
-            sale_date__month=month
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
-
-        # Aggregate total sales for Novosibirsk
-        total_sales_nsk = Sale.objects.filter(
-            product=product,
-            store__location="novosibirsk",
-            sale_date__year=year,
-            sale_date__month=month
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
-
-        # Aggregate total sales for Kemerovo
-        total_sales_kem = Sale.objects.filter(
-            product=product,
-            store__location="kemerovo",
-            sale_date__year=year,
-            sale_date__month=month
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
-    else:
-        # Aggregate total sales across all stores
-        total_sales = Sale.objects.filter(
-            product=product,
-            sale_date__year=year,
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
-
-        # Aggregate total sales for Novosibirsk
-        total_sales_nsk = Sale.objects.filter(
-            product=product,
-            store__location="novosibirsk",
-            sale_date__year=year,
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
+    # Sales of the product in the month (or the whole year for month=0), from the DailySales rollup
+    start, end = month_range(year, month) if month != 0 else year_range(year)
+    sales_data = (
+        DailySales.objects.filter(product=product, date__gte=start, date__lt=end)
+        .values('store__location')
+        .annotate(total_sales_quantity=Sum('quantity'))
+    )
+    by_location = {sale['store__location']: sale['total_sales_quantity'] or 0 for sale in sales_data}
 
-        # Aggregate total sales for Kemerovo
-        total_sales_kem = Sale.objects.filter(
-            product=product,
-            store__location="kemerovo",
-            sale_date__year=year,
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
+    # Aggregate total sales across all stores, for Novosibirsk and for Kemerovo
+    total_sales = sum(by_location.values())
+    total_sales_nsk = by_location.get("novosibirsk", 0)
+    total_sales_kem = by_location.get("kemerovo", 0)
 
     # Return results as a tuple
     return total_sales, total_sales_nsk, total_sales_kem
@@ -79,10 +98,12 @@ def get_sales_all_months(year):
     # Pre-fetch product weights into a dictionary for quick lookup
     product_weights = {product.id: product.weight for product in Product.objects.all()}
     
-    # Fetch sales data grouped by month, product, and location
+    # Fetch sales data from the DailySales rollup, grouped by month, product, and location
+    start, end = year_range(year)
     sales_data = (
-        Sale.objects.filter(sale_date__year=year)
-        .values('sale_date__month', 'product', 'store__location')
+        DailySales.objects.filter(date__gte=start, date__lt=end)
+        .annotate(month=ExtractMonth('date'))
+        .values('month', 'product', 'store__location')
         .annotate(total_sales_quantity=Sum('quantity'))
     )
     
@@ -93,7 +114,7 @@ def get_sales_all_months(year):
     
     # Process the aggregated sales data
     for sale in sales_data:        
-        month = sale['sale_date__month'] - 1  # Convert month to zero-indexed
+        month = sale['month'] - 1  # Convert month to zero-indexed
         product_id = sale['product']
         location = sale['store__location']
         sales_quantity = sale['total_sales_quantity'] or 0
@@ -108,24 +129,24 @@ def get_sales_all_months(year):
         elif location == 'kemerovo':
             total_sales_kem['sales'][month] += weighted_sales
     
-    for i in range(1, 13):
-        wd_in_month = len(WorkingDays.objects.filter(date__month=i, date__year=year))
-        total_sales['av_sales'][i-1] = total_sales['sales'][i-1] / wd_in_month
-        total_sales_nsk['av_sales'][i-1] = total_sales_nsk['sales'][i-1] / wd_in_month
-        total_sales_kem['av_sales'][i-1] = total_sales_kem['sales'][i-1] / wd_in_month
+    for i, wd_in_month in enumerate(get_working_days_per_month(year)):
+        total_sales['av_sales'][i] = total_sales['sales'][i] / wd_in_month
+        total_sales_nsk['av_sales'][i] = total_sales_nsk['sales'][i] / wd_in_month
+        total_sales_kem['av_sales'][i] = total_sales_kem['sales'][i] / wd_in_month
 
     return total_sales, total_sales_nsk, total_sales_kem
 
 def get_sales_all_months2(year):
     total_sales_list = []; total_sales_nsk_list = [];     total_sales_kem_list = []
     for i in range(1, 13):
+        start, end = month_range(year, i)
         # Aggregate total sales across all stores
         sales_month = 0
         for product in Product.objects.all():
             total_sales = Sale.objects.filter(
                 product=product,
-                sale_date__year=year,
-                sale_date__month=i,
+                sale_date__gte=start,
+                sale_date__lt=end,
             ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
             sales_month += total_sales * product.weight
         total_sales_list.append(sales_month * product.weight )
@@ -136,8 +157,8 @@ def get_sales_all_months2(year):
             total_sales = Sale.objects.filter(
                 product=product,
                 store__location='novosibirsk',
-                sale_date__year=year,
-                sale_date__month=i,
+                sale_date__gte=start,
+                sale_date__lt=end,
             ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
             sales_month += total_sales * product.weight
         total_sales_nsk_list.append(sales_month * product.weight )
@@ -148,8 +169,8 @@ def get_sales_all_months2(year):
             total_sales = Sale.objects.filter(
                 product=product,
                 store__location='kemerovo',
-                sale_date__year=year,
-                sale_date__month=i,
+                sale_date__gte=start,
+                sale_date__lt=end,
             ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
             sales_month += total_sales * product.weight
         total_sales_kem_list.append(sales_month * product.weight )
@@ -157,198 +178,120 @@ def get_sales_all_months2(year):
     return total_sales_list, total_sales_nsk_list, total_sales_kem_list
 
 def get_product_sales_all_months(product, year):
+    # Monthly sales of the product by location, from the DailySales rollup
+    start, end = year_range(year)
+    sales_data = (
+        DailySales.objects.filter(product=product, date__gte=start, date__lt=end)
+        .annotate(month=ExtractMonth('date'))
+        .values('month', 'store__location')
+        .annotate(total_sales_quantity=Sum('quantity'))
+    )
+    sales = [0] * 12; sales_nsk = [0] * 12; sales_kem = [0] * 12
+    for sale in sales_data:
+        month = sale['month'] - 1
+        sales_quantity = sale['total_sales_quantity'] or 0
+        sales[month] += sales_quantity
+        if sale['store__location'] == 'novosibirsk':
+            sales_nsk[month] += sales_quantity
+        elif sale['store__location'] == 'kemerovo':
+            sales_kem[month] += sales_quantity
+
     total_sales_list = {'sales': [], 'av_sales': []}
     total_sales_nsk_list = {'sales': [], 'av_sales': []}
     total_sales_kem_list = {'sales': [], 'av_sales': []}
-    for i in range(1, 13):
-        wd_in_month = len(WorkingDays.objects.filter(date__month=i, date__year=year))
-
-        # Aggregate total sales across all stores
-        total_sales = Sale.objects.filter(
-            product=product,
-            sale_date__year=year,
-            sale_date__month=i,
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
-        total_sales_list['sales'].append(total_sales)
-        total_sales_list['av_sales'].append(total_sales / wd_in_month)
-
-        # Aggregate total sales for Novosibirsk
-        total_sales_nsk = Sale.objects.filter(
-            product=product,
-            store__location="novosibirsk",
-            sale_date__year=year,     
-            sale_date__month=i,       
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
-        total_sales_nsk_list['sales'].append(total_sales_nsk)
-        total_sales_nsk_list['av_sales'].append(total_sales_nsk / wd_in_month)
-
-        # Aggregate total sales for Kemerovo
-        total_sales_kem = Sale.objects.filter(
-            product=product,
-            store__location="kemerovo",
-            sale_date__year=year,
-            sale_date__month=i,
-        ).aggregate(total_sales_quantity=Sum('quantity'))['total_sales_quantity'] or 0
-        total_sales_kem_list['sales'].append(total_sales_kem)    
-        total_sales_kem_list['av_sales'].append(total_sales_kem / wd_in_month)
+    for i, wd_in_month in enumerate(get_working_days_per_month(year)):
+        total_sales_list['sales'].append(sales[i])
+        total_sales_list['av_sales'].append(sales[i] / wd_in_month)
+        total_sales_nsk_list['sales'].append(sales_nsk[i])
+        total_sales_nsk_list['av_sales'].append(sales_nsk[i] / wd_in_month)
+        total_sales_kem_list['sales'].append(sales_kem[i])
+        total_sales_kem_list['av_sales'].append(sales_kem[i] / wd_in_month)
 
     # Return results as a tuple
     return total_sales_list, total_sales_nsk_list, total_sales_kem_list
 
-def get_weighted_av_inventory_all_months(product, year: int) -> list:
+def get_product_timeseries(product, years) -> dict:
     """
-    Returns a list of weighted average inventory of a given product and year
-    based on the working days and inventory levels.
+    Monthly series of one product for the product page, loaded with grouped
+    queries: daily sales by location, working days and the inventory engine.
+    Args:
+        product (Product): the product
+        years (list): years of interest, e.g. [2023, 2024]
+    Returns:
+        dict: per year and location ('total', 'novosibirsk', 'kemerovo') 12 monthly values of
+              'sales', 'av_sales' (per working day, 0 for months without working days),
+              'cum_sales' and 'inventory' (weighted average over the working days).
+    Example return:
+        {2024: {'total': {'sales': [120, ...], 'av_sales': [6.0, ...], 'cum_sales': [120, ...], 'inventory': [310.5, ...]},
+                'novosibirsk': {...}, 'kemerovo': {...}}}
     """
-    av_inv_list_nsk = []; av_inv_list_kem = []; av_inv_list = []
-    
-    for month in range(1, 13):  # Loop through each month
-        # Get all working days for the month
-        working_days = list(WorkingDays.objects.filter(date__year=year, date__month=month).order_by('date').values_list('date', flat=True))
-        
-        # Get all inventory records for the month, sorted by date
-        inventory_records_nsk_main = (
-            Inventory.objects.filter(
-                product=product,
-                store__name='Novosibirsk Main',
-                date__year=year,
-                date__month=month,
-            )
-            .values('date')
-            .annotate(avg_inventory=Sum('inventory_level'))
-            .order_by('date')
-        )
-        inventory_records_nsk_reserve = (
-            Inventory.objects.filter(
-                product=product,
-                store__name='Novosibirsk Reserve',
-                date__year=year,
-                date__month=month,
-            )
-            .values('date')
-            .annotate(avg_inventory=Sum('inventory_level'))
-            .order_by('date')
-        )
-        inventory_records_kem = (
-            Inventory.objects.filter(
-                product=product,
-                store__name='Kemerovo Main',
-                date__year=year,
-                date__month=month,
-            )
-            .values('date')
-            .annotate(avg_inventory=Sum('inventory_level'))
-            .order_by('date')
+    first_year, last_year = min(years), max(years)
+    n_months = (last_year - first_year + 1) * 12
+    start, end = year_range(first_year)[0], year_range(last_year)[1]
+
+    def month_index(days):
+        days = pd.DatetimeIndex(days)
+        return ((days.year - first_year) * 12 + days.month - 1).to_numpy()
+
+    # Monthly sales by location
+    sales_data = pd.DataFrame(
+        list(
+            DailySales.objects.filter(product=product, date__gte=start, date__lt=end)
+            .values('date', 'store__location')
+            .annotate(total_sales_quantity=Sum('quantity'))
+            .values_list('date', 'store__location', 'total_sales_quantity')
+        ),
+        columns=['date', 'location', 'quantity'],
+    )
+    sales_months = month_index(sales_data['date'])
+    sales = {
+        'total': np.bincount(sales_months, weights=sales_data['quantity'], minlength=n_months),
+    }
+    for location in DEFAULT_STORE_GROUPS:
+        is_location = (sales_data['location'] == location).to_numpy()
+        sales[location] = np.bincount(
+            sales_months[is_location], weights=sales_data['quantity'][is_location], minlength=n_months
         )
-        
-        # Map inventory records to their dates
-        inventory_map_nsk_main =    {record['date']: record['avg_inventory'] for record in inventory_records_nsk_main}
-        inventory_map_nsk_reserve = {record['date']: record['avg_inventory'] for record in inventory_records_nsk_reserve}
-        inventory_map_kem = {record['date']: record['avg_inventory'] for record in inventory_records_kem}
 
-        # Initialize variables for weighted average calculation
-        total_weighted_inventory = 0
-        total_days = len(working_days)
-        
-        # Novosibirsk Main
-        current_inventory_level = 0
-        last_inventory_date = None
-        for day in working_days:
-            if day in inventory_map_nsk_main:  # If there's an inventory record for this day
-                current_inventory_level = inventory_map_nsk_main[day]
-                last_inventory_date = day
-            
-            # Use the current inventory level for this day
-            total_weighted_inventory += current_inventory_level
-        
-        # Novosibirsk Reserve
-        current_inventory_level = 0
-        for day in working_days:
-            if day in inventory_map_nsk_reserve:  # If there's an inventory record for this day
-                current_inventory_level = inventory_map_nsk_reserve[day]
-                last_inventory_date = day
-            
-            # Use the current inventory level for this day
-            total_weighted_inventory += current_inventory_level        
-
-        # Calculate the weighted average for the month
-        weighted_average = total_weighted_inventory / total_days if total_days > 0 else 0
-        av_inv_list_nsk.append(weighted_average)
-
-        # Kemerovo
-        total_weighted_inventory_kem = 0
-        current_inventory_level = 0
-        for day in working_days:
-            if day in inventory_map_kem:  # If there's an inventory record for this day
-                current_inventory_level = inventory_map_kem[day]
-                last_inventory_date = day
-            
-            # Use the current inventory level for this day
-            total_weighted_inventory_kem += current_inventory_level        
-
-        # Calculate the weighted average for the month
-        weighted_average_kem = total_weighted_inventory_kem / total_days if total_days > 0 else 0
-        av_inv_list_kem.append(weighted_average_kem)
+    # Working days of every month
+    working_days = list(
+        WorkingDays.objects.filter(date__gte=start, date__lt=end).order_by('date').values_list('date', flat=True)
+    )
+    day_months = month_index(working_days)
+    wd_in_month = np.bincount(day_months, minlength=n_months)
+
+    # Weighted average inventory over the working days of every month
+    inventory = get_weighted_av_inventory(years, products=[product])
+
+    timeseries = {}
+    for year in years:
+        months = slice((year - first_year) * 12, (year - first_year + 1) * 12)
+        timeseries[year] = {}
+        for location in ('total', *DEFAULT_STORE_GROUPS):
+            year_sales = sales[location][months]
+            av_sales = np.divide(
+                year_sales, wd_in_month[months], out=np.zeros(12), where=wd_in_month[months] > 0
+            )
+            timeseries[year][location] = {
+                'sales': year_sales.astype(np.int64).tolist(),
+                'av_sales': av_sales.tolist(),
+                'cum_sales': np.cumsum(year_sales).astype(np.int64).tolist(),
+                'inventory': inventory[year][location],
+            }
+    return timeseries
 
-        # total
-        av_inv_list.append(weighted_average + weighted_average_kem)
-    
-    return av_inv_list, av_inv_list_nsk, av_inv_list_kem
+def get_weighted_av_inventory_all_months(product, year: int) -> list:
+    """
+    Returns a list of weighted average inventory of a given product and year
+    based on the working days and inventory levels.
+    """
+    averages = get_weighted_av_inventory([year], products=[product])[year]
+    return averages['total'], averages['novosibirsk'], averages['kemerovo']
 
 def get_weighted_av_inventory_all_months_all_products(year: int) -> tuple:
     """
     Returns lists of weighted average inventory (total, Novosibirsk, and Kemerovo) 
     for all products for a given year based on working days and inventory levels.
     """
-    from collections import defaultdict
-
-    av_inv_list = []  # Total weighted average inventory
-    av_inv_list_nsk = []  # Novosibirsk (Main + Reserve) weighted average inventory
-    av_inv_list_kem = []  # Kemerovo weighted average inventory
-
-    # Loop through each month
-    for month in range(1, 13):
-        # Get all working days for the month
-        working_days = list(
-            WorkingDays.objects.filter(date__year=year, date__month=month)
-            .order_by("date")
-            .values_list("date", flat=True)
-        )
-
-        # Fetch inventory records for all relevant stores
-        inventory_records = Inventory.objects.filter(
-            date__year=year, date__month=month
-        ).values("store__name", "date").annotate(avg_inventory=Sum("inventory_level"))
-
-        # Group inventory records by store
-        inventory_map = defaultdict(dict)
-        for record in inventory_records:
-            inventory_map[record["store__name"]][record["date"]] = record["avg_inventory"]
-
-        # Stores to process
-        stores = {
-            "Novosibirsk Main": {"total": 0, "current_level": 0},
-            "Novosibirsk Reserve": {"total": 0, "current_level": 0},
-            "Kemerovo Main": {"total": 0, "current_level": 0},
-        }
-
-        total_days = len(working_days)
-
-        # Process inventory for each working day
-        for day in working_days:
-            for store_name, store_data in stores.items():
-                if day in inventory_map[store_name]:
-                    store_data["current_level"] = inventory_map[store_name][day]
-                store_data["total"] += store_data["current_level"]
-
-        # Calculate weighted averages for each store
-        weighted_nsk_main = stores["Novosibirsk Main"]["total"] / total_days if total_days > 0 else 0
-        weighted_nsk_reserve = stores["Novosibirsk Reserve"]["total"] / total_days if total_days > 0 else 0
-        weighted_kem = stores["Kemerovo Main"]["total"] / total_days if total_days > 0 else 0
-
-        # Append results
-        av_inv_list_nsk.append(weighted_nsk_main + weighted_nsk_reserve)
-        av_inv_list_kem.append(weighted_kem)
-        av_inv_list.append(weighted_nsk_main + weighted_nsk_reserve + weighted_kem)
-
-    return av_inv_list, av_inv_list_nsk, av_inv_list_kem
+    averages = get_weighted_av_inventory([year])[year]
+    return averages['total'], averages['novosibirsk'], averages['kemerovo']
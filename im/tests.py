@@ -1,3 +1,769 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from scipy.stats import kruskal
+from statsmodels.tsa.seasonal import seasonal_decompose
+
+from .models import (
+    CurrentInventory, DailySales, DemandForecast, Inventory, Job, Product, ProductClassification, ProductSalesRanking, ProductStatistics,
+    ProductStoreStatistics, Store, WorkingDays,
+)
+from .quaries import get_product_timeseries
+from .process_excel import make_flat_table, make_flat_table_inv, read_inventory_report, INVENTORY_CHUNK_ROWS
+from .utils import iter_demand_scenarios, simulate_demand_batch
+from .utils_cache import get_cache_stats, get_data_generation
+from .utils_classification import classify
+from .utils_import import import_inventory, import_sales
+from .utils_inventory import get_weighted_av_inventory
+from .utils_jobs import JOB_HANDLERS, claim_next_job, enqueue_job, run_job
+from .utils_forecast import daily_forecast, forecast_demand, initial_state, refit_forecasts, smooth_seasonal
+from .utils_oracle import BatchOracleAgent
+from .utils_place_order import place_order, write_order_workbook
+from .utils_rollup import rebuild_current_inventory
+from .utils_ranking import get_abc_classes, get_top_products, get_trailing_top_products
+from .utils_policy import compute_policy, order_up_to, simulate_echelon_policy, simulate_policy, sweep_policy_grid
+from .utils_seasonality import kruskal_rows, seasonal_indices
+from .utils_stat import (
+    calculate_sales_global_statistics, calculate_sales_statistics, read_sales_statistics, roll_sales_statistics,
+)
+from .utils_parallel import EXECUTION_MODES, STATISTICS_KEYS, parallel_row_statistics, row_statistics, shared_zeros
+
+
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), 'testdata')
+
+
+class MakeFlatTableTest(SimpleTestCase):
+    def test_matches_golden_file(self):
+        data = pd.read_excel(os.path.join(TESTDATA_DIR, 'sales_report_sample.xlsx'), engine='openpyxl')
+        flat = make_flat_table(data)
+
+        golden = pd.read_csv(
+            os.path.join(TESTDATA_DIR, 'sales_report_sample_flat.csv'), dtype=str, keep_default_na=False
+        )
+        pd.testing.assert_frame_equal(flat.astype(str), golden)
+        self.assertEqual(
+            flat.dtypes.astype(str).tolist(),
+            ['object', 'Int32', 'object', 'object', 'float64', 'float64', 'object'],
+        )
+
+    def test_rows_before_first_header_have_no_store(self):
+        data = pd.read_excel(os.path.join(TESTDATA_DIR, 'sales_report_sample.xlsx'), engine='openpyxl')
+        flat = make_flat_table(data)
+        self.assertEqual(flat.loc[0, 'store'], "")
+        self.assertEqual(flat.loc[0, 'SKU'], "")
+
+
+class InventoryReportTest(SimpleTestCase):
+    def setUp(self):
+        self.path = os.path.join(TESTDATA_DIR, 'inventory_report_sample.xlsx')
+        self.golden = pd.read_csv(
+            os.path.join(TESTDATA_DIR, 'inventory_report_sample_flat.csv'), dtype=str, keep_default_na=False, index_col=0
+        )
+        self.golden.index = self.golden.index.astype(int)
+
+    def test_make_flat_table_inv_matches_golden_file(self):
+        flat = make_flat_table_inv(pd.read_excel(self.path, engine='openpyxl'))
+        pd.testing.assert_frame_equal(flat.astype(str), self.golden, check_index_type=False)
+
+    def test_streaming_reader_matches_golden_file(self):
+        for chunk_rows in (1, 3, INVENTORY_CHUNK_ROWS):
+            flat = read_inventory_report(self.path, chunk_rows=chunk_rows)
+            pd.testing.assert_frame_equal(flat.astype(str), self.golden, check_index_type=False)
+
+    def test_report_with_other_columns_is_an_error(self):
+        workbook = openpyxl.Workbook()
+        for row in range(8):
+            workbook.active.append([f'cell {row}', row, row])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'report.xlsx')
+            workbook.save(path)
+            with self.assertRaises(ValueError):
+                read_inventory_report(path, chunk_rows=3)
+
+
+class ParallelRowStatisticsTest(SimpleTestCase):
+    def test_modes_match_serial(self):
+        sales = np.random.default_rng(0).poisson(3.0, size=(11, 3, 40)).astype(np.int64)
+        expected = row_statistics(sales)
+        for mode in EXECUTION_MODES:
+            for workers in (1, 3, 20):
+                result = parallel_row_statistics(sales, mode=mode, workers=workers)
+                for key in STATISTICS_KEYS:
+                    np.testing.assert_array_equal(result[key], expected[key])
+
+    def test_shared_matrix_and_its_prefix(self):
+        sales = shared_zeros((11, 3, 40))
+        sales[...] = np.random.default_rng(0).poisson(3.0, size=sales.shape)
+        for matrix in (sales, sales[:7]):
+            result = parallel_row_statistics(matrix, mode='process', workers=3)
+            np.testing.assert_array_equal(result['sum'], matrix.sum(axis=-1))
+
+
+class ClassifyTest(SimpleTestCase):
+    def test_abc_per_group_and_xyz(self):
+        # group 0: values 70, 20, 10; group 1: one product without sales and one with all of them
+        classes = classify(
+            values=[20, 70, 10, 0, 5],
+            sums=[10, 10, 10, 0, 10],
+            sumsqs=[10, 20, 100, 0, 50],
+            n_days=10,
+            groups=[0, 0, 0, 1, 1],
+        )
+        # shares sold before each product in group 0: 0.7, 0 and 0.9
+        self.assertEqual(classes['abc'].tolist(), ['A', 'A', 'B', 'C', 'A'])
+        np.testing.assert_allclose(classes['value_share'], [0.2, 0.7, 0.1, 0, 1])
+        # daily sales with mean 1 and variances 0, 1, 9, 4
+        np.testing.assert_allclose(classes['cv'], [0, 1, 3, np.nan, 2])
+        self.assertEqual(classes['xyz'].tolist(), ['X', 'Y', 'Z', 'Z', 'Z'])
+
+
+class PolicyTest(SimpleTestCase):
+    def test_safety_stock_from_demand_and_lead_time_variance(self):
+        policy = compute_policy(
+            mean_demand=[10, 10, 0], std_demand=[0, 4, 4], lead_time_mean=4, lead_time_std=[1, 0, 1],
+            cycle_days=30, service_level=0.975,
+        )
+        # lead time demand std: sqrt(4 * 0 + 100 * 1), sqrt(4 * 16 + 0), sqrt(4 * 16 + 0)
+        np.testing.assert_allclose(policy['safety_stock'], 1.959964 * np.array([10, 8, 8]), rtol=1e-6)
+        np.testing.assert_allclose(policy['s'], policy['lead_time_demand'] + policy['safety_stock'])
+        np.testing.assert_allclose(policy['S'] - policy['s'], [300, 300, 0])
+
+    def test_order_only_at_or_below_reorder_point(self):
+        np.testing.assert_array_equal(order_up_to([50, 51, -5], s=50, S=200), [150, 0, 205])
+
+
+class SimulateDemandBatchTest(SimpleTestCase):
+    def test_seeded_and_independent_of_chunk_size(self):
+        means, stds = [0, 2, 5], [0, 1, 4]  # no demand, Poisson fallback, negative binomial
+        demand = simulate_demand_batch(means, stds, n_periods=20, n_scenarios=7, seed=42)
+        self.assertEqual(demand.shape, (7, 3, 20))
+        self.assertFalse(demand[:, 0].any())
+        chunks = list(iter_demand_scenarios(means, stds, 20, 7, seed=42, max_values=120))
+        self.assertEqual([first for first, _ in chunks], [0, 2, 4, 6])
+        np.testing.assert_array_equal(np.concatenate([chunk for _, chunk in chunks]), demand)
+
+    def test_means_follow_parameters(self):
+        demand = simulate_demand_batch([3, 10], [3, 2], n_periods=1000, n_scenarios=20, seed=0)
+        np.testing.assert_allclose(demand.mean(axis=(0, 2)), [3, 10], rtol=0.02)
+        np.testing.assert_allclose(demand.std(axis=(0, 2)), [3, 10 ** 0.5], rtol=0.03)
+
+
+class SimulatePolicyTest(SimpleTestCase):
+    def test_replay_with_fixed_lead_time(self):
+        # SKU 0 reorders before running out, SKU 1 starts empty and is always short
+        result = simulate_policy(
+            demand=np.full((2, 7), 5), initial_inventory=[10, 0], s=[10, 0], S=[30, 4], pack_size=[1, 1],
+            lead_time_mean=2,
+        )
+        np.testing.assert_array_equal(result['sold'], [35, 12])
+        np.testing.assert_array_equal(result['lost'], [0, 23])
+        np.testing.assert_array_equal(result['stockout_days'], [0, 7])
+        np.testing.assert_array_equal(result['orders'], [2, 4])
+        np.testing.assert_array_equal(result['ordered'], [45, 16])
+        np.testing.assert_allclose(result['fill_rate'], [1, 12 / 35])
+        np.testing.assert_allclose(result['average_inventory'], [75 / 7, 0])
+
+
+class SimulateEchelonPolicyTest(SimpleTestCase):
+    def test_branch_is_replenished_from_hub_stock(self):
+        # SKU 0: the hub ships to the branch what it has; SKU 1: the hub counts the branch stock
+        hub = {
+            'demand': np.zeros((2, 4)), 'initial_inventory': np.array([20., 0.]), 's': np.array([0., 10.]),
+            'S': np.array([0., 30.]), 'pack_size': np.ones(2), 'pack_threshold': np.full(2, 0.4),
+            'lead_time_mean': 2.0, 'lead_time_std': 0.0,
+        }
+        branch = {
+            'demand': np.array([[5.] * 4, [0.] * 4]), 'initial_inventory': np.array([0., 25.]),
+            's': np.array([5., 0.]), 'S': np.array([15., 0.]), 'pack_size': np.ones(2),
+            'pack_threshold': np.full(2, 0.4), 'lead_time_mean': 1.0, 'lead_time_std': 0.0,
+        }
+        result = simulate_echelon_policy(hub, branch)
+        np.testing.assert_array_equal(result['kem']['sold'], [15, 0])
+        np.testing.assert_array_equal(result['kem']['lost'], [5, 0])
+        np.testing.assert_array_equal(result['kem']['ordered'], [20, 0])
+        np.testing.assert_array_equal(result['kem']['orders'], [2, 0])
+        np.testing.assert_allclose(result['kem']['average_inventory'], [5, 25])
+        np.testing.assert_allclose(result['nsk']['average_inventory'], [2.5, 0])
+        np.testing.assert_array_equal(result['nsk']['orders'], [0, 0])
+
+
+class SweepPolicyGridTest(SimpleTestCase):
+    def test_cheapest_setting_meeting_fill_rate(self):
+        inputs = {
+            'demand': np.array([[[5] * 20, [0] * 20]]), 'initial_inventory': np.array([10., 0.]),
+            'mean_demand': np.array([5., 0.]), 'std_demand': np.zeros(2), 'lead_time_demand': np.full(2, np.nan),
+            'service_level': np.full(2, 0.5), 'pack_size': np.ones(2), 'weights': np.ones(2),
+            'lost_demand_cost': np.zeros(2), 'lead_time_mean': 1.0, 'lead_time_std': 0.0,
+            'holding_cost_kg': 1.0, 'ordering_cost_kg': 0.0,
+        }
+        # the branch has no demand, so the hub serves its own
+        branch = {
+            **inputs, 'demand': np.zeros((1, 2, 20)), 'initial_inventory': np.zeros(2), 'mean_demand': np.zeros(2),
+        }
+        best = sweep_policy_grid({'nsk': inputs, 'kem': branch}, [10, 2], [0.4], min_fill_rate=0.95)
+        # both settings serve all the demand, the shorter cycle holds less stock
+        np.testing.assert_array_equal(best['S_days'], [2, 10])
+        np.testing.assert_array_equal(best['fill_rate'], [1, 1])
+        np.testing.assert_array_equal(best['demand'], [100, 0])
+
+
+class SeasonalityRowsTest(SimpleTestCase):
+    def test_matches_scipy_and_statsmodels(self):
+        rng = np.random.default_rng(0)
+        series = np.vstack([
+            rng.poisson(5, 36) + np.tile(np.arange(12), 3),  # seasonal
+            rng.poisson(2, 36),  # with ties
+            np.round(rng.normal(10, 2, 36), 1),
+        ]).astype(np.float64)
+        months = np.arange(36) % 12
+        stats, p_values = kruskal_rows(series, months)
+        indices = seasonal_indices(series)
+        for i, row in enumerate(series):
+            expected = kruskal(*[row[months == month] for month in range(12)])
+            self.assertAlmostEqual(stats[i], expected.statistic)
+            self.assertAlmostEqual(p_values[i], expected.pvalue)
+            decomposition = seasonal_decompose(row, model='additive', period=12)
+            np.testing.assert_allclose(indices[i], decomposition.seasonal[:12])
+
+    def test_constant_series_has_no_test(self):
+        stats, p_values = kruskal_rows(np.zeros((1, 24)), np.arange(24) % 12)
+        self.assertTrue(np.isnan(stats[0]) and np.isnan(p_values[0]))
+
+
+class ForecastTest(SimpleTestCase):
+    def test_incremental_smoothing_matches_full_history(self):
+        rng = np.random.default_rng(0)
+        values = rng.poisson(5, (4, 30)) + np.tile(np.arange(12), 3)[:30]
+        # the history starts in March
+        state = initial_state(values, 2)
+        full = smooth_seasonal(values, *state, 2)
+        carried = smooth_seasonal(values[:, 27:], *smooth_seasonal(values[:, :27], *state, 2), (2 + 27) % 12)
+        for expected, actual in zip(full, carried):
+            np.testing.assert_allclose(actual, expected)
+
+    def test_lead_time_demand_follows_the_season(self):
+        seasonal = np.zeros((1, 12))
+        seasonal[0, 1] = 2.0  # February
+        forecasts = daily_forecast(np.array([3.0]), seasonal, date(2025, 1, 30), horizon=5)
+        np.testing.assert_allclose(forecasts, [[3, 3, 5, 5, 5]])
+        np.testing.assert_allclose(forecast_demand(forecasts, [1], 2.5), [3 + 5 + 2.5])
+        # past the horizon the last day repeats
+        np.testing.assert_allclose(forecast_demand(forecasts, [4], 3), [15])
+
+    def test_policy_uses_forecast_where_given(self):
+        policy = compute_policy(
+            np.array([10.0, 10.0]), np.zeros(2), 3.0, 0.0, 0.0, 0.5, lead_time_demand=np.array([45.0, np.nan]),
+        )
+        np.testing.assert_allclose(policy['lead_time_demand'], [45, 30])
+
+
+def create_store(name, location=None, lead_time_mean=3.0):
+    return Store.objects.create(
+        name=name, location=location, capacity=1000, lead_time_mean=lead_time_mean, lead_time_std=1.0,
+        container_cost=100, container_capacity=60, ordering_cost_kg=1.0, holding_cost_kg=0.01,
+    )
+
+
+def create_product(sku, **fields):
+    return Product.objects.create(sku=sku, name=f"Product {sku}", weight=1.0, volume=0.01, **fields)
+
+
+class ImportInventoryTest(TestCase):
+    def setUp(self):
+        self.store = create_store('Kemerovo Main', 'kemerovo')
+        self.product = create_product('1021')
+
+    def test_aliased_warehouses_are_summed_and_reimport_is_idempotent(self):
+        # 'Оптовый Кемерово' and 'Оптовый' are both Kemerovo Main
+        df = pd.DataFrame({
+            'SKU': ['1021', '1021', '1021'],
+            'store': ['Kemerovo Main'] * 3,
+            'date': [date(2024, 1, 9), date(2024, 1, 9), date(2024, 1, 10)],
+            'end': [8, 5, 4],
+        })
+        first = import_inventory(df)
+        second = import_inventory(df)
+
+        self.assertEqual((first['inserted'], first['updated']), (2, 0))
+        self.assertEqual((second['inserted'], second['updated'], second['unchanged']), (0, 0, 2))
+        levels = dict(Inventory.objects.values_list('date', 'inventory_level'))
+        self.assertEqual(levels, {date(2024, 1, 9): 13, date(2024, 1, 10): 4})
+        current = CurrentInventory.objects.get(product=self.product, store=self.store)
+        self.assertEqual((current.date, current.inventory_level), (date(2024, 1, 10), 4))
+
+        updated = import_inventory(df.assign(end=[8, 6, 4]))
+        self.assertEqual((updated['updated'], updated['unchanged']), (1, 1))
+        self.assertEqual(Inventory.objects.get(date=date(2024, 1, 9)).inventory_level, 14)
+
+
+class JobQueueTest(TestCase):
+    def test_enqueue_claim_and_run(self):
+        first = enqueue_job(Job.STATISTICS, {'mode': 'full'})
+        second = enqueue_job(Job.ORDER)
+        handler = mock.Mock(return_value={'products': 3})
+        with mock.patch.dict(JOB_HANDLERS, {Job.STATISTICS: handler}):
+            job = claim_next_job()
+            self.assertEqual((job.pk, job.status), (first.pk, Job.RUNNING))
+            self.assertEqual(claim_next_job().pk, second.pk)
+            self.assertIsNone(claim_next_job())
+            run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress, job.result), (Job.DONE, 1.0, {'products': 3}))
+
+    def test_failing_handler_and_unsaveable_result_fail_the_job(self):
+        for handler in (mock.Mock(side_effect=ValueError("bad file")), mock.Mock(return_value={'value': object()})):
+            enqueue_job(Job.STATISTICS)
+            with mock.patch.dict(JOB_HANDLERS, {Job.STATISTICS: handler}):
+                job = run_job(claim_next_job())
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.FAILED)
+            self.assertIsNone(job.result)
+            self.assertTrue(job.error)
+
+    def test_stale_running_job_is_marked_failed(self):
+        stale = enqueue_job(Job.ORDER)
+        Job.objects.filter(pk=stale.pk).update(status=Job.RUNNING, started_at=timezone.now() - timedelta(days=1))
+        running = enqueue_job(Job.ORDER)
+        Job.objects.filter(pk=running.pk).update(status=Job.RUNNING, started_at=timezone.now())
+        self.assertIsNone(claim_next_job(timeout=timedelta(hours=1)))
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual((stale.status, running.status), (Job.FAILED, Job.RUNNING))
+
+
+class RefitForecastsTest(TestCase):
+    def setUp(self):
+        self.store = create_store('Novosibirsk Main', 'novosibirsk')
+        self.product = create_product('1021')
+        for month, quantity in ((1, 40), (2, 60), (3, 90)):
+            DailySales.objects.create(product=self.product, store=self.store, date=date(2024, month, 10), quantity=quantity)
+        DailySales.objects.create(product=self.product, store=self.store, date=date(2024, 3, 31), quantity=0)
+        self.add_working_days(1, 2)
+
+    def add_working_days(self, *months):
+        WorkingDays.objects.bulk_create([WorkingDays(date=date(2024, month, day)) for month in months for day in (1, 2)])
+
+    def test_months_without_working_days_are_not_fitted(self):
+        result = refit_forecasts(full=True)
+        self.assertEqual(result['last_month'], '2024-02-01')
+        forecast = DemandForecast.objects.get()
+        self.assertEqual(forecast.last_month, date(2024, 2, 1))
+        self.assertEqual(refit_forecasts()['updated'], 0)
+
+        self.add_working_days(3)
+        result = refit_forecasts()
+        self.assertEqual((result['updated'], result['last_month']), (1, '2024-03-01'))
+        carried = DemandForecast.objects.get()
+        # March alone smoothed into the February state: 90 sales over 2 working days
+        self.assertAlmostEqual(carried.level, 0.3 * 45 + 0.7 * forecast.level)
+        self.assertEqual(carried.forecast_start, date(2024, 4, 1))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ImportSalesTest(TestCase):
+    def setUp(self):
+        self.stores = [create_store('Novosibirsk Main', 'novosibirsk'), create_store('Kemerovo Main', 'kemerovo')]
+        self.products = [create_product('1021', S_days=10), create_product('1022', S_days=10)]
+        self.days = [date(2024, 1, day) for day in range(9, 20) if date(2024, 1, day).weekday() < 5]
+        WorkingDays.objects.bulk_create([WorkingDays(date=day) for day in self.days])
+        rng = np.random.default_rng(0)
+        import_sales(self.sales_frame([
+            (product.sku, store.name, day, int(rng.integers(0, 9)))
+            for product in self.products for store in self.stores for day in self.days
+        ]))
+
+    def sales_frame(self, rows):
+        df = pd.DataFrame(rows, columns=['SKU', 'store', 'sale_date', 'quantity'])
+        return df.assign(cost=df['quantity'] * 2.0, sale_value=df['quantity'] * 3.0, client_type='retail')
+
+    def assertStatisticsEqual(self, start_date, end_date):
+        statistics, statistics_global = read_sales_statistics()
+        full = calculate_sales_statistics(start_date, end_date)
+        full_global = calculate_sales_global_statistics(start_date, end_date)
+        for sku, stores in full.items():
+            for store, stat in stores.items():
+                self.assertAlmostEqual(statistics[sku][store]['sales_mean'], stat['sales_mean'])
+                self.assertAlmostEqual(statistics[sku][store]['sales_std'], stat['sales_std'])
+            for key in ('sales_mean', 'sales_std', 'S'):
+                self.assertAlmostEqual(statistics_global[sku][key], full_global[sku][key])
+
+    def test_import_updates_rollup_statistics_ranking_and_cache(self):
+        calculate_sales_statistics(self.days[0], self.days[-1])
+        calculate_sales_global_statistics(self.days[0], self.days[-1])
+        generation = get_data_generation()
+        quantity = DailySales.objects.get(product=self.products[0], store=self.stores[0], date=self.days[2]).quantity
+
+        # two more sales on one day, one on a day outside the window
+        with self.captureOnCommitCallbacks(execute=True):
+            import_sales(self.sales_frame([
+                ('1021', 'Novosibirsk Main', self.days[2], 5),
+                ('1021', 'Novosibirsk Main', self.days[2], 2),
+                ('1022', 'Kemerovo Main', date(2024, 1, 25), 4),
+            ]))
+
+        self.assertGreater(get_data_generation(), generation)
+        daily = DailySales.objects.get(product=self.products[0], store=self.stores[0], date=self.days[2])
+        self.assertEqual((daily.quantity, daily.sale_value), (quantity + 7, (quantity + 7) * 3.0))
+        for product in self.products:
+            ranking = ProductSalesRanking.objects.get(product=product, year=2024, month=0, location='')
+            totals = DailySales.objects.filter(product=product).aggregate(quantity=Sum('quantity'))
+            self.assertEqual(ranking.quantity, totals['quantity'])
+        self.assertStatisticsEqual(self.days[0], self.days[-1])
+
+    def test_rolled_window_matches_full_calculation(self):
+        calculate_sales_statistics(self.days[0], self.days[4])
+        calculate_sales_global_statistics(self.days[0], self.days[4])
+
+        result = roll_sales_statistics(self.days[2], self.days[-1])
+
+        self.assertEqual(result, {'mode': 'incremental', 'days_in': len(self.days) - 5, 'days_out': 2})
+        self.assertStatisticsEqual(self.days[2], self.days[-1])
+
+
+class PlaceOrderTest(TestCase):
+    def setUp(self):
+        self.stores = {
+            name: create_store(name, location)
+            for name, location in (('Novosibirsk Main', 'novosibirsk'), ('Kemerovo Main', 'kemerovo'), ('Other', None))
+        }
+        self.products = [create_product(sku) for sku in ('1021', '1022', '1023', '1024')]
+        for product, store, abc_class in (
+            (self.products[0], 'Novosibirsk Main', 'A'),
+            (self.products[1], 'Novosibirsk Main', 'C'),
+            (self.products[1], 'Kemerovo Main', 'A'),
+            (self.products[2], 'Novosibirsk Main', 'C'),
+            (self.products[3], 'Other', 'A'),
+        ):
+            ProductClassification.objects.create(
+                product=product, store=self.stores[store], abc_class=abc_class, xyz_class='X',
+                window_start=date(2024, 1, 1), window_end=date(2024, 12, 31),
+            )
+
+    def test_abc_filter_uses_the_classes_of_the_sale_stores(self):
+        order, _, _ = place_order(selected_months=[], reference_date=date(2024, 12, 31), abc_classes=['A'])
+        self.assertEqual(order['sku'].tolist(), ['1021', '1022'])
+
+    def test_policy_columns_only_on_request(self):
+        selected_months = [(2024, 12)]
+        order, _, _ = place_order(selected_months=selected_months, reference_date=date(2024, 12, 31))
+        self.assertEqual(order.columns.tolist(), [
+            'sku', 'name', 'manufacturer', 'item_weight', 'order_nsk', 'order_nsk_weight', 'order_kem',
+            'order_kem_weight', 'inv_level', 'inv_level_nsk', 'inv_level_kem', 'sales_dec', 'sales_dec_nsk',
+            'sales_dec_kem',
+        ])
+        order, _, _ = place_order(
+            selected_months=selected_months, reference_date=date(2024, 12, 31), policy_columns=True,
+        )
+        self.assertEqual(
+            order.columns[11:15].tolist(),
+            ['reorder_point_nsk', 'order_up_to_nsk', 'reorder_point_kem', 'order_up_to_kem'],
+        )
+
+
+class TrailingTopProductsTest(TestCase):
+    def test_window_spans_the_turn_of_the_year(self):
+        products = [create_product(sku) for sku in ('1021', '1022', '1023')]
+        for product, year, month, value in (
+            (products[0], 2023, 2, 500),   # before the window
+            (products[0], 2023, 3, 10),
+            (products[1], 2023, 12, 20),
+            (products[1], 2024, 3, 900),   # after the window
+            (products[2], 2024, 2, 15),
+            (products[2], 2024, 0, 1000),  # yearly row
+        ):
+            ProductSalesRanking.objects.create(product=product, year=year, month=month, location='', sale_value=value)
+        top = get_trailing_top_products(None, date(2024, 2, 10))
+        self.assertEqual([(row['product__sku'], row['sale_value']) for row in top], [
+            ('1022', 20), ('1023', 15), ('1021', 10),
+        ])
+
+
+class SimulateDemandViewTest(TestCase):
+    def test_invalid_seed_is_a_bad_request(self):
+        product = create_product('1021')
+        for seed in ('abc', '1.5', '-3'):
+            response = self.client.post(reverse('im:simulate_demand'), {'product_id': product.id, 'seed': seed})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class WeightedAverageInventoryTest(TestCase):
+    def test_snapshots_carry_over_the_working_days_of_their_month(self):
+        stores = [create_store('Novosibirsk Main', 'novosibirsk'), create_store('Kemerovo Main', 'kemerovo')]
+        products = [create_product('1021'), create_product('1022')]
+        WorkingDays.objects.bulk_create([
+            WorkingDays(date=day) for day in (date(2024, 1, 9), date(2024, 1, 10), date(2024, 1, 11), date(2024, 2, 1))
+        ])
+        for product, store, day, level in (
+            (products[0], stores[0], date(2024, 1, 10), 6),
+            (products[1], stores[0], date(2024, 1, 10), 4),
+            (products[0], stores[1], date(2024, 1, 9), 3),
+            (products[0], stores[1], date(2024, 1, 11), 9),
+        ):
+            Inventory.objects.create(product=product, store=store, date=day, inventory_level=level)
+
+        averages = get_weighted_av_inventory([2024])[2024]
+        # January: Novosibirsk 0, 10, 10 and Kemerovo 3, 3, 9; February has no snapshot
+        self.assertAlmostEqual(averages['novosibirsk'][0], 20 / 3)
+        self.assertAlmostEqual(averages['kemerovo'][0], 5)
+        self.assertAlmostEqual(averages['total'][0], 35 / 3)
+        self.assertEqual((averages['total'][1], averages['total'][2]), (0, 0))
+        self.assertAlmostEqual(get_weighted_av_inventory([2024], products=[products[1]])[2024]['total'][0], 8 / 3)
+
+
+class WriteOrderWorkbookTest(SimpleTestCase):
+    def test_workbook_matches_to_excel(self):
+        df = pd.DataFrame({'sku': ['1021', '1022', '1023'], 'order_nsk': [24.0, np.nan, 6.0], 'order_kem': [1, 0, 2]})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'order.xlsx')
+            write_order_workbook(path, {'All Orders': df, 'Kemerovo': df.query('order_kem > 0')}, chunk_rows=2)
+            sheets = pd.read_excel(path, sheet_name=None, dtype={'sku': str})
+        self.assertEqual(list(sheets), ['All Orders', 'Kemerovo'])
+        pd.testing.assert_frame_equal(sheets['All Orders'], df)
+        self.assertEqual(sheets['Kemerovo']['sku'].tolist(), ['1021', '1023'])
+
+
+class InventoryUniqueSnapshotMigrationTest(TransactionTestCase):
+    migrate_from = [('im', '0017_alter_product_sku_alter_store_name')]
+    migrate_to = [('im', '0018_inventory_unique_snapshot')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicate_snapshots_are_not_summed(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        Store, Product, Inventory = (apps.get_model('im', name) for name in ('Store', 'Product', 'Inventory'))
+        store = Store.objects.create(
+            name='Kemerovo Main', capacity=1000, lead_time_mean=3.0, lead_time_std=1.0,
+            container_cost=100, container_capacity=60, ordering_cost_kg=1.0, holding_cost_kg=0.01,
+        )
+        product = Product.objects.create(sku='1021', name='Product 1021', weight=1.0, volume=0.01)
+        # the same report uploaded twice, then a corrected snapshot of the 9th
+        for day, level in ((date(2024, 1, 9), 8), (date(2024, 1, 10), 4), (date(2024, 1, 9), 8),
+                           (date(2024, 1, 10), 4), (date(2024, 1, 9), 7)):
+            Inventory.objects.create(product=product, store=store, date=day, inventory_level=level)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        Inventory = executor.loader.project_state(self.migrate_to).apps.get_model('im', 'Inventory')
+        levels = dict(Inventory.objects.values_list('date', 'inventory_level'))
+        self.assertEqual(levels, {date(2024, 1, 9): 7, date(2024, 1, 10): 4})
+
+
+class SalesStatisticsTest(TestCase):
+    def test_statistics_over_working_days_are_upserted(self):
+        nsk, kem = create_store('Novosibirsk Main', 'novosibirsk'), create_store('Kemerovo Main', 'kemerovo')
+        product = create_product('1021', S_days=10)
+        WorkingDays.objects.bulk_create([WorkingDays(date=date(2024, 1, day)) for day in (9, 10, 11)])
+        for store, day, quantity in ((nsk, 9, 2), (nsk, 10, 4), (nsk, 13, 100), (kem, 11, 3)):
+            DailySales.objects.create(product=product, store=store, date=date(2024, 1, day), quantity=quantity)
+
+        for _ in range(2):
+            statistics = calculate_sales_statistics(date(2024, 1, 1), date(2024, 1, 31))
+            statistics_global = calculate_sales_global_statistics(date(2024, 1, 1), date(2024, 1, 31))
+
+        # Saturday the 13th is not a working day: Novosibirsk 2, 4, 0 and Kemerovo 0, 0, 3
+        self.assertEqual(statistics['1021']['Novosibirsk Main']['sales_list'], [2, 4, 0])
+        expected = {nsk.id: (2, np.sqrt(8 / 3)), kem.id: (1, np.sqrt(2))}
+        self.assertEqual(ProductStoreStatistics.objects.count(), 2)
+        for stat in ProductStoreStatistics.objects.all():
+            self.assertAlmostEqual(stat.sales_mean, expected[stat.store_id][0])
+            self.assertAlmostEqual(stat.sales_std, expected[stat.store_id][1])
+            self.assertEqual(stat.n_days, 3)
+        # all stores: 2, 4, 3
+        stat = ProductStatistics.objects.get()
+        self.assertAlmostEqual(stat.sales_mean, 3)
+        self.assertAlmostEqual(stat.sales_std, np.sqrt(2 / 3))
+        self.assertAlmostEqual(stat.S, 30)
+        self.assertAlmostEqual(statistics_global['1021']['S'], 30)
+
+
+class BatchOracleAgentTest(TestCase):
+    def setUp(self):
+        self.stores = {
+            name: create_store(name, lead_time_mean=lead_time)
+            for name, lead_time in (
+                ('Novosibirsk Main', 3.0), ('Novosibirsk Reserve', 3.0), ('Kemerovo Main', 2.0), ('Kemerovo Transit', 2.0),
+            )
+        }
+        Store.objects.update(lead_time_std=0)
+        self.products = [create_product('1021', S_days=10), create_product('1022', S_days=10, order_pack=10)]
+        for product, store, sales_mean in (
+            (self.products[0], 'Novosibirsk Main', 4), (self.products[0], 'Kemerovo Main', 2),
+            (self.products[1], 'Novosibirsk Main', 1),
+        ):
+            ProductStoreStatistics.objects.create(
+                product=product, store=self.stores[store], sales_mean=sales_mean, sales_std=0,
+            )
+        for store, level in (
+            ('Novosibirsk Main', 5), ('Novosibirsk Reserve', 3), ('Kemerovo Main', 1), ('Kemerovo Transit', 1),
+        ):
+            CurrentInventory.objects.create(
+                product=self.products[0], store=self.stores[store], date=date(2024, 1, 9), inventory_level=level,
+            )
+
+    def test_orders_of_the_hub_and_branch(self):
+        agent = BatchOracleAgent(Product.objects.order_by('id'))
+        policy = agent.get_policy()
+        # Novosibirsk covers both cities: demand 6 over 3 days, plus 10 days; Kemerovo 2 over 2 days, plus 10 days
+        np.testing.assert_allclose(policy['nsk']['s'], [18, 3])
+        np.testing.assert_allclose(policy['nsk']['S'], [78, 13])
+        np.testing.assert_allclose(policy['kem']['S'], [24, 0])
+        np.testing.assert_allclose(agent.inv_levels['nsk'], [8, 0])
+
+        actions = agent.get_actions(policy)
+        # 1021: echelon position 8 + 2; 1022: 13 is one pack of 10, the rest 0.3 is below the 0.4 threshold
+        np.testing.assert_allclose(actions['nsk'], [68, 10])
+        np.testing.assert_allclose(actions['kem'], [22, 0])
+
+
+class CurrentInventoryTest(TestCase):
+    def test_latest_snapshot_survives_an_older_import_and_a_rebuild(self):
+        create_store('Novosibirsk Main', 'novosibirsk')
+        create_store('Kemerovo Main', 'kemerovo')
+        create_product('1021')
+        create_product('1022')
+
+        def inventory(rows):
+            return pd.DataFrame(rows, columns=['SKU', 'store', 'date', 'end'])
+
+        import_inventory(inventory([
+            ('1021', 'Novosibirsk Main', date(2024, 2, 1), 12),
+            ('1021', 'Kemerovo Main', date(2024, 1, 20), 5),
+        ]))
+        # an older report of January arrives later
+        import_inventory(inventory([
+            ('1021', 'Novosibirsk Main', date(2024, 1, 15), 30),
+            ('1021', 'Kemerovo Main', date(2024, 1, 31), 7),
+            ('1022', 'Kemerovo Main', date(2024, 1, 31), 0),
+        ]))
+        expected = {
+            ('1021', 'Novosibirsk Main'): (date(2024, 2, 1), 12),
+            ('1021', 'Kemerovo Main'): (date(2024, 1, 31), 7),
+            ('1022', 'Kemerovo Main'): (date(2024, 1, 31), 0),
+        }
+
+        def current():
+            return {
+                (sku, store): (day, level) for sku, store, day, level in CurrentInventory.objects.values_list(
+                    'product__sku', 'store__name', 'date', 'inventory_level'
+                )
+            }
+
+        self.assertEqual(current(), expected)
+        self.assertEqual(rebuild_current_inventory(), 3)
+        self.assertEqual(current(), expected)
+
+
+class ProductTimeseriesTest(TestCase):
+    def test_monthly_series_by_location(self):
+        nsk, kem = create_store('Novosibirsk Main', 'novosibirsk'), create_store('Kemerovo Main', 'kemerovo')
+        other = create_store('Other')
+        product, other_product = create_product('1021'), create_product('1022')
+        WorkingDays.objects.bulk_create([
+            WorkingDays(date=day) for day in (date(2023, 12, 29), date(2024, 1, 9), date(2024, 1, 10), date(2024, 3, 5))
+        ])
+        for sold, store, day, quantity in (
+            (product, nsk, date(2023, 12, 29), 5), (product, nsk, date(2024, 1, 9), 4),
+            (product, kem, date(2024, 1, 10), 2), (product, other, date(2024, 1, 10), 1),
+            (product, nsk, date(2024, 3, 5), 6), (other_product, nsk, date(2024, 1, 9), 50),
+        ):
+            DailySales.objects.create(product=sold, store=store, date=day, quantity=quantity)
+        Inventory.objects.create(product=product, store=nsk, date=date(2024, 1, 9), inventory_level=10)
+
+        timeseries = get_product_timeseries(product, [2023, 2024])
+
+        total = timeseries[2024]['total']
+        # the store without a location only counts towards the total
+        self.assertEqual(total['sales'][:4], [7, 0, 6, 0])
+        self.assertEqual(total['av_sales'][:4], [3.5, 0, 6, 0])
+        self.assertEqual(total['cum_sales'][-1], 13)
+        self.assertEqual(timeseries[2024]['novosibirsk']['sales'][:3], [4, 0, 6])
+        self.assertEqual(timeseries[2024]['kemerovo']['sales'][:3], [2, 0, 0])
+        self.assertEqual(timeseries[2024]['novosibirsk']['inventory'][0], 10)
+        self.assertEqual(timeseries[2023]['total']['sales'][11], 5)
+        self.assertEqual(timeseries[2023]['total']['av_sales'][11], 5)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = create_store('Novosibirsk Main', 'novosibirsk')
+        self.product = create_product('1021')
+
+    def test_page_is_cached_until_the_next_import(self):
+        url = reverse('im:product_detail', args=[self.product.id])
+        self.assertEqual(self.client.get(url).context['sales'], 0)
+
+        # written behind the cache's back: the cached page is served
+        DailySales.objects.create(product=self.product, store=self.store, date=date(2024, 11, 5), quantity=3)
+        self.assertEqual(self.client.get(url).context['sales'], 0)
+        self.assertEqual((get_cache_stats()['hits'], get_cache_stats()['misses']), (1, 1))
+
+        # an import starts a new data generation once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            import_sales(pd.DataFrame({
+                'SKU': ['1021'], 'store': ['Novosibirsk Main'], 'sale_date': [date(2024, 11, 6)], 'quantity': [4],
+                'cost': [8.0], 'sale_value': [12.0], 'client_type': ['retail'],
+            }))
+        self.assertEqual(self.client.get(url).context['sales'], 7)
+        self.assertEqual(get_cache_stats()['misses'], 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SalesRankingTest(TestCase):
+    def setUp(self):
+        create_store('Novosibirsk Main', 'novosibirsk')
+        create_store('Kemerovo Main', 'kemerovo')
+        for sku in ('1021', '1022', '1023'):
+            create_product(sku)
+        Product.objects.filter(sku='1021').update(weight=2.0)
+
+    def import_rows(self, rows):
+        df = pd.DataFrame(rows, columns=['SKU', 'store', 'sale_date', 'quantity', 'sale_value'])
+        import_sales(df.assign(cost=0.0, client_type='retail'))
+
+    def test_import_refreshes_the_ranking(self):
+        self.import_rows([
+            ('1021', 'Novosibirsk Main', date(2024, 1, 9), 5, 50.0),
+            ('1021', 'Kemerovo Main', date(2024, 2, 1), 1, 10.0),
+            ('1022', 'Novosibirsk Main', date(2024, 1, 10), 20, 30.0),
+            ('1023', 'Kemerovo Main', date(2024, 1, 10), 2, 5.0),
+            ('1023', 'Novosibirsk Main', date(2023, 12, 29), 100, 1000.0),
+        ])
+        year = ProductSalesRanking.objects.get(product__sku='1021', year=2024, month=0, location='')
+        self.assertEqual((year.quantity, year.sale_value, year.weight_quantity), (6, 60.0, 12.0))
+        month = ProductSalesRanking.objects.get(product__sku='1021', year=2024, month=1, location='novosibirsk')
+        self.assertEqual((month.quantity, month.sale_value), (5, 50.0))
+
+        def skus(ranking):
+            return [row['product__sku'] for row in ranking]
+
+        self.assertEqual(skus(get_top_products(2, 2024)), ['1021', '1022'])
+        self.assertEqual(skus(get_top_products(None, 2024, by='weight')), ['1022', '1021', '1023'])
+        self.assertEqual(skus(get_top_products(None, 2024, month=1, location='kemerovo')), ['1023'])
+        # shares of the 95 sold before each product: 0, 60/95 and 90/95
+        classes = get_abc_classes(2024)
+        self.assertEqual([classes[product.id] for product in Product.objects.order_by('sku')], ['A', 'A', 'B'])
+
+        self.import_rows([('1023', 'Kemerovo Main', date(2024, 1, 11), 1, 100.0)])
+        self.assertEqual(skus(get_top_products(1, 2024)), ['1023'])
+        self.assertEqual(
+            ProductSalesRanking.objects.get(product__sku='1023', year=2024, month=1, location='kemerovo').quantity, 3,
+        )
@@ -13,5 +13,9 @@ urlpatterns = [
     path('calculate-statistics-form/', views.calculate_statistics_form, name='calculate_statistics_form'),
     path('place-order/', views.place_order_view, name='place_order'),
     path('stores/', views.store_list, name='store_list'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<int:id>/', views.job_status, name='job_status'),
+    path('jobs/<int:id>/download/', views.job_download, name='job_download'),
 ]
 
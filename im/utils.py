@@ -2,6 +2,11 @@ import numpy as np
 import scipy.stats as stats
 import matplotlib.pyplot as plt
 
+
+DEMAND_DISTRIBUTIONS = ('negative_binomial', 'poisson', 'normal')
+# Largest number of simulated values held in memory at a time by iter_demand_scenarios
+SIMULATION_CHUNK_VALUES = 2 ** 24
+
     
 class DemandGenerator:
     def __init__(self, generator_agrs: dict):
@@ -65,5 +70,66 @@ class DemandGenerator:
         plt.xlabel('Period')
         plt.ylabel('Quantity')
         plt.show()
-    
+
+
+def _draw_scenario(rng, means, stds, n_periods, distribution) -> np.ndarray:
+    """One (SKUs, periods) scenario; SKUs without overdispersion fall back to Poisson for negative_binomial."""
+    if distribution == 'normal':
+        return np.maximum(rng.normal(means[:, None], stds[:, None], size=(len(means), n_periods)), 0)
+    demand = np.zeros((len(means), n_periods), dtype=np.int64)
+    variances = stds ** 2
+    nbinom = (means > 0) & (variances > means) if distribution == 'negative_binomial' else np.zeros(len(means), bool)
+    poisson = (means > 0) & ~nbinom
+    if nbinom.any():
+        mean, variance = means[nbinom], variances[nbinom]
+        # same parametrisation as DemandGenerator._negative_binomial
+        demand[nbinom] = rng.negative_binomial(
+            (mean ** 2 / (variance - mean))[:, None], (mean / variance)[:, None], size=(len(mean), n_periods)
+        )
+    if poisson.any():
+        demand[poisson] = rng.poisson(means[poisson][:, None], size=(int(poisson.sum()), n_periods))
+    return demand
+
+
+def iter_demand_scenarios(means, stds, n_periods, n_scenarios=1, distribution='negative_binomial', seed=None,
+                          max_values=SIMULATION_CHUNK_VALUES):
+    """
+    Simulate the daily demand of many SKUs with NumPy's Generator API, in chunks of
+    scenarios holding at most max_values values (at least one scenario per chunk).
+    Every scenario has its own child seed, so a seed gives the same demand whatever the chunk size.
+    Args:
+        means, stds (np.ndarray): daily demand mean and standard deviation of every SKU(-store)
+        n_periods (int): days per scenario
+        n_scenarios (int): number of scenarios
+        distribution (str): 'negative_binomial', 'poisson' or 'normal' (clipped at 0)
+        seed (int or np.random.SeedSequence): None for fresh entropy
+    Yields:
+        (int, np.ndarray): index of the first scenario and a (scenarios, SKUs, periods) chunk,
+                           int64 except for the normal distribution.
+    """
+    if distribution not in DEMAND_DISTRIBUTIONS:
+        raise NotImplementedError(f"Distribution {distribution} not supported. Try one of {', '.join(DEMAND_DISTRIBUTIONS)}.")
+    means = np.nan_to_num(np.asarray(means, dtype=np.float64))
+    stds = np.nan_to_num(np.asarray(stds, dtype=np.float64))
+    if (means < 0).any() or (stds < 0).any() or n_periods <= 0 or n_scenarios <= 0:
+        raise ValueError("Mean, standard deviation, period length and scenarios must be positive values.")
+
+    seeds = np.random.SeedSequence(seed).spawn(n_scenarios)
+    chunk = max(1, max_values // max(len(means) * n_periods, 1))
+    for start in range(0, n_scenarios, chunk):
+        yield start, np.stack([
+            _draw_scenario(np.random.default_rng(scenario_seed), means, stds, n_periods, distribution)
+            for scenario_seed in seeds[start:start + chunk]
+        ])
+
+
+def simulate_demand_batch(means, stds, n_periods, n_scenarios=1, distribution='negative_binomial', seed=None) -> np.ndarray:
+    """
+    Whole (scenarios, SKUs, periods) demand tensor of iter_demand_scenarios, for sizes that fit in memory.
+    Example return:
+        array([[[3, 0, 5, ...], [0, 1, 0, ...]]])
+    """
+    return np.concatenate([
+        demand for _, demand in iter_demand_scenarios(means, stds, n_periods, n_scenarios, distribution, seed)
+    ])
 
@@ -0,0 +1,157 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from .models import Inventory, ProductStoreData, WorkingDays
+from .utils import simulate_demand_batch
+from .utils_oracle import BatchOracleAgent, CITY_STORES, SALE_STORES
+from .utils_policy import evaluate_policy
+from .utils_stat import get_sales_matrix
+
+
+# How far back the starting inventory snapshot is looked for
+INITIAL_INVENTORY_DAYS = 31
+BACKTEST_SOURCES = ('history', 'simulated')
+
+
+def get_initial_inventory(products, start_date) -> dict:
+    """
+    Inventory of every city on start_date: the latest snapshot of every store of the city
+    in the INITIAL_INVENTORY_DAYS days up to start_date, 0 without one.
+    Example return:
+        {'nsk': array([51., 0.]), 'kem': array([6., 2.])}
+    """
+    product_index = {product.id: i for i, product in enumerate(products)}
+    store_city = {name: city for city, names in CITY_STORES.items() for name in names}
+    snapshots = pd.DataFrame(
+        list(
+            Inventory.objects.filter(
+                store__name__in=list(store_city),
+                date__gt=start_date - timedelta(days=INITIAL_INVENTORY_DAYS), date__lte=start_date,
+            ).values_list('product_id', 'store__name', 'date', 'inventory_level')
+        ),
+        columns=['product_id', 'store', 'date', 'inventory_level'],
+    )
+    latest = snapshots.sort_values('date').drop_duplicates(['product_id', 'store'], keep='last')
+    latest = latest[latest['product_id'].isin(product_index)]
+
+    inventory = {city: np.zeros(len(products)) for city in CITY_STORES}
+    for city in CITY_STORES:
+        rows = latest[latest['store'].map(store_city) == city]
+        np.add.at(inventory[city], rows['product_id'].map(product_index).to_numpy(dtype=np.int64),
+                  rows['inventory_level'].to_numpy(dtype=np.float64))
+    return inventory
+
+
+def get_backtest_inputs(start_date, end_date, products, source='history') -> tuple:
+    """
+    Everything the policy backtest needs about products and cities, loaded with a few queries.
+    The policy inputs are those of BatchOracleAgent.get_policy, including the Novosibirsk
+    echelon and the forecast lead time demand, from a point in time agent that only sees the
+    sales before start_date. The demand of the 'history' source is the DailySales of the sale
+    stores on the working days; for 'simulated' it is drawn later by slice_inputs from the
+    sales mean and standard deviation of each sale store.
+    Returns:
+        (list, dict): products, city -> evaluate_policy inputs with 'demand' shaped (1, SKUs, days) or None.
+    """
+    if source not in BACKTEST_SOURCES:
+        raise ValueError(f"Unknown source {source!r}, use one of {', '.join(BACKTEST_SOURCES)}.")
+    working_days = list(
+        WorkingDays.objects.filter(date__range=(start_date, end_date)).order_by('date').values_list('date', flat=True)
+    )
+    agent = BatchOracleAgent(products, reference_date=start_date, point_in_time=True)
+    products = agent.products
+    policy_inputs = agent.get_policy_inputs()
+    sale_stores = [agent.store_by_name[SALE_STORES[city]] for city in agent.stores]
+    pack_size = np.array([product.order_pack for product in products], dtype=np.float64)
+    weights = np.array([product.weight for product in products], dtype=np.float64)
+    initial_inventory = get_initial_inventory(products, start_date)
+    if source == 'history':
+        history = get_sales_matrix(products, sale_stores, working_days, start_date, end_date)
+    lost_demand_costs = {
+        (product_id, store_id): cost
+        for product_id, store_id, cost in ProductStoreData.objects.filter(store__in=sale_stores).values_list(
+            'product_id', 'store_id', 'lost_demand_cost_item'
+        )
+    }
+
+    city_inputs = {}
+    for j, (city, store) in enumerate(zip(agent.stores, sale_stores)):
+        city_inputs[city] = {
+            **policy_inputs[city],
+            'demand': history[None, :, j] if source == 'history' else None,
+            'n_days': len(working_days),
+            'sales_mean': agent.mean_demand[city],
+            'sales_std': agent.std_demand[city],
+            'initial_inventory': initial_inventory[city],
+            'pack_size': pack_size,
+            'weights': weights,
+            'lost_demand_cost': np.array(
+                [lost_demand_costs.get((product.id, store.id), 0.0) for product in products], dtype=np.float64
+            ),
+            'holding_cost_kg': store.holding_cost_kg,
+            'ordering_cost_kg': store.ordering_cost_kg,
+        }
+    return products, city_inputs
+
+
+def slice_inputs(city_inputs, start, stop, n_scenarios=1, seed=None) -> dict:
+    """
+    Inputs of the SKUs start:stop. Simulated demand (negative binomial, from the sales
+    statistics of each store) is drawn here, so only one slice of scenarios is in memory at a time.
+    """
+    sliced = {}
+    for city, inputs in city_inputs.items():
+        sliced[city] = {
+            key: values[start:stop] if isinstance(values, np.ndarray) else values
+            for key, values in inputs.items() if key != 'demand'
+        }
+        sliced[city]['demand'] = inputs['demand'][:, start:stop] if inputs['demand'] is not None else (
+            simulate_demand_batch(
+                inputs['sales_mean'][start:stop], inputs['sales_std'][start:stop], inputs['n_days'],
+                n_scenarios, seed=seed,
+            )
+        )
+    return sliced
+
+
+def backtest_oracle(start_date, end_date, products, source='history', n_scenarios=1, review_days=1, seed=None):
+    """
+    Backtest the order policy of BatchOracleAgent over the working days from start_date
+    to end_date, with the S_days and pack rounding threshold of every product: Novosibirsk
+    orders for both cities on its echelon position and replenishes Kemerovo from its stock
+    (see utils_policy.simulate_echelon_policy). Kemerovo 'orders' are transfers.
+    Args:
+        products (list): Product objects
+        source (str): 'history' replays the DailySales of the sale stores,
+                      'simulated' draws n_scenarios negative binomial scenarios from the statistics
+        review_days (int): working days between two order reviews
+        seed (int): seed of the simulated demand and lead times
+    Returns:
+        (dict, pd.DataFrame): summary per city, per product results per city (averaged over scenarios).
+    Example return:
+        {'nsk': {'fill_rate': 0.97, 'stockout_days': 412, 'lost': 1830.0, 'average_inventory': 5120.4,
+                 'orders': 960, 'holding_cost': 91200.5, 'ordering_cost': 40510.0, 'lost_demand_cost': 0.0}, ...}
+    """
+    products, city_inputs = get_backtest_inputs(start_date, end_date, products, source)
+    city_inputs = slice_inputs(city_inputs, 0, len(products), n_scenarios, seed)
+    S_days = np.array([product.S_days for product in products], dtype=np.float64)
+    pack_threshold = np.array([product.pack_round_threshold for product in products], dtype=np.float64)
+
+    summary, details = {}, {'sku': [product.sku for product in products]}
+    for city, result in evaluate_policy(city_inputs, S_days, pack_threshold, review_days, seed).items():
+        result.pop('cost')
+        total_demand = result['demand'].sum()
+        summary[city] = {
+            'fill_rate': float(result['sold'].sum() / total_demand) if total_demand > 0 else 1.0,
+            'stockout_days': float(result['stockout_days'].sum()),
+            'lost': float(result['lost'].sum()),
+            'average_inventory': float(result['average_inventory'].sum()),
+            'orders': float(result['orders'].sum()),
+            'holding_cost': float(result['holding_cost'].sum()),
+            'ordering_cost': float(result['ordering_cost'].sum()),
+            'lost_demand_cost': float(result['lost_demand_cost'].sum()),
+        }
+        details.update({f'{key}_{city}': values for key, values in result.items()})
+    return summary, pd.DataFrame(details)
@@ -0,0 +1,78 @@
+import time
+
+from django.core.cache import cache
+
+
+GENERATION_KEY = 'data_generation'
+HITS_KEY = 'cache_hits'
+MISSES_KEY = 'cache_misses'
+
+
+def get_data_generation() -> int:
+    """
+    Current data generation, the version of every cached dashboard context.
+    It starts from the current time in milliseconds, so that a generation lost
+    from the cache never brings back contexts cached under an older one.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = int(time.time() * 1000)
+        if not cache.add(GENERATION_KEY, generation, timeout=None):
+            generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def bump_data_generation() -> int:
+    """
+    Start a new data generation after an import, so that every dashboard is computed again.
+    Returns:
+        int: the new generation.
+    """
+    generation = max(get_data_generation() + 1, int(time.time() * 1000))
+    cache.set(GENERATION_KEY, generation, timeout=None)
+    return generation
+
+
+def _count(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add and incr
+        cache.set(key, 1, timeout=None)
+
+
+def cached_context(name, builder, *args):
+    """
+    Context of a dashboard, computed by builder(*args) once per data generation.
+    Args:
+        name (str): name of the dashboard, e.g. 'sales'
+        builder (callable): computes the context
+        args: arguments of builder, part of the cache key
+    Returns:
+        dict: the context.
+    """
+    key = ':'.join(['context', name, *map(str, args)])
+    generation = get_data_generation()
+    context = cache.get(key, version=generation)
+    if context is not None:
+        _count(HITS_KEY)
+        return context
+    _count(MISSES_KEY)
+    context = builder(*args)
+    cache.set(key, context, version=generation)
+    return context
+
+
+def get_cache_stats() -> dict:
+    """
+    Example return:
+        {'generation': 1760789012345, 'hits': 120, 'misses': 8, 'hit_rate': 0.9375}
+    """
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {
+        'generation': get_data_generation(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None,
+    }
@@ -0,0 +1,121 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import DailySales, ProductClassification, WorkingDays
+from .utils_ranking import ABC_THRESHOLDS
+
+
+CLASSIFICATION_BATCH_SIZE = 5000
+# Coefficients of variation closing the X and Y classes
+XYZ_THRESHOLDS = (0.5, 1.0)
+# Cycle service level of every ABC/XYZ class, used by the oracle for the safety stock
+SERVICE_LEVELS = {
+    'AX': 0.99, 'AY': 0.98, 'AZ': 0.97,
+    'BX': 0.97, 'BY': 0.95, 'BZ': 0.93,
+    'CX': 0.93, 'CY': 0.90, 'CZ': 0.85,
+}
+
+
+def classify(values, sums, sumsqs, n_days, groups, abc_thresholds=ABC_THRESHOLDS, xyz_thresholds=XYZ_THRESHOLDS) -> dict:
+    """
+    Vectorised ABC/XYZ classification of (product, store) rows.
+    ABC ranks the rows of each group (store) by sales value, XYZ uses the coefficient
+    of variation of the daily sales over n_days working days (days without sales count as 0).
+    Args:
+        values (np.ndarray): sales value of every row
+        sums, sumsqs (np.ndarray): sum and sum of squares of the daily quantities
+        n_days (int): working days in the window
+        groups (np.ndarray): group (store) index of every row
+    Returns:
+        dict: arrays 'abc', 'xyz', 'value_share' and 'cv' (nan without sales).
+    """
+    values = np.maximum(np.asarray(values, dtype=np.float64), 0)
+    groups = np.asarray(groups, dtype=np.int64)
+    n_rows = len(values)
+
+    # ABC: share of the group value sold by the better ranked rows of the group
+    group_totals = np.bincount(groups, weights=values)
+    order = np.lexsort((-values, groups))
+    sorted_values, sorted_groups = values[order], groups[order]
+    value_before = np.cumsum(sorted_values) - sorted_values - (np.cumsum(group_totals) - group_totals)[sorted_groups]
+    totals = group_totals[sorted_groups]
+    share_before = np.ones(n_rows)
+    np.divide(value_before, totals, out=share_before, where=totals > 0)
+    abc = np.empty(n_rows, dtype='<U1')
+    abc[order] = np.where(
+        share_before < abc_thresholds[0], 'A', np.where(share_before < abc_thresholds[1], 'B', 'C')
+    )
+    value_share = np.zeros(n_rows)
+    np.divide(values, group_totals[groups], out=value_share, where=group_totals[groups] > 0)
+
+    # XYZ: coefficient of variation of the daily sales
+    mean = np.asarray(sums, dtype=np.float64) / n_days if n_days else np.zeros(n_rows)
+    variance = np.asarray(sumsqs, dtype=np.float64) / n_days - mean ** 2 if n_days else np.zeros(n_rows)
+    cv = np.full(n_rows, np.nan)
+    np.divide(np.sqrt(np.maximum(variance, 0)), mean, out=cv, where=mean > 0)
+    xyz = np.where(cv <= xyz_thresholds[0], 'X', np.where(cv <= xyz_thresholds[1], 'Y', 'Z'))  # nan is Z
+
+    return {'abc': abc, 'xyz': xyz, 'value_share': value_share, 'cv': cv}
+
+
+def get_product_classes(start_date, end_date) -> dict:
+    """
+    ABC/XYZ classes of every product sold in every store between start_date and
+    end_date, from one grouped query over the DailySales rollup on working days.
+    Returns:
+        dict: the classify arrays plus 'product_ids' and 'store_ids' of every row.
+    """
+    working_days = WorkingDays.objects.filter(date__range=(start_date, end_date))
+    n_days = working_days.count()
+    totals = (
+        DailySales.objects.filter(date__in=working_days.values('date'))
+        .values('product', 'store')
+        .annotate(total=Sum('quantity'), total_sq=Sum(F('quantity') * F('quantity')), total_value=Sum('sale_value'))
+        .values_list('product', 'store', 'total', 'total_sq', 'total_value')
+    )
+    rows = np.array(
+        [(product_id, store_id, total or 0, total_sq or 0, total_value or 0)
+         for product_id, store_id, total, total_sq, total_value in totals],
+        dtype=np.float64,
+    ).reshape(-1, 5)
+    product_ids, store_ids = rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64)
+    _, groups = np.unique(store_ids, return_inverse=True)
+    return {
+        'product_ids': product_ids,
+        'store_ids': store_ids,
+        **classify(rows[:, 4], rows[:, 2], rows[:, 3], n_days, groups),
+    }
+
+
+def classify_products(start_date, end_date) -> dict:
+    """
+    ABC/XYZ classes of every product sold in every store between start_date and
+    end_date (see get_product_classes). The ProductClassification table is replaced.
+    Returns:
+        dict: number of classified (product, store) pairs per class.
+    Example return:
+        {'AX': 120, 'AY': 80, 'CZ': 4100}
+    """
+    classes = get_product_classes(start_date, end_date)
+    product_ids, store_ids = classes['product_ids'], classes['store_ids']
+
+    with transaction.atomic():
+        ProductClassification.objects.all().delete()
+        ProductClassification.objects.bulk_create(
+            (
+                ProductClassification(
+                    product_id=product_id, store_id=store_id, abc_class=abc_class, xyz_class=xyz_class,
+                    value_share=value_share, cv=None if np.isnan(cv) else cv,
+                    window_start=start_date, window_end=end_date,
+                )
+                for product_id, store_id, abc_class, xyz_class, value_share, cv in zip(
+                    product_ids.tolist(), store_ids.tolist(), classes['abc'].tolist(), classes['xyz'].tolist(),
+                    classes['value_share'].tolist(), classes['cv'].tolist(),
+                )
+            ),
+            batch_size=CLASSIFICATION_BATCH_SIZE,
+        )
+
+    labels, counts = np.unique(np.char.add(classes['abc'], classes['xyz']), return_counts=True)
+    return dict(zip(labels.tolist(), counts.tolist()))
@@ -0,0 +1,334 @@
+from datetime import date, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Min, Sum
+
+from .models import DailySales, DemandForecast, WorkingDays
+from .quaries import get_latest_sales_date
+from .utils_seasonality import SEASONALITY_PERIOD, seasonal_indices
+
+
+# Smoothing constants of the level and of the seasonal component
+FORECAST_ALPHA = 0.3
+FORECAST_GAMMA = 0.2
+# Days forecast from the month after the last fitted one
+FORECAST_HORIZON_DAYS = 90
+FORECAST_BATCH_SIZE = 5000
+
+
+def _month_number(day) -> int:
+    """Months since year 0 of the month of a date, so consecutive months differ by 1."""
+    return day.year * 12 + day.month - 1
+
+
+def _month_start(number) -> date:
+    return date(number // 12, number % 12 + 1, 1)
+
+
+def initial_state(values, first_month) -> tuple:
+    """
+    Starting level and seasonal component of every series: the mean of the first year
+    and the additive seasonal indices of the first two years (see utils_seasonality),
+    no seasonal component for series shorter than two years.
+    Args:
+        values (np.ndarray): (series, months) sales per working day
+        first_month (int): calendar month of the first column, 0 for January
+    Returns:
+        (np.ndarray, np.ndarray): level (series,) and seasonal component (series, 12), January first.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    level = values[:, :SEASONALITY_PERIOD].mean(axis=1) if values.shape[1] else np.zeros(len(values))
+    seasonal = np.zeros((len(values), SEASONALITY_PERIOD))
+    if values.shape[1] >= 2 * SEASONALITY_PERIOD and len(values):
+        # the indices start with the phase of the first observation
+        seasonal = np.roll(seasonal_indices(values[:, :2 * SEASONALITY_PERIOD]), first_month, axis=1)
+    return level, seasonal
+
+
+def smooth_seasonal(values, level, seasonal, first_month, alpha=FORECAST_ALPHA, gamma=FORECAST_GAMMA) -> tuple:
+    """
+    Additive seasonal exponential smoothing of monthly series, all series at once, one step
+    per month. Continuing from a stored state with the new months only gives the same state
+    as smoothing the whole history again.
+    Args:
+        values (np.ndarray): (series, months) sales per working day
+        level, seasonal (np.ndarray): state before the first month, (series,) and (series, 12)
+        first_month (int): calendar month of the first column, 0 for January
+    Returns:
+        (np.ndarray, np.ndarray): level and seasonal component after the last month.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    level = np.asarray(level, dtype=np.float64).copy()
+    seasonal = np.asarray(seasonal, dtype=np.float64).copy()
+    for t in range(values.shape[1]):
+        month = (first_month + t) % SEASONALITY_PERIOD
+        new_level = alpha * (values[:, t] - seasonal[:, month]) + (1 - alpha) * level
+        seasonal[:, month] = gamma * (values[:, t] - new_level) + (1 - gamma) * seasonal[:, month]
+        level = new_level
+    return level, seasonal
+
+
+def daily_forecast(level, seasonal, start, horizon=FORECAST_HORIZON_DAYS) -> np.ndarray:
+    """
+    Forecast sales per working day of every day from start: the level plus the seasonal
+    component of the day's month, never below 0.
+    Example return:
+        array([[4.2, 4.2, ..., 5.1], [0., 0., ..., 0.]])
+    """
+    months = np.array([(start + timedelta(days=day)).month - 1 for day in range(horizon)], dtype=np.int64)
+    return np.maximum(np.asarray(level)[:, None] + np.asarray(seasonal)[:, months], 0)
+
+
+def get_monthly_store_sales(first_month, last_month, stores=None) -> tuple:
+    """
+    Sales per working day of every product and store with sales in the months
+    first_month to last_month (first days of the months), one grouped query per month
+    over a date range, which uses the date index and avoids the per row date functions
+    of ExtractYear/ExtractMonth.
+    Returns:
+        (list, np.ndarray): (product id, store id) pairs and a (pairs, months) matrix.
+    """
+    first, last = _month_number(first_month), _month_number(last_month)
+    rows = []
+    for month in range(first, last + 1):
+        daily_sales = DailySales.objects.filter(date__gte=_month_start(month), date__lt=_month_start(month + 1))
+        if stores is not None:
+            daily_sales = daily_sales.filter(store__in=stores)
+        totals = daily_sales.values('product_id', 'store_id').annotate(total=Sum('quantity'))
+        rows.append(np.array(
+            [(product_id, store_id, month - first, total)
+             for product_id, store_id, total in totals.values_list('product_id', 'store_id', 'total')],
+            dtype=np.float64,
+        ).reshape(-1, 4))
+    rows = np.concatenate(rows) if rows else np.zeros((0, 4))
+    pairs, pair_index = np.unique(rows[:, :2].astype(np.int64), axis=0, return_inverse=True)
+    sales = np.zeros((len(pairs), last - first + 1))
+    sales[pair_index.ravel(), rows[:, 2].astype(np.int64)] = rows[:, 3]
+
+    wd_in_month = np.bincount(
+        [_month_number(day) - first for day in WorkingDays.objects.filter(
+            date__gte=first_month, date__lt=_month_start(last + 1)
+        ).values_list('date', flat=True)],
+        minlength=last - first + 1,
+    )
+    rates = np.divide(sales, wd_in_month, out=np.zeros_like(sales), where=wd_in_month > 0)
+    return [tuple(pair) for pair in pairs.tolist()], rates
+
+
+def get_last_complete_month(reference_date=None) -> date:
+    """First day of the last month fully covered by the sales, up to reference_date (the latest sales date)."""
+    reference_date = reference_date or get_latest_sales_date()
+    month = _month_number(reference_date)
+    if (reference_date + timedelta(days=1)).month == reference_date.month:
+        month -= 1
+    return _month_start(month)
+
+
+def _months_with_working_days(first_month, last_month) -> set:
+    """Month numbers (see _month_number) of first_month to last_month having WorkingDays."""
+    return {
+        _month_number(day) for day in WorkingDays.objects.filter(
+            date__gte=first_month, date__lt=_month_start(_month_number(last_month) + 1)
+        ).values_list('date', flat=True)
+    }
+
+
+def _last_working_month(first_month, last_month, working_months) -> date:
+    """
+    Last month of first_month to last_month before the first one without working days,
+    the month before first_month when it has none. Without its calendar a month would
+    be fitted as zero sales, so the fit stops before it until WorkingDays are uploaded.
+    """
+    month = _month_number(first_month)
+    while month <= _month_number(last_month) and month in working_months:
+        month += 1
+    return _month_start(month - 1)
+
+
+def fit_history(reference_date=None, stores=None) -> dict:
+    """
+    Smooth every product and store over its whole history, from the first month with
+    working days to the last complete month up to reference_date, without storing it.
+    Returns:
+        dict: 'pairs' (product id, store id), 'level', 'seasonal', 'last_month' and 'months' fitted.
+    """
+    last_month = get_last_complete_month(reference_date)
+    sales = DailySales.objects.all() if stores is None else DailySales.objects.filter(store__in=stores)
+    history = sales.filter(date__lt=_month_start(_month_number(last_month) + 1))
+    first_day = history.aggregate(first=Min('date'))['first']
+    working_months = _months_with_working_days(first_day, last_month) if first_day else set()
+    months = 0
+    if working_months:
+        first_month = _month_start(min(working_months))
+        last_month = _last_working_month(first_month, last_month, working_months)
+        months = _month_number(last_month) - _month_number(first_month) + 1
+    if months <= 0:
+        return {
+            'pairs': [], 'level': np.zeros(0), 'seasonal': np.zeros((0, SEASONALITY_PERIOD)),
+            'last_month': last_month, 'months': 0,
+        }
+    pairs, rates = get_monthly_store_sales(first_month, last_month, stores)
+    level, seasonal = smooth_seasonal(rates, *initial_state(rates, first_month.month - 1), first_month.month - 1)
+    return {'pairs': pairs, 'level': level, 'seasonal': seasonal, 'last_month': last_month, 'months': months}
+
+
+def refit_forecasts(reference_date=None, stores=None, full=False, horizon=FORECAST_HORIZON_DAYS) -> dict:
+    """
+    Fit the demand forecast of every product and store, all series at once. Incrementally by
+    default: stored states are carried forward with the months completed since their last
+    month only, so a new month of sales costs one grouped query over that month. With
+    full=True, or when nothing is stored yet, every pair is smoothed over the whole history
+    from its first month with working days. New pairs seen in an incremental run start
+    from the new months, without seasonality until a full refit. The fit stops before the
+    first month whose WorkingDays are missing and resumes once they are uploaded.
+    Args:
+        reference_date (date): the latest sales date by default
+        stores (QuerySet): stores to forecast, all stores with sales by default
+        full (bool): refit from the whole history
+    Returns:
+        dict: number of pairs fitted from the history, carried forward and months applied.
+    Example return:
+        {'fitted': 0, 'updated': 20080, 'months': 1, 'last_month': '2024-12-01'}
+    """
+    last_month = get_last_complete_month(reference_date)
+    states = {} if full else {
+        (product_id, store_id): (level, seasonal, state_month)
+        for product_id, store_id, level, seasonal, state_month in DemandForecast.objects.filter(
+            **({'store__in': stores} if stores is not None else {})
+        ).values_list('product_id', 'store_id', 'level', 'seasonal', 'last_month')
+    }
+    fitted = {}
+    n_fitted = n_updated = months = 0
+
+    if states:
+        behind = [state[2] for state in states.values() if state[2] < last_month]
+        if behind:
+            first_month = _month_start(_month_number(min(behind)) + 1)
+            last_month = _last_working_month(
+                first_month, last_month, _months_with_working_days(first_month, last_month)
+            )
+        # carry every group of states sharing a last month forward
+        for state_month in sorted({state[2] for state in states.values()}):
+            if state_month >= last_month:
+                continue
+            first_month = _month_start(_month_number(state_month) + 1)
+            pairs, rates = get_monthly_store_sales(first_month, last_month, stores)
+            row = dict(zip(pairs, range(len(pairs))))
+            keys = [key for key, state in states.items() if state[2] == state_month]
+            new_keys = [key for key in pairs if key not in states]
+            values = np.zeros((len(keys) + len(new_keys), rates.shape[1]))
+            for i, key in enumerate(keys + new_keys):
+                if key in row:
+                    values[i] = rates[row[key]]
+            level, seasonal = initial_state(values[len(keys):], first_month.month - 1)
+            level = np.concatenate([[states[key][0] for key in keys], level])
+            seasonal = np.concatenate([
+                np.array([states[key][1] for key in keys], dtype=np.float64).reshape(-1, SEASONALITY_PERIOD),
+                np.zeros_like(seasonal),
+            ])
+            level, seasonal = smooth_seasonal(values, level, seasonal, first_month.month - 1)
+            fitted.update(zip(keys + new_keys, zip(level.tolist(), seasonal.tolist())))
+            # new pairs of later groups are already fitted by the first one
+            states.update((key, (None, None, last_month)) for key in new_keys)
+            n_updated += len(keys)
+            n_fitted += len(new_keys)
+            months = max(months, rates.shape[1])
+    else:
+        fit = fit_history(reference_date, stores)
+        last_month, months = fit['last_month'], fit['months']
+        fitted.update(zip(fit['pairs'], zip(fit['level'].tolist(), fit['seasonal'].tolist())))
+        n_fitted = len(fit['pairs'])
+
+    if fitted:
+        forecast_start = _month_start(_month_number(last_month) + 1)
+        keys = list(fitted)
+        forecasts = daily_forecast(
+            np.array([fitted[key][0] for key in keys]), np.array([fitted[key][1] for key in keys]),
+            forecast_start, horizon,
+        )
+        with transaction.atomic():
+            if full:
+                DemandForecast.objects.filter(**({'store__in': stores} if stores is not None else {})).delete()
+            DemandForecast.objects.bulk_create(
+                (
+                    DemandForecast(
+                        product_id=product_id, store_id=store_id, level=round(level, 6),
+                        seasonal=np.round(seasonal, 6).tolist(), last_month=last_month,
+                        forecast_start=forecast_start, forecast=row,
+                    )
+                    for ((product_id, store_id), (level, seasonal)), row in zip(
+                        ((key, fitted[key]) for key in keys), np.round(forecasts, 4).tolist()
+                    )
+                ),
+                batch_size=FORECAST_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['product', 'store'],
+                update_fields=['level', 'seasonal', 'last_month', 'forecast_start', 'forecast', 'fitted_at'],
+            )
+    return {'fitted': n_fitted, 'updated': n_updated, 'months': months, 'last_month': str(last_month)}
+
+
+def forecast_demand(forecasts, offsets, days) -> np.ndarray:
+    """
+    Total forecast demand of the days [offset, offset + days) of every row; fractional
+    days count part of the last day and days past the horizon repeat its last day.
+    Args:
+        forecasts (np.ndarray): (series, horizon) daily forecasts
+        offsets, days (np.ndarray or float): first forecast day and number of days of every row
+    Example return:
+        array([12.6, 0.])
+    """
+    forecasts = np.asarray(forecasts, dtype=np.float64)
+    n_rows, horizon = forecasts.shape
+    cumulative = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(forecasts, axis=1)], axis=1)
+    rows = np.arange(n_rows)
+
+    def total_until(x):
+        x = np.broadcast_to(np.asarray(x, dtype=np.float64), (n_rows,))
+        day = np.minimum(np.floor(x).astype(np.int64), horizon - 1)
+        return cumulative[rows, day] + (x - day) * forecasts[rows, day]
+
+    offsets = np.maximum(np.asarray(offsets, dtype=np.float64), 0)
+    return total_until(offsets + np.asarray(days, dtype=np.float64)) - total_until(offsets)
+
+
+def get_fitted_forecast_demand(fit, product_ids, store, days, reference_date, horizon=FORECAST_HORIZON_DAYS):
+    """
+    get_forecast_demand from a fit_history result instead of the stored forecasts.
+    Example return:
+        array([12.6, nan, 0.])
+    """
+    index = {product_id: i for i, product_id in enumerate(product_ids)}
+    demand = np.full(len(index), np.nan)
+    rows = [i for i, (product_id, store_id) in enumerate(fit['pairs']) if store_id == store.id and product_id in index]
+    if rows:
+        forecast_start = _month_start(_month_number(fit['last_month']) + 1)
+        forecasts = daily_forecast(fit['level'][rows], fit['seasonal'][rows], forecast_start, horizon)
+        demand[[index[fit['pairs'][i][0]] for i in rows]] = forecast_demand(
+            forecasts, (reference_date - forecast_start).days, days,
+        )
+    return demand
+
+
+def get_forecast_demand(product_ids, store, days, reference_date=None) -> np.ndarray:
+    """
+    Forecast demand of every product at a store over `days` days from reference_date,
+    the first forecast day by default; nan for products without a forecast.
+    Example return:
+        array([12.6, nan, 0.])
+    """
+    index = {product_id: i for i, product_id in enumerate(product_ids)}
+    demand = np.full(len(index), np.nan)
+    rows = DemandForecast.objects.filter(store=store, product_id__in=list(index)).values_list(
+        'product_id', 'forecast_start', 'forecast'
+    )
+    rows = [row for row in rows if row[2]]
+    if rows:
+        width = max(len(forecast) for _, _, forecast in rows)
+        forecasts = np.array([forecast + forecast[-1:] * (width - len(forecast)) for _, _, forecast in rows])
+        offsets = np.array([
+            (reference_date - forecast_start).days if reference_date else 0 for _, forecast_start, _ in rows
+        ])
+        demand[[index[product_id] for product_id, _, _ in rows]] = forecast_demand(forecasts, offsets, days)
+    return demand
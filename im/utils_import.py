@@ -0,0 +1,167 @@
+from datetime import date
+
+import pandas as pd
+from django.db import transaction
+
+from .models import Product, Store, Sale, Inventory
+from .utils_rollup import refresh_daily_sales, refresh_current_inventory
+from .utils_ranking import refresh_sales_ranking
+from .utils_stat import update_sales_statistics
+from .utils_cache import bump_data_generation
+
+
+SALES_CHUNK_SIZE = 5000
+INVENTORY_CHUNK_SIZE = 5000
+
+
+def _sku_str(sku) -> str:
+    # 1005.0 read from a numeric Excel column is SKU '1005'
+    if isinstance(sku, float) and sku.is_integer():
+        return str(int(sku))
+    return str(sku)
+
+
+def _resolve_frame(df, date_column, value_column):
+    """
+    Resolve SKUs and store names once into in-memory maps and validate the frame as a whole.
+    Returns:
+        (pd.DataFrame, dict): valid rows with product_id and store_id columns, partial import summary.
+    """
+    df = df.copy()
+    df['SKU'] = df['SKU'].map(_sku_str)
+
+    product_map = dict(Product.objects.values_list('sku', 'id'))
+    store_map = dict(Store.objects.values_list('name', 'id'))
+
+    df['product_id'] = df['SKU'].map(product_map)
+    df['store_id'] = df['store'].map(store_map)
+    # the parsers fill unreadable dates with 0, which must not become 1970-01-01
+    is_date = df[date_column].map(lambda value: isinstance(value, (date, str)))
+    df[date_column] = pd.to_datetime(df[date_column].where(is_date), errors='coerce')
+
+    unknown_sku = df['product_id'].isna()
+    invalid = (
+        df['store_id'].isna()
+        | df[date_column].isna()
+        | df[value_column].isna()
+    )
+    valid = df[~unknown_sku & ~invalid].copy()
+    valid['product_id'] = valid['product_id'].astype(int)
+    valid['store_id'] = valid['store_id'].astype(int)
+    valid[date_column] = valid[date_column].dt.date
+
+    summary = {
+        'skipped': int((invalid & ~unknown_sku).sum()),
+        'unknown_sku_rows': int(unknown_sku.sum()),
+        'unknown_skus': sorted(df.loc[unknown_sku, 'SKU'].unique().tolist()),
+    }
+    return valid, summary
+
+
+def import_sales(df, chunk_size=SALES_CHUNK_SIZE) -> dict:
+    """
+    Bulk import of a flat sales table (output of make_flat_table).
+
+    SKUs and store names are resolved once into in-memory maps, the frame is
+    validated as a whole and the rows are written with chunked bulk_create
+    inside a single transaction, together with the DailySales rollup, the
+    running sums of the sales statistics for the touched days and the sales
+    ranking of the touched products and years. The cached
+    dashboards are invalidated on commit.
+    Args:
+        df (pd.DataFrame): columns SKU, store, sale_date, quantity, cost, sale_value, client_type
+        chunk_size (int): number of rows per bulk_create batch
+    Returns:
+        dict: import summary.
+    Example return:
+        {'inserted': 15230, 'skipped': 4, 'unknown_sku_rows': 7, 'unknown_skus': ['1099', '2045']}
+    """
+    valid, summary = _resolve_frame(df, 'sale_date', 'quantity')
+
+    sales = [
+        Sale(
+            product_id=product_id,
+            store_id=store_id,
+            quantity=int(quantity),
+            sale_date=sale_date,
+            cost=float(cost) if pd.notna(cost) else None,
+            sale_value=float(sale_value) if pd.notna(sale_value) else None,
+            client_type=client_type if pd.notna(client_type) else None,
+        )
+        for product_id, store_id, quantity, sale_date, cost, sale_value, client_type in zip(
+            valid['product_id'], valid['store_id'], valid['quantity'], valid['sale_date'],
+            valid['cost'], valid['sale_value'], valid['client_type'],
+        )
+    ]
+
+    with transaction.atomic():
+        Sale.objects.bulk_create(sales, batch_size=chunk_size)
+        changes = refresh_daily_sales(zip(valid['product_id'], valid['store_id'], valid['sale_date']))
+        update_sales_statistics(changes)
+        refresh_sales_ranking(zip(valid['product_id'], valid['sale_date']))
+        transaction.on_commit(bump_data_generation)
+
+    return {'inserted': len(sales), **summary}
+
+
+def import_inventory(df, chunk_size=INVENTORY_CHUNK_SIZE) -> dict:
+    """
+    Idempotent import of a flat inventory table (output of read_inventory_report).
+
+    Snapshots are keyed by (product, store, date). Rows of the file with the same
+    key (several 1C warehouses mapped to one Store) are summed. Only new keys and
+    keys whose level changed are written, with batched
+    bulk_create(update_conflicts=True), so re-importing a month is cheap.
+    CurrentInventory is refreshed for the (product, store) pairs of the file.
+    Args:
+        df (pd.DataFrame): columns SKU, store, date, end
+        chunk_size (int): number of rows per bulk_create batch
+    Returns:
+        dict: import summary.
+    Example return:
+        {'inserted': 120, 'updated': 3, 'unchanged': 5210, 'skipped': 0, 'unknown_sku_rows': 2, 'unknown_skus': ['1099']}
+    """
+    valid, summary = _resolve_frame(df, 'date', 'end')
+    levels = (
+        valid.astype({'end': 'float64'})
+        .groupby(['product_id', 'store_id', 'date'])['end']
+        .sum()
+    )
+
+    existing = {}
+    if len(levels):
+        dates = levels.index.get_level_values('date')
+        existing = {
+            (product_id, store_id, day): level
+            for product_id, store_id, day, level in Inventory.objects.filter(
+                store_id__in=levels.index.get_level_values('store_id').unique().tolist(),
+                date__range=(dates.min(), dates.max()),
+            ).values_list('product_id', 'store_id', 'date', 'inventory_level')
+        }
+
+    inventories = []
+    inserted = updated = 0
+    for (product_id, store_id, day), level in levels.items():
+        current = existing.get((product_id, store_id, day))
+        if current == level:
+            continue
+        if current is None:
+            inserted += 1
+        else:
+            updated += 1
+        inventories.append(
+            Inventory(product_id=product_id, store_id=store_id, date=day, inventory_level=level)
+        )
+
+    with transaction.atomic():
+        Inventory.objects.bulk_create(
+            inventories,
+            batch_size=chunk_size,
+            update_conflicts=True,
+            unique_fields=['product', 'store', 'date'],
+            update_fields=['inventory_level'],
+        )
+        refresh_current_inventory(levels.index.droplevel('date').unique())
+        transaction.on_commit(bump_data_generation)
+
+    return {'inserted': inserted, 'updated': updated, 'unchanged': len(levels) - inserted - updated, **summary}
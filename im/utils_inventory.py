@@ -0,0 +1,96 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.db.models import Sum
+
+from .models import Inventory, WorkingDays
+
+
+# Stores whose inventory is reported for each location on the dashboards
+DEFAULT_STORE_GROUPS = {
+    'novosibirsk': ['Novosibirsk Main', 'Novosibirsk Reserve'],
+    'kemerovo': ['Kemerovo Main'],
+}
+
+
+def get_inventory_matrix(years, store_names, products=None) -> pd.DataFrame:
+    """
+    Daily inventory of the given stores on every working day of the years,
+    summed over the products and loaded with one grouped query.
+    The last snapshot of a month is carried over the following working days
+    of the same month; days before the first snapshot of the month are 0.
+    Args:
+        years (list): years of interest, e.g. [2023, 2024]
+        store_names (list): rows of the matrix
+        products (iterable): Product objects or ids, None for all products
+    Returns:
+        pd.DataFrame: stores x working days.
+    """
+    start, end = date(min(years), 1, 1), date(max(years) + 1, 1, 1)
+    working_days = list(
+        WorkingDays.objects.filter(date__gte=start, date__lt=end).order_by('date').values_list('date', flat=True)
+    )
+    inventories = Inventory.objects.filter(store__name__in=store_names, date__gte=start, date__lt=end)
+    if products is not None:
+        inventories = inventories.filter(product__in=products)
+    snapshots = pd.DataFrame(
+        list(
+            inventories.values('store__name', 'date')
+            .annotate(inventory=Sum('inventory_level'))
+            .values_list('store__name', 'date', 'inventory')
+        ),
+        columns=['store', 'date', 'inventory'],
+    )
+
+    matrix = (
+        snapshots.pivot(index='store', columns='date', values='inventory')
+        .reindex(index=store_names, columns=working_days)
+        .astype(np.float64)
+    )
+    months = np.array([day.year * 12 + day.month for day in working_days], dtype=np.int64)
+    return matrix.T.groupby(months).ffill().T.fillna(0)
+
+
+def get_weighted_av_inventory(years, products=None, store_groups=None) -> dict:
+    """
+    Monthly weighted average inventory (mean over the working days of the month)
+    of every store group, plus their total.
+    Args:
+        years (list): years of interest, e.g. [2024]
+        products (iterable): Product objects or ids, None for all products
+        store_groups (dict): group name -> store names, DEFAULT_STORE_GROUPS by default
+    Returns:
+        dict: per year and group 12 monthly values, 0 for months without working days.
+    Example return:
+        {2024: {'novosibirsk': [310.5, ...], 'kemerovo': [88.0, ...], 'total': [398.5, ...]}}
+    """
+    store_groups = store_groups or DEFAULT_STORE_GROUPS
+    store_names = [name for names in store_groups.values() for name in names]
+    matrix = get_inventory_matrix(years, store_names, products)
+
+    first_year = min(years)
+    n_months = (max(years) - first_year + 1) * 12
+    month_index = np.array([(day.year - first_year) * 12 + day.month - 1 for day in matrix.columns], dtype=np.int64)
+    wd_in_month = np.bincount(month_index, minlength=n_months)
+
+    # weighted average of every store, then summed over the stores of the group
+    store_averages = {}
+    for store_name, levels in zip(matrix.index, matrix.to_numpy()):
+        store_averages[store_name] = np.divide(
+            np.bincount(month_index, weights=levels, minlength=n_months), wd_in_month,
+            out=np.zeros(n_months), where=wd_in_month > 0,
+        )
+    averages = {
+        group: sum((store_averages[name] for name in names), np.zeros(n_months))
+        for group, names in store_groups.items()
+    }
+    averages['total'] = sum(averages.values(), np.zeros(n_months))
+
+    return {
+        year: {
+            group: values[(year - first_year) * 12:(year - first_year + 1) * 12].tolist()
+            for group, values in averages.items()
+        }
+        for year in years
+    }
@@ -0,0 +1,203 @@
+import os
+import tempfile
+import traceback
+from datetime import datetime, timedelta
+
+import pandas as pd
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job
+from .process_excel import make_flat_table, read_inventory_report
+from .utils_import import import_sales, import_inventory
+from .utils_place_order import place_order, write_order_workbook
+from .utils_classification import classify_products
+from .utils_forecast import refit_forecasts
+from .utils_seasonality import analyse_seasonality, get_seasonality_years
+from .utils_stat import calculate_sales_statistics, calculate_sales_global_statistics, roll_sales_statistics
+
+
+# Running jobs started longer ago belong to a worker that was killed
+JOB_TIMEOUT = timedelta(hours=6)
+
+
+def enqueue_job(kind, params=None, upload=None) -> Job:
+    """
+    Queue a job for the `run_jobs` worker.
+    Args:
+        kind (str): one of Job.KIND_CHOICES, e.g. Job.ORDER
+        params (dict): JSON serialisable arguments of the job
+        upload (UploadedFile): file to import, stored with the job
+    Returns:
+        Job: the queued job.
+    """
+    job = Job(kind=kind, params=params or {})
+    if upload is not None:
+        job.input_file.save(upload.name, upload, save=False)
+    job.save()
+    return job
+
+
+def fail_stale_jobs(timeout=JOB_TIMEOUT) -> int:
+    """
+    Mark running jobs started more than timeout ago as failed: their worker was killed
+    before it could save the outcome. They are not requeued, as an import may have
+    been partly committed.
+    Returns:
+        int: number of jobs marked failed.
+    """
+    return Job.objects.filter(status=Job.RUNNING, started_at__lt=timezone.now() - timeout).update(
+        status=Job.FAILED, message="The worker stopped before the job finished", finished_at=timezone.now(),
+    )
+
+
+def claim_next_job(timeout=JOB_TIMEOUT):
+    """
+    Oldest queued job, switched to running. The status is changed with a
+    conditional UPDATE, so two workers never run the same job. Stale running
+    jobs are marked failed first, see fail_stale_jobs.
+    Returns:
+        Job or None: None when the queue is empty.
+    """
+    fail_stale_jobs(timeout)
+    while True:
+        job = Job.objects.filter(status=Job.QUEUED).order_by('created_at', 'id').first()
+        if job is None:
+            return None
+        claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, started_at=timezone.now(), message="Started"
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def report_progress(job, progress, message=""):
+    """Save the progress (0 to 1) and the current step of a running job."""
+    job.progress = min(max(progress, 0.0), 1.0)
+    job.message = message[:200]
+    job.save(update_fields=['progress', 'message'])
+
+
+def run_job(job) -> Job:
+    """
+    Run a claimed job and store its result, or the error when it fails, including
+    a result that cannot be saved. The job never stays running.
+    """
+    try:
+        handler = JOB_HANDLERS[job.kind]
+        job.result = handler(job, lambda progress, message="": report_progress(job, progress, message))
+        job.status = Job.DONE
+        job.progress = 1.0
+        job.message = "Finished"
+        job.finished_at = timezone.now()
+        # a savepoint, so a failed save leaves the connection usable for saving the failure
+        with transaction.atomic():
+            job.save()
+    except Exception as e:
+        job.result = None
+        job.status = Job.FAILED
+        job.message = str(e)[:200]
+        job.error = traceback.format_exc()
+        job.finished_at = timezone.now()
+        job.save(update_fields=['result', 'status', 'message', 'error', 'finished_at'])
+    return job
+
+
+def get_job_status(job) -> dict:
+    """
+    Example return:
+        {'id': 7, 'kind': 'order', 'status': 'running', 'progress': 0.4, 'message': 'Computing orders',
+         'result': None, 'error': '', 'has_output': False}
+    """
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': job.result,
+        'error': job.error,
+        'has_output': bool(job.output_file),
+    }
+
+
+def _run_statistics(job, progress) -> dict:
+    start_date = datetime.strptime(job.params['start_date'], "%Y-%m-%d").date()
+    end_date = datetime.strptime(job.params['end_date'], "%Y-%m-%d").date()
+    if job.params.get('mode', 'incremental') == 'full':
+        execution = job.params.get('execution', 'serial')
+        progress(0.1, "Calculating store statistics")
+        statistics = calculate_sales_statistics(start_date, end_date, mode=execution)
+        progress(0.6, "Calculating global statistics")
+        calculate_sales_global_statistics(start_date, end_date, mode=execution)
+        progress(0.8, "Classifying products")
+        classes = classify_products(start_date, end_date)
+        progress(0.9, "Analysing seasonality")
+        seasonality = analyse_seasonality(get_seasonality_years(end_date))
+        progress(0.95, "Forecasting demand")
+        # up to the latest sales, which may be later than the statistics window
+        forecasts = refit_forecasts(full=True)
+        return {
+            'mode': 'full', 'products': len(statistics), 'classes': classes, 'seasonality': seasonality,
+            'forecasts': forecasts,
+        }
+    progress(0.1, "Moving the statistics window")
+    return roll_sales_statistics(start_date, end_date)
+
+
+def _run_order(job, progress) -> dict:
+    params = job.params
+    selected_months = params.get('selected_months')
+    reference_date = params.get('reference_date')
+    df, df_nsk, df_kem = place_order(
+        selected_months=[tuple(month) for month in selected_months] if selected_months else None,
+        skus=params.get('skus'),
+        reference_date=datetime.strptime(reference_date, "%Y-%m-%d").date() if reference_date else None,
+        n_top=params.get('n_top'),
+        abc_classes=params.get('abc_classes'),
+        progress=lambda share, message: progress(0.9 * share, message),
+    )
+
+    progress(0.9, "Writing the workbook")
+    today = str(datetime.today().date())
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"orders_{today}.xlsx")
+        write_order_workbook(path, {'All Orders': df, 'Novosibirsk': df_nsk, 'Kemerovo': df_kem})
+        with open(path, 'rb') as workbook:
+            job.output_file.save(f"orders_{today}.xlsx", File(workbook), save=False)
+    return {
+        'products': len(df),
+        'order_lines_nsk': len(df_nsk),
+        'order_lines_kem': len(df_kem),
+    }
+
+
+def _run_import_sales(job, progress) -> dict:
+    progress(0.1, "Reading the sales report")
+    with job.input_file.open('rb') as file:
+        data = pd.read_excel(file, engine='openpyxl')
+    df = make_flat_table(data)
+    progress(0.4, "Importing sales")
+    result = import_sales(df)
+    # carries the forecasts forward when the import completes a month, a no-op otherwise
+    progress(0.9, "Updating the demand forecasts")
+    result['forecasts'] = refit_forecasts()
+    return result
+
+
+def _run_import_inventory(job, progress) -> dict:
+    progress(0.1, "Reading the inventory report")
+    with job.input_file.open('rb') as file:
+        df = read_inventory_report(file)
+    progress(0.4, "Importing inventory")
+    return import_inventory(df)
+
+
+JOB_HANDLERS = {
+    Job.STATISTICS: _run_statistics,
+    Job.ORDER: _run_order,
+    Job.IMPORT_SALES: _run_import_sales,
+    Job.IMPORT_INVENTORY: _run_import_inventory,
+}
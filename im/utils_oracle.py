@@ -1,109 +1,232 @@
-from .models import Inventory, Store, ProductStoreStatistics
-from collections import defaultdict
+from .models import CurrentInventory, Store, ProductStoreStatistics, ProductClassification, WorkingDays
+from .utils_classification import SERVICE_LEVELS, get_product_classes
+from .utils_forecast import fit_history, get_fitted_forecast_demand, get_forecast_demand
+from .utils_policy import BRANCH, DEFAULT_SERVICE_LEVEL, HUB, compute_policy, order_up_to, round_to_pack
+from .utils_stat import get_sales_matrix
+from datetime import timedelta
+import logging
+import numpy as np
 
 
-class OracleAgent:
-    def __init__(self, product):
+logger = logging.getLogger(__name__)
+
+# Stores whose latest inventory counts towards each city
+CITY_STORES = {
+    'nsk': ["Novosibirsk Main", "Novosibirsk Reserve", "Novosibirsk Transit"],
+    'kem': ["Kemerovo Main", "Kemerovo Transit"],
+}
+# Stores whose sales statistics and lead time give the demand of each city
+SALE_STORES = {'nsk': 'Novosibirsk Main', 'kem': 'Kemerovo Main'}
+# Days of sales before the reference date giving the statistics and classes of a point in time agent
+POINT_IN_TIME_DAYS = 365
+
+
+class BatchOracleAgent:
+    """
+    Order policy for many products at once. Current inventory, lead times, sales
+    statistics and ABC/XYZ classes are loaded with a handful of queries and the
+    (s, S) policy of utils_policy is computed for every product and city as NumPy arrays.
+    The lead time demand comes from the seasonal forecasts of utils_forecast where they exist.
+    Novosibirsk is the hub: its policy covers the demand and inventory of both cities.
+    A point in time agent computes the statistics, classes and forecasts from the sales
+    before reference_date instead of reading the stored ones, for backtests.
+    """
+    def __init__(self, products, reference_date=None, point_in_time=False):
         """
-        product: (Product class)
+        products: (iterable of Product), e.g. a Product queryset
+        reference_date: (date) first day of the lead time, the first forecast day by default
+        point_in_time: (bool) use only the sales of the POINT_IN_TIME_DAYS days before reference_date
         """
-        self.product = product
+        if point_in_time and reference_date is None:
+            raise ValueError("A point in time agent needs a reference_date.")
+        self.products = list(products)
+        self.reference_date = reference_date
+        self.point_in_time = point_in_time
         self.stores = ['nsk', 'kem']
+        self.product_index = {product.id: i for i, product in enumerate(self.products)}
+        store_names = [name for names in CITY_STORES.values() for name in names]
+        self.store_by_name = {store.name: store for store in Store.objects.filter(name__in=store_names)}
+        self.inv_levels = self._get_inventory_levels()
+        self.mean_demand, self.std_demand = self._get_demand_statistics()
+        self.service_levels = self._get_service_levels()
+        self.lead_time_demand = self._get_lead_time_demand()
 
-    def get_actions(self, verbose=False) -> list:
-        """
-        """
-        actions = [0, 0]
-        inv_levels: dict = self._get_inventory_level()  # {'nsk': 51, 'kem': 6}
-        future_demand = self._predict_demand()  # {'nsk': 396, 'kem': 5}        
-        S = self._get_S()
-        target_inventory = {}
-        
-        for i, store in enumerate(self.stores):
-            if store == 'kem':
-                target_inventory[store] = max(S[store] - inv_levels[store] + future_demand[store], 0)
-            elif store == 'nsk':
-                target_inventory[store] = max(
-                    S[store] - inv_levels['nsk'] - inv_levels['kem'] + future_demand['nsk'] + future_demand['kem'], 0
-                    )
-            actions[i] = self._get_correct_quantity(target_inventory[store])  
+    def get_actions(self, policy=None, verbose=False) -> dict:
+        """
+        Args:
+            policy (dict): result of get_policy(), computed when not given
+        Example output:
+            {'nsk': array([24., 0., 60.]), 'kem': array([4., 0., 12.])}
+        """
+        policy = policy or self.get_policy()
+        pack_size = np.array([product.order_pack for product in self.products], dtype=np.float64)
+        pack_threshold = np.array([product.pack_round_threshold for product in self.products], dtype=np.float64)
+        inventory_position = {
+            'nsk': self.inv_levels['nsk'] + self.inv_levels['kem'],
+            'kem': self.inv_levels['kem'],
+        }
+        actions = {
+            store: round_to_pack(
+                order_up_to(inventory_position[store], policy[store]['s'], policy[store]['S']), pack_size, pack_threshold
+            )
+            for store in self.stores
+        }
         if verbose:
-            for store in self.stores:
-                print(f'{store}: S = {S[store]}, Inv = {inv_levels[store]}, FutDem = {future_demand[store]}')
+            for i, product in enumerate(self.products):
+                for store in self.stores:
+                    logger.info(
+                        "%s %s: s = %s, S = %s, Inv = %s", product.sku, store,
+                        policy[store]['s'][i], policy[store]['S'][i], inventory_position[store][i],
+                    )
         return actions
-    
-    def _get_correct_quantity(self, target_inventory: int) -> int:
-        pack_size: int = self.product.order_pack  # how many in 1 pack 
-        order = (target_inventory // pack_size) * pack_size
-        rest = target_inventory % pack_size
-        if (rest / pack_size) > 0.4:
-            order += pack_size
-        return order
 
-    def _predict_demand(self) -> dict:
+    def get_policy(self) -> dict:
         """
+        (s, S) policy of every product and city, see utils_policy.compute_policy.
         Example output:
-            {'nsk': 396, 'kem': 5}
-        """
-        sale_stores = {'nsk': 'Novosibirsk Main', 'kem': 'Kemerovo Main' }
-        future_demand = {}
-        for store, store_name in sale_stores.items():
-            sales_mean = ProductStoreStatistics.objects.filter(
-                product=self.product, store=Store.objects.get(name=store_name)
-                ).first().sales_mean
-            lead_time = Store.objects.get(name=store_name).lead_time_mean
-            future_demand[store] = round(sales_mean * lead_time)  
-        return future_demand
-    
-    def _get_mean_demand(self) -> dict:
+            {'nsk': {'lead_time_demand': array([...]), 'safety_stock': array([...]), 's': array([...]), 'S': array([...])},
+             'kem': {...}}
+        """
+        S_days = np.array([product.S_days for product in self.products], dtype=np.float64)
+        return {
+            store: compute_policy(
+                inputs['mean_demand'], inputs['std_demand'], inputs['lead_time_mean'], inputs['lead_time_std'],
+                S_days, inputs['service_level'], inputs['lead_time_demand'],
+            )
+            for store, inputs in self.get_policy_inputs().items()
+        }
+
+    def get_policy_inputs(self) -> dict:
         """
+        compute_policy arguments of every city but the cycle days, also used by the backtest.
+        The Novosibirsk echelon sums the means and variances of both cities.
         Example output:
-            {'nsk': 24.2185, 'kem': 5.212}
-        """
-        sale_stores = {'nsk': 'Novosibirsk Main', 'kem': 'Kemerovo Main' }
-        mean_demand = {}
-        for store, store_name in sale_stores.items():
-            sales_mean = ProductStoreStatistics.objects.filter(
-                product=self.product, store=Store.objects.get(name=store_name)
-                ).first().sales_mean
-            mean_demand[store] = sales_mean  
-        return mean_demand
-    
-    def _get_S(self) -> dict:
-        mean_demand = self._get_mean_demand()
-        S = {}
-        S['nsk'] = int((mean_demand['nsk'] + mean_demand['kem']) * (self.product.S_days + 3 )  )  #### <-- changed
-        S['kem'] = int(mean_demand['kem'] * (self.product.S_days - 10))
-        return S
+            {'nsk': {'mean_demand': array([...]), 'std_demand': array([...]), 'lead_time_demand': array([...]),
+                     'service_level': array([...]), 'lead_time_mean': 3.0, 'lead_time_std': 1.0},
+             'kem': {...}}
+        """
+        demand = {
+            HUB: (
+                self.mean_demand[HUB] + self.mean_demand[BRANCH],
+                np.sqrt(self.std_demand[HUB] ** 2 + self.std_demand[BRANCH] ** 2),
+            ),
+            BRANCH: (self.mean_demand[BRANCH], self.std_demand[BRANCH]),
+        }
+        inputs = {}
+        for store, store_name in SALE_STORES.items():
+            sale_store = self.store_by_name[store_name]
+            mean_demand, std_demand = demand[store]
+            inputs[store] = {
+                'mean_demand': mean_demand,
+                'std_demand': std_demand,
+                'lead_time_demand': self.lead_time_demand[store],
+                'service_level': self.service_levels[store],
+                'lead_time_mean': sale_store.lead_time_mean,
+                'lead_time_std': sale_store.lead_time_std,
+            }
+        return inputs
 
-    def _get_inventory_level(self) -> dict:
+    def _get_lead_time_demand(self) -> dict:
         """
-        Returns:
-            inv_levels: (dict), inventory level for each city
+        Forecast demand over the lead time of each city, nan for products without a forecast.
+        The Novosibirsk echelon adds the forecasts of both sale stores over its lead time.
+        Example output:
+            {'nsk': array([118.2, nan]), 'kem': array([21.4, nan])}
         """
+        product_ids = list(self.product_index)
+        hub_store, branch_store = (self.store_by_name[SALE_STORES[store]] for store in (HUB, BRANCH))
+        if self.point_in_time:
+            fit = fit_history(self.reference_date - timedelta(days=1), [hub_store, branch_store])
 
-        # Define stores grouped by city
-        city_stores = {
-            'nsk': ["Novosibirsk Main", "Novosibirsk Reserve", "Novosibirsk Transit"],
-            'kem': ["Kemerovo Main", "Kemerovo Transit"]
+            def forecast(store, days):
+                return get_fitted_forecast_demand(fit, product_ids, store, days, self.reference_date)
+        else:
+            def forecast(store, days):
+                return get_forecast_demand(product_ids, store, days, self.reference_date)
+        return {
+            HUB: sum(forecast(store, hub_store.lead_time_mean) for store in (hub_store, branch_store)),
+            BRANCH: forecast(branch_store, branch_store.lead_time_mean),
         }
 
-        # Initialize inventory levels
-        inv_levels = defaultdict(int)
-
-        # Query the latest inventory for each store
-        for city, stores in city_stores.items():
-            for store_name in stores:
-                store = Store.objects.filter(name=store_name).first()
-                if store:
-                    inventory = Inventory.objects.filter(product=self.product, store=store).order_by('-date').first()
-                    inv_levels[city] += inventory.inventory_level if inventory else 0
+    def _get_history_window(self) -> tuple:
+        """First and last day of the sales a point in time agent learns from."""
+        return self.reference_date - timedelta(days=POINT_IN_TIME_DAYS), self.reference_date - timedelta(days=1)
 
-        return dict(inv_levels)
+    def _get_demand_statistics(self) -> tuple:
+        """
+        Mean and standard deviation of the daily sales at the sale store of each city,
+        0 without statistics.
+        """
+        store_city = {self.store_by_name[name].id: store for store, name in SALE_STORES.items()}
+        if self.point_in_time:
+            start_date, end_date = self._get_history_window()
+            working_days = list(
+                WorkingDays.objects.filter(date__range=(start_date, end_date)).order_by('date').values_list('date', flat=True)
+            )
+            sale_stores = [self.store_by_name[SALE_STORES[store]] for store in self.stores]
+            # days without sales count as 0, as in calculate_sales_statistics; [None] gives 0 without working days
+            sales = get_sales_matrix(self.products, sale_stores, working_days or [None], start_date, end_date)
+            return (
+                {store: sales[:, j].mean(axis=1) for j, store in enumerate(self.stores)},
+                {store: sales[:, j].std(axis=1) for j, store in enumerate(self.stores)},
+            )
+        mean_demand = {store: np.zeros(len(self.products)) for store in self.stores}
+        std_demand = {store: np.zeros(len(self.products)) for store in self.stores}
+        statistics = ProductStoreStatistics.objects.filter(
+            product_id__in=list(self.product_index), store_id__in=list(store_city)
+        ).values_list('product_id', 'store_id', 'sales_mean', 'sales_std')
+        for product_id, store_id, sales_mean, sales_std in statistics:
+            i = self.product_index[product_id]
+            if sales_mean is not None:
+                mean_demand[store_city[store_id]][i] = sales_mean
+            if sales_std is not None:
+                std_demand[store_city[store_id]][i] = sales_std
+        return mean_demand, std_demand
 
-    def _get_number_of_packs(self, order_quantity_good: int) -> int:
-        packs_number = round(order_quantity_good / self.store_env.env_config['order_pack'])
-        return packs_number
+    def _get_service_levels(self) -> dict:
+        """
+        Service level of the ABC/XYZ class of every product at the sale store of each city,
+        DEFAULT_SERVICE_LEVEL for products without a class.
+        Example output:
+            {'nsk': array([0.99, 0.95]), 'kem': array([0.9, 0.85])}
+        """
+        store_city = {self.store_by_name[name].id: store for store, name in SALE_STORES.items()}
+        service_levels = {store: np.full(len(self.products), DEFAULT_SERVICE_LEVEL) for store in self.stores}
+        if self.point_in_time:
+            computed = get_product_classes(*self._get_history_window())
+            classes = [
+                row for row in zip(
+                    computed['product_ids'].tolist(), computed['store_ids'].tolist(),
+                    computed['abc'].tolist(), computed['xyz'].tolist(),
+                )
+                if row[0] in self.product_index and row[1] in store_city
+            ]
+        else:
+            classes = ProductClassification.objects.filter(
+                product_id__in=list(self.product_index), store_id__in=list(store_city)
+            ).values_list('product_id', 'store_id', 'abc_class', 'xyz_class')
+        for product_id, store_id, abc_class, xyz_class in classes:
+            level = SERVICE_LEVELS.get(abc_class + xyz_class)
+            if level is not None:
+                service_levels[store_city[store_id]][self.product_index[product_id]] = level
+        return service_levels
 
+    def _get_inventory_levels(self) -> dict:
+        """
+        Sum of the latest inventory of every store of each city.
+        Example output:
+            {'nsk': array([51., 0.]), 'kem': array([6., 2.])}
+        """
+        store_city = {
+            self.store_by_name[name].id: city
+            for city, names in CITY_STORES.items() for name in names if name in self.store_by_name
+        }
+        latest = CurrentInventory.objects.filter(
+            product_id__in=list(self.product_index),
+            store_id__in=list(store_city),
+        ).values_list('product_id', 'store_id', 'inventory_level')
 
-    
+        inv_levels = {city: np.zeros(len(self.products)) for city in CITY_STORES}
+        for product_id, store_id, inventory_level in latest:
+            inv_levels[store_city[store_id]][self.product_index[product_id]] += inventory_level
+        return inv_levels
@@ -0,0 +1,136 @@
+import math
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Kept free of Django imports: process pool workers import this module on their own
+EXECUTION_MODES = ('serial', 'thread', 'process')
+STATISTICS_KEYS = ('mean', 'std', 'sum', 'sumsq')
+
+# Shared memory segment name of every array allocated by shared_zeros, by data address
+_shared_names = {}
+# (workers, executor) of the process pool kept between calls
+_process_pool = None
+
+
+def row_statistics(sales) -> dict:
+    """
+    Mean, population standard deviation, sum and sum of squares over the last axis.
+    Args:
+        sales (np.ndarray): int64 daily sales, e.g. (products, stores, days)
+    Returns:
+        dict: arrays shaped like sales without its last axis.
+    Example return:
+        {'mean': array([[2.5, 0.]]), 'std': array([[1.1, 0.]]), 'sum': array([[10, 0]]), 'sumsq': array([[30, 0]])}
+    """
+    values = sales.astype(np.float64)
+    return {
+        'mean': values.mean(axis=-1),
+        'std': values.std(axis=-1),
+        'sum': sales.sum(axis=-1),
+        'sumsq': (sales ** 2).sum(axis=-1),
+    }
+
+
+def partition(n_rows, n_parts) -> list:
+    """
+    Contiguous (start, stop) ranges splitting n_rows into at most n_parts nearly equal parts.
+    Example return:
+        [(0, 4), (4, 7), (7, 10)]
+    """
+    bounds = np.linspace(0, n_rows, min(n_parts, n_rows) + 1).astype(int) if n_rows else [0]
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _release_shared(address, shm):
+    _shared_names.pop(address, None)
+    shm.unlink()
+
+
+def shared_zeros(shape, dtype=np.int64) -> np.ndarray:
+    """
+    np.zeros in a shared memory segment. parallel_row_statistics hands such an
+    array to the process workers by name instead of copying it; the segment is
+    released together with the array.
+    """
+    dtype = np.dtype(dtype)
+    # a new segment is zero-filled
+    shm = shared_memory.SharedMemory(create=True, size=max(math.prod(shape) * dtype.itemsize, 1))
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _shared_names[array.ctypes.data] = shm.name
+    weakref.finalize(array, _release_shared, array.ctypes.data, shm)
+    return array
+
+
+def _get_process_pool(workers) -> ProcessPoolExecutor:
+    """Process pool of the given size, started once and reused by the following calls."""
+    global _process_pool
+    if _process_pool is None or _process_pool[0] != workers:
+        if _process_pool is not None:
+            _process_pool[1].shutdown()
+        _process_pool = (workers, ProcessPoolExecutor(max_workers=workers))
+    return _process_pool[1]
+
+
+def _discard_process_pool():
+    """Forget a pool whose worker died, the next call starts a new one."""
+    global _process_pool
+    _process_pool = None
+
+
+def _shared_row_statistics(shm_name, shape, dtype, start, stop) -> dict:
+    """Process pool task: row_statistics of rows start:stop of a matrix in shared memory."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    sales = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    result = row_statistics(sales[start:stop])
+    del sales  # release the buffer before closing
+    shm.close()
+    return result
+
+
+def parallel_row_statistics(sales, mode='serial', workers=None) -> dict:
+    """
+    row_statistics of a matrix whose first axis (the SKUs) is partitioned across workers.
+    Threads read the matrix directly. Processes of a pool kept between calls attach to
+    the matrix in shared memory: an array of shared_zeros as it is, any other array
+    after a copy. The partial results are concatenated in row order.
+    Args:
+        sales (np.ndarray): int64 daily sales with the SKUs on the first axis
+        mode (str): 'serial', 'thread' or 'process'
+        workers (int): pool size, the number of CPUs by default
+    Returns:
+        dict: same as row_statistics(sales).
+    """
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode {mode!r}, use one of {', '.join(EXECUTION_MODES)}.")
+    workers = workers or os.cpu_count() or 1
+    parts = partition(len(sales), workers)
+    if mode == 'serial' or len(parts) <= 1:
+        return row_statistics(sales)
+
+    if mode == 'thread':
+        with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            results = list(pool.map(lambda part: row_statistics(sales[part[0]:part[1]]), parts))
+    else:
+        shared_name = _shared_names.get(sales.ctypes.data) if sales.flags.c_contiguous else None
+        if shared_name is None:
+            shared = shared_zeros(sales.shape, sales.dtype)
+            shared[...] = sales
+            sales, shared_name = shared, _shared_names[shared.ctypes.data]
+        pool = _get_process_pool(len(parts))
+        try:
+            futures = [
+                pool.submit(_shared_row_statistics, shared_name, sales.shape, sales.dtype.str, start, stop)
+                for start, stop in parts
+            ]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            _discard_process_pool()
+            raise
+
+    return {key: np.concatenate([result[key] for result in results]) for key in STATISTICS_KEYS}
@@ -1,137 +1,172 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime
+import xlsxwriter
+from datetime import datetime, timedelta
 
-from .models import Product
-from im.utils_oracle import OracleAgent
-from im.utils_stat import get_month_sales_by_location, calculate_sales_statistics, calculate_sales_global_statistics
-from im.quaries import get_top_products_by_sales
-import os
-import pandas as pd
-from datetime import datetime
+from django.db.models import Sum
+
+from .models import Product, DailySales, ProductClassification
+from im.utils_oracle import BatchOracleAgent, SALE_STORES
+from im.utils_ranking import get_trailing_top_products
+from im.quaries import get_latest_sales_date, month_range
+
+
+EXPORT_CHUNK_ROWS = 5000
+# Months of sales shown next to the order when no months are given
+ORDER_SALES_MONTHS = 3
+
+
+def get_order_months(reference_date, n_months=ORDER_SALES_MONTHS) -> list:
+    """
+    The n_months calendar months up to and including the month of reference_date.
+    Example return:
+        [(2024, 10), (2024, 11), (2024, 12)]
+    """
+    last = reference_date.year * 12 + reference_date.month - 1
+    return [(index // 12, index % 12 + 1) for index in range(last - n_months + 1, last + 1)]
 
 
-def place_order(selected_months):
+def get_monthly_sales_by_location(products, selected_months) -> dict:
+    """
+    Sales of every product per location in each month, one grouped query per month
+    over the DailySales rollup.
+    Args:
+        products (list): Product objects, order of the arrays
+        selected_months (list of tuple): (year, month) tuples
+    Returns:
+        dict: (year, month) -> location -> int64 array aligned with products.
+    Example return:
+        {(2024, 10): {'novosibirsk': array([612, 0]), 'kemerovo': array([90, 0])}}
+    """
+    product_index = {product.id: i for i, product in enumerate(products)}
+    sales_by_month = {}
+    for year, month in selected_months:
+        start, end = month_range(year, month)
+        sales = {location: np.zeros(len(products), dtype=np.int64) for location in ('novosibirsk', 'kemerovo')}
+        totals = (
+            DailySales.objects.filter(date__gte=start, date__lt=end, store__location__in=list(sales))
+            .values('product_id', 'store__location')
+            .annotate(total_sales=Sum('quantity'))
+            .values_list('product_id', 'store__location', 'total_sales')
+        )
+        for product_id, location, total_sales in totals:
+            if product_id in product_index:
+                sales[location][product_index[product_id]] = total_sales or 0
+        sales_by_month[(year, month)] = sales
+    return sales_by_month
+
+
+def place_order(
+    selected_months=None, skus=None, reference_date=None, n_top=None, abc_classes=None, policy_columns=False,
+    progress=None,
+):
     """
-    Place an order and save the results to an Excel file.
+    Order of every product for Novosibirsk and Kemerovo, computed for the whole
+    catalogue at once from prefetched inventory, statistics and monthly sales.
 
     Args:
         selected_months (list of tuple): List of (year, month) tuples for sales data inclusion.
                                          Example: [(2024, 10), (2024, 11)]
+                                         By default the ORDER_SALES_MONTHS months up to reference_date.
+        skus (iterable): SKUs to order, None for the whole catalogue.
+        reference_date (date): date of the order run, the latest sales date by default.
+        n_top (int): keep only the n_top best selling products of the 12 months up to reference_date.
+        abc_classes (iterable): keep only the products of these ABC classes at the sale store
+                                of either city, e.g. ['A', 'B']. The classes are read from
+                                ProductClassification, like the service levels of the oracle.
+        policy_columns (bool): also return the reorder_point_* and order_up_to_* columns of the (s, S) policy.
+        progress (callable): optional progress(share, message) callback, share from 0 to 1.
 
     Returns:
-        pd.DataFrame: Order dataframe.
+        (pd.DataFrame, pd.DataFrame, pd.DataFrame): all products, Novosibirsk and Kemerovo order lines.
     """
-
-    # Calculate Average day sales
-    start_date = "2024-11-01"
-    end_date   = "2024-12-13"
-    #calculate_sales_statistics(start_date, end_date)
-    #calculate_sales_global_statistics(start_date, end_date)
-
-    # Ensure output directory exists
-    output_dir = "orders_excel"
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Prepare date for filename
-    date = datetime.today().strftime("%Y-%m-%d")
-
-    # Initialize order dictionary
-    order = {
-        'sku': [],
-        'name': [],
-        'manufacturer': [],
-        'item_weight': [],
-        'order_nsk': [],
-        'order_nsk_weight': [],
-        'order_kem': [],
-        'order_kem_weight': [],
-        'inv_level': [],
-        'inv_level_nsk': [],
-        'inv_level_kem': [],
-        # 'av_sales': [],
-        # 'av_sales_nsk': [],
-        # 'av_sales_kem': [],
-    }
-
-    # Add dynamic columns for selected months
-    sales_columns = {}
-    for year, month in selected_months:
+    reference_date = reference_date or get_latest_sales_date()
+    if selected_months is None:
+        selected_months = get_order_months(reference_date)
+
+    products = Product.objects.order_by('id')
+    if skus is not None:
+        products = products.filter(sku__in=list(skus))
+    if n_top is not None:
+        top = get_trailing_top_products(n_top, reference_date)
+        products = products.filter(id__in=[row['product__id'] for row in top])
+    if abc_classes is not None:
+        classified = ProductClassification.objects.filter(
+            abc_class__in=list(abc_classes), store__name__in=list(SALE_STORES.values())
+        )
+        products = products.filter(id__in=classified.values('product_id'))
+
+    # Inventory, lead times, sales statistics and classes of all products are prefetched at once
+    if progress:
+        progress(0.1, "Computing orders")
+    # the lead time of today's order starts the day after the latest sales
+    agent = BatchOracleAgent(products, reference_date=reference_date + timedelta(days=1))
+    policy = agent.get_policy()
+    actions = agent.get_actions(policy)
+    weights = np.array([product.weight for product in agent.products], dtype=np.float64)
+
+    order = pd.DataFrame({
+        'sku': [product.sku for product in agent.products],
+        'name': [product.name for product in agent.products],
+        'manufacturer': [product.manufacturer for product in agent.products],
+        'item_weight': weights,
+        'order_nsk': actions['nsk'],
+        'order_nsk_weight': actions['nsk'] * weights,
+        'order_kem': actions['kem'],
+        'order_kem_weight': actions['kem'] * weights,
+        'inv_level': agent.inv_levels['nsk'] + agent.inv_levels['kem'],
+        'inv_level_nsk': agent.inv_levels['nsk'],
+        'inv_level_kem': agent.inv_levels['kem'],
+    })
+    if policy_columns:
+        for store in agent.stores:
+            order[f'reorder_point_{store}'] = policy[store]['s'].round()
+            order[f'order_up_to_{store}'] = policy[store]['S'].round()
+
+    # Monthly sales
+    if progress:
+        progress(0.6, "Loading monthly sales")
+    for (year, month), sales in get_monthly_sales_by_location(agent.products, selected_months).items():
         month_name = datetime(year, month, 1).strftime('%b').lower()  # e.g., "oct"
-        sales_columns[f'sales_{month_name}'] = []
-        sales_columns[f'sales_{month_name}_nsk'] = []
-        sales_columns[f'sales_{month_name}_kem'] = []
-    order.update(sales_columns)
-
-    # Pre-fetch sales data for selected months
-    sales_data_by_month = {
-        (year, month): get_month_sales_by_location(year, month)
-        for year, month in selected_months
-    }
+        order[f'sales_{month_name}'] = sales['novosibirsk'] + sales['kemerovo']
+        order[f'sales_{month_name}_nsk'] = sales['novosibirsk']
+        order[f'sales_{month_name}_kem'] = sales['kemerovo']
+    if progress:
+        progress(1.0, "Order computed")
 
-    q =  get_top_products_by_sales(221)
-    skus = q.values_list('product__sku', flat=True)
-    mannol_products = Product.objects.filter(sku__in=skus)
-    for product in mannol_products: # Product.objects.all()
-        agent = OracleAgent(product)
-        actions = agent.get_actions()
-
-        # Populate static product data
-        order['sku'].append(product.sku)
-        order['name'].append(product.name)
-        order['manufacturer'].append(product.manufacturer)
-        order['item_weight'].append(product.weight)
-
-        # Calculate orders and weights
-        order_nsk, order_kem = actions[0], actions[1]
-        order['order_nsk'].append(order_nsk)
-        order['order_kem'].append(order_kem)
-        order['order_nsk_weight'].append(order_nsk * product.weight)
-        order['order_kem_weight'].append(order_kem * product.weight)
-
-        # Inventory levels
-        inv_levels = agent._get_inventory_level()
-        nsk_inv = inv_levels.get('nsk', 0)
-        kem_inv = inv_levels.get('kem', 0)
-        order['inv_level_nsk'].append(nsk_inv)
-        order['inv_level_kem'].append(kem_inv)
-        order['inv_level'].append(nsk_inv + kem_inv)
-
-        # Monthly sales
-        for (year, month), sales_data in sales_data_by_month.items():
-            month_name = datetime(year, month, 1).strftime('%b').lower()
-            month_sales = sales_data.get(product.sku, {})
-            order[f'sales_{month_name}_nsk'].append(month_sales.get('novosibirsk', 0))
-            order[f'sales_{month_name}_kem'].append(month_sales.get('kemerovo', 0))
-            order[f'sales_{month_name}'].append(
-                month_sales.get('novosibirsk', 0) + month_sales.get('kemerovo', 0)
-            )
-
-    # Create dataframe and save to Excel
-    df = pd.DataFrame(order)
-    
-    ######### save locally
-    #output_path = os.path.join(output_dir, f'order_{date}.xlsx')
-    #df.to_excel(output_path, index=False)
-    #print(f"Order saved to {output_path}")
-
-    df_nsk_order = df.query('order_nsk > 0')[['sku', 'name', 'order_nsk', 'order_nsk_weight']]
-    df_kem_order = df.query('order_kem > 0')[['sku', 'name', 'order_kem', 'order_kem_weight']]
-
-    return df, df_nsk_order, df_kem_order
+    df_nsk_order = order.query('order_nsk > 0')[['sku', 'name', 'order_nsk', 'order_nsk_weight']]
+    df_kem_order = order.query('order_kem > 0')[['sku', 'name', 'order_kem', 'order_kem_weight']]
+
+    return order, df_nsk_order, df_kem_order
 
 def calculate_order_weight(df) -> dict:
     """
     Example output:
-        {
-            "nsk: 960,
-            "kem": 0
-        }
+        {'nsk': 960, 'kem': 0}
+    """
+    return {
+        'nsk': df.order_nsk_weight.sum(),
+        'kem': df.order_kem_weight.sum(),
+    }
+
+def write_order_workbook(path, sheets, chunk_rows=EXPORT_CHUNK_ROWS) -> None:
+    """
+    Write order sheets to an .xlsx file with XlsxWriter in constant_memory mode:
+    every row is flushed to disk once written, so memory does not grow with the order.
+    Args:
+        path (str): output file
+        sheets (dict): sheet name -> DataFrame, e.g. {'All Orders': df, 'Novosibirsk': df_nsk}
+        chunk_rows (int): rows converted to Python values at a time
     """
-    order_weight = {
-        'nsk': df.order_nsk_weight.sum(), 
-        'kem': df.order_kem_weight.sum(), 
-        }
-    order_weight_of_ones = {'nsk': 0, 'kem': 0}
-    
-      
-    return order_weight, order_weight_of_ones
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    for sheet_name, df in sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(column) for column in df.columns], header_format)
+        # constant_memory needs the rows in order; NaN cells are left empty like DataFrame.to_excel
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            values = chunk.astype(object).where(chunk.notna(), None)
+            for row, cells in enumerate(values.itertuples(index=False, name=None), start=start + 1):
+                worksheet.write_row(row, 0, cells)
+    workbook.close()
@@ -0,0 +1,349 @@
+import numpy as np
+from scipy.stats import norm
+
+
+# Kept free of Django imports: process pool workers of the parameter sweep import this module on their own
+
+# Cycle service level of products without an ABC/XYZ class
+DEFAULT_SERVICE_LEVEL = 0.95
+# Lead times are drawn up to mean + MAX_LEAD_TIME_STD * std days
+MAX_LEAD_TIME_STD = 4
+# The hub city buys from the supplier for both cities and replenishes the branch city from its stock
+HUB, BRANCH = 'nsk', 'kem'
+
+
+def compute_policy(mean_demand, std_demand, lead_time_mean, lead_time_std, cycle_days, service_level,
+                   lead_time_demand=None) -> dict:
+    """
+    (s, S) policy of many SKU-store pairs at once. The demand over a random lead time
+    has mean d * L and variance L * std_d^2 + d^2 * std_L^2; the safety stock covers it
+    at the service level, s is the lead time demand plus the safety stock and S adds
+    the demand of cycle_days days. All arguments broadcast against each other.
+    Args:
+        mean_demand, std_demand (np.ndarray): daily sales mean and standard deviation
+        lead_time_mean, lead_time_std (float or np.ndarray): lead time in days
+        cycle_days (np.ndarray): days of demand covered by one order, e.g. Product.S_days
+        service_level (float or np.ndarray): probability of no stockout during the lead time
+        lead_time_demand (np.ndarray): forecast demand over the lead time replacing d * L, nan where missing
+    Returns:
+        dict: arrays 'lead_time_demand', 'safety_stock', 's' (reorder point) and 'S' (order-up-to level).
+    Example return:
+        {'lead_time_demand': array([96., 0.]), 'safety_stock': array([41.3, 0.]),
+         's': array([137.3, 0.]), 'S': array([857.3, 0.])}
+    """
+    mean_demand = np.maximum(np.asarray(mean_demand, dtype=np.float64), 0)
+    std_demand = np.maximum(np.asarray(std_demand, dtype=np.float64), 0)
+    lead_time_mean = np.asarray(lead_time_mean, dtype=np.float64)
+    lead_time_std = np.asarray(lead_time_std, dtype=np.float64)
+
+    if lead_time_demand is None:
+        lead_time_demand = mean_demand * lead_time_mean
+    else:
+        lead_time_demand = np.asarray(lead_time_demand, dtype=np.float64)
+        lead_time_demand = np.where(np.isnan(lead_time_demand), mean_demand * lead_time_mean, lead_time_demand)
+    lead_time_std_demand = np.sqrt(lead_time_mean * std_demand ** 2 + mean_demand ** 2 * lead_time_std ** 2)
+    z = norm.ppf(np.asarray(service_level, dtype=np.float64))
+    safety_stock = np.maximum(z, 0) * lead_time_std_demand
+    s = lead_time_demand + safety_stock
+    return {
+        'lead_time_demand': lead_time_demand,
+        'safety_stock': safety_stock,
+        's': s,
+        'S': s + mean_demand * np.asarray(cycle_days, dtype=np.float64),
+    }
+
+
+def order_up_to(inventory_position, s, S) -> np.ndarray:
+    """
+    Order quantities of an (s, S) policy: up to S when the inventory position is at or below s, else 0.
+    Example return:
+        array([720., 0.])
+    """
+    inventory_position = np.asarray(inventory_position, dtype=np.float64)
+    return np.where(inventory_position <= s, np.maximum(S - inventory_position, 0), 0.0)
+
+
+def round_to_pack(target_inventory, pack_size, threshold=0.4):
+    """
+    Round order quantities down to whole packs, adding one more pack when the
+    rest is more than threshold of a pack. Works on scalars and NumPy arrays.
+    """
+    order = (target_inventory // pack_size) * pack_size
+    rest = target_inventory % pack_size
+    return np.where(rest / pack_size > threshold, order + pack_size, order)
+
+
+def _draw_lead_times(rng, n, lead_time_mean, lead_time_std, max_lead) -> np.ndarray:
+    lead_time = rng.normal(lead_time_mean, lead_time_std, n) if lead_time_std > 0 else np.full(n, lead_time_mean)
+    return np.clip(np.rint(lead_time), 1, max_lead).astype(np.int64)
+
+
+def simulate_policy(demand, initial_inventory, s, S, pack_size, lead_time_mean, lead_time_std=0.0,
+                    review_days=1, seed=None, pack_threshold=0.4) -> dict:
+    """
+    Replay daily demand against an (s, S) policy for every SKU at once, one step per day.
+    Each day the deliveries due arrive, demand is served from stock (unserved demand is lost)
+    and, on review days, SKUs whose inventory position (stock plus open orders) is at or below s
+    order up to S in whole packs. Every order gets its own lead time, drawn from a normal
+    distribution and rounded to whole days (at least 1).
+    Args:
+        demand (np.ndarray): (SKUs, days) demand
+        initial_inventory, s, S, pack_size (np.ndarray): per SKU
+        lead_time_mean, lead_time_std (float): lead time in days
+        review_days (int): days between two order reviews
+        seed (int): seed of the lead time draws
+        pack_threshold (float or np.ndarray): rounding threshold of round_to_pack, per SKU or for all
+    Returns:
+        dict: per SKU arrays 'demand', 'sold', 'lost', 'fill_rate', 'stockout_days',
+              'average_inventory', 'orders' and 'ordered'.
+    """
+    demand = np.asarray(demand, dtype=np.float64)
+    n_skus, n_days = demand.shape
+    rng = np.random.default_rng(seed)
+    max_lead = max(1, int(np.ceil(lead_time_mean + MAX_LEAD_TIME_STD * lead_time_std)))
+    pipeline = np.zeros((max_lead + 1, n_skus))  # deliveries by arrival day modulo max_lead + 1
+
+    on_hand = np.maximum(np.asarray(initial_inventory, dtype=np.float64), 0).copy()
+    on_order = np.zeros(n_skus)
+    sold, lost, inventory_sum, ordered = (np.zeros(n_skus) for _ in range(4))
+    stockout_days, orders = np.zeros(n_skus, dtype=np.int64), np.zeros(n_skus, dtype=np.int64)
+
+    for day in range(n_days):
+        slot = day % len(pipeline)
+        on_hand += pipeline[slot]
+        on_order -= pipeline[slot]
+        pipeline[slot] = 0
+
+        sales = np.minimum(on_hand, demand[:, day])
+        shortage = demand[:, day] - sales
+        on_hand -= sales
+        sold += sales
+        lost += shortage
+        stockout_days += shortage > 0
+
+        if day % review_days == 0:
+            quantity = round_to_pack(order_up_to(on_hand + on_order, s, S), pack_size, pack_threshold)
+            placed = np.flatnonzero(quantity > 0)
+            if len(placed):
+                lead_time = _draw_lead_times(rng, len(placed), lead_time_mean, lead_time_std, max_lead)
+                # one order per SKU and day, so the (slot, SKU) pairs are unique
+                pipeline[(day + lead_time) % len(pipeline), placed] += quantity[placed]
+                on_order[placed] += quantity[placed]
+                orders[placed] += 1
+                ordered[placed] += quantity[placed]
+        inventory_sum += on_hand
+
+    total_demand = demand.sum(axis=1)
+    fill_rate = np.ones(n_skus)
+    np.divide(sold, total_demand, out=fill_rate, where=total_demand > 0)
+    return {
+        'demand': total_demand,
+        'sold': sold,
+        'lost': lost,
+        'fill_rate': fill_rate,
+        'stockout_days': stockout_days,
+        'average_inventory': inventory_sum / max(n_days, 1),
+        'orders': orders,
+        'ordered': ordered,
+    }
+
+
+def simulate_echelon_policy(hub, branch, review_days=1, seed=None) -> dict:
+    """
+    Replay daily demand against the two echelon policy of the order run, every SKU at once.
+    The hub orders from the supplier up to its S when its echelon position (its stock and
+    open orders plus the branch stock and transfers in transit) is at or below its s; the
+    branch orders up to its S from the hub, which ships what it has on hand. Demand is
+    served from the local stock and unserved demand is lost. Every order and transfer
+    gets its own lead time, as in simulate_policy.
+    Args:
+        hub, branch (dict): per SKU arrays 'demand' (SKUs, days), 'initial_inventory', 's', 'S',
+                            'pack_size', 'pack_threshold' and scalars 'lead_time_mean', 'lead_time_std'
+                            (for the branch, the transfer time from the hub)
+        review_days (int): days between two order reviews
+        seed (int): seed of the lead time draws
+    Returns:
+        dict: {HUB: ..., BRANCH: ...} with the simulate_policy arrays of each store; the
+              branch 'orders' and 'ordered' are the transfers from the hub.
+    """
+    rng = np.random.default_rng(seed)
+    stores = {HUB: hub, BRANCH: branch}
+    n_skus, n_days = np.shape(hub['demand'])
+    state = {}
+    for name, inputs in stores.items():
+        max_lead = max(1, int(np.ceil(inputs['lead_time_mean'] + MAX_LEAD_TIME_STD * inputs['lead_time_std'])))
+        state[name] = {
+            'demand': np.asarray(inputs['demand'], dtype=np.float64),
+            'max_lead': max_lead,
+            'pipeline': np.zeros((max_lead + 1, n_skus)),  # arrivals by day modulo max_lead + 1
+            'on_hand': np.maximum(np.asarray(inputs['initial_inventory'], dtype=np.float64), 0).copy(),
+            'on_order': np.zeros(n_skus),
+            'sold': np.zeros(n_skus), 'lost': np.zeros(n_skus), 'inventory_sum': np.zeros(n_skus),
+            'ordered': np.zeros(n_skus), 'stockout_days': np.zeros(n_skus, dtype=np.int64),
+            'orders': np.zeros(n_skus, dtype=np.int64),
+        }
+
+    def place(name, day, quantity):
+        store = state[name]
+        placed = np.flatnonzero(quantity > 0)
+        if len(placed):
+            inputs = stores[name]
+            lead_time = _draw_lead_times(
+                rng, len(placed), inputs['lead_time_mean'], inputs['lead_time_std'], store['max_lead']
+            )
+            store['pipeline'][(day + lead_time) % len(store['pipeline']), placed] += quantity[placed]
+            store['on_order'][placed] += quantity[placed]
+            store['orders'][placed] += 1
+            store['ordered'][placed] += quantity[placed]
+
+    hub_state, branch_state = state[HUB], state[BRANCH]
+    for day in range(n_days):
+        for store in state.values():
+            slot = day % len(store['pipeline'])
+            store['on_hand'] += store['pipeline'][slot]
+            store['on_order'] -= store['pipeline'][slot]
+            store['pipeline'][slot] = 0
+
+            sales = np.minimum(store['on_hand'], store['demand'][:, day])
+            shortage = store['demand'][:, day] - sales
+            store['on_hand'] -= sales
+            store['sold'] += sales
+            store['lost'] += shortage
+            store['stockout_days'] += shortage > 0
+
+        if day % review_days == 0:
+            wanted = round_to_pack(
+                order_up_to(branch_state['on_hand'] + branch_state['on_order'], branch['s'], branch['S']),
+                branch['pack_size'], branch['pack_threshold'],
+            )
+            shipped = np.minimum(wanted, hub_state['on_hand'])
+            hub_state['on_hand'] -= shipped
+            place(BRANCH, day, shipped)
+
+            echelon_position = (
+                hub_state['on_hand'] + hub_state['on_order'] + branch_state['on_hand'] + branch_state['on_order']
+            )
+            place(HUB, day, round_to_pack(
+                order_up_to(echelon_position, hub['s'], hub['S']), hub['pack_size'], hub['pack_threshold'],
+            ))
+        for store in state.values():
+            store['inventory_sum'] += store['on_hand']
+
+    results = {}
+    for name, store in state.items():
+        total_demand = store['demand'].sum(axis=1)
+        fill_rate = np.ones(n_skus)
+        np.divide(store['sold'], total_demand, out=fill_rate, where=total_demand > 0)
+        results[name] = {
+            'demand': total_demand,
+            'sold': store['sold'],
+            'lost': store['lost'],
+            'fill_rate': fill_rate,
+            'stockout_days': store['stockout_days'],
+            'average_inventory': store['inventory_sum'] / max(n_days, 1),
+            'orders': store['orders'],
+            'ordered': store['ordered'],
+        }
+    return results
+
+
+def evaluate_policy(city_inputs, S_days, pack_threshold, review_days=1, seed=None) -> dict:
+    """
+    Backtest the two echelon (s, S) policy of the hub and branch cities over every demand
+    scenario and price it. The policy of each city is computed as BatchOracleAgent.get_policy
+    does, from the demand parameters of its echelon.
+    Args:
+        city_inputs (dict): HUB and BRANCH inputs with per SKU arrays 'demand' (scenarios, SKUs, days)
+                            and 'initial_inventory' of the city's stores; the compute_policy arguments
+                            'mean_demand', 'std_demand', 'lead_time_demand' and 'service_level' of its
+                            echelon; 'pack_size', 'weights' and 'lost_demand_cost'; and the store scalars
+                            'lead_time_mean', 'lead_time_std', 'holding_cost_kg' (per kg and day)
+                            and 'ordering_cost_kg'
+        S_days, pack_threshold (np.ndarray): settings of every SKU
+    Returns:
+        dict: city -> the simulate_policy arrays averaged over the scenarios, plus
+              'holding_cost', 'ordering_cost', 'lost_demand_cost' and 'cost'.
+    """
+    n_scenarios, n_skus, n_days = city_inputs[HUB]['demand'].shape
+    stores = {}
+    for city, inputs in city_inputs.items():
+        policy = compute_policy(
+            inputs['mean_demand'], inputs['std_demand'], inputs['lead_time_mean'], inputs['lead_time_std'],
+            S_days, inputs['service_level'], inputs['lead_time_demand'],
+        )
+        # scenarios are stacked along the SKU axis
+        stores[city] = {
+            'demand': inputs['demand'].reshape(-1, n_days),
+            **{key: np.tile(np.broadcast_to(values, n_skus), n_scenarios) for key, values in (
+                ('initial_inventory', inputs['initial_inventory']), ('s', policy['s']), ('S', policy['S']),
+                ('pack_size', inputs['pack_size']), ('pack_threshold', pack_threshold),
+            )},
+            'lead_time_mean': inputs['lead_time_mean'],
+            'lead_time_std': inputs['lead_time_std'],
+        }
+    simulated = simulate_echelon_policy(stores[HUB], stores[BRANCH], review_days, seed)
+
+    results = {}
+    for city, inputs in city_inputs.items():
+        result = {key: values.reshape(n_scenarios, n_skus).mean(axis=0) for key, values in simulated[city].items()}
+        result['holding_cost'] = result['average_inventory'] * inputs['weights'] * inputs['holding_cost_kg'] * n_days
+        result['ordering_cost'] = result['ordered'] * inputs['weights'] * inputs['ordering_cost_kg']
+        result['lost_demand_cost'] = result['lost'] * inputs['lost_demand_cost']
+        result['cost'] = result['holding_cost'] + result['ordering_cost'] + result['lost_demand_cost']
+        results[city] = result
+    return results
+
+
+def sweep_policy_grid(city_inputs, S_days_grid, threshold_grid, min_fill_rate, review_days=1, seed=None) -> dict:
+    """
+    Best S_days and pack rounding threshold of every SKU on a grid. Every grid point is
+    backtested at once (the SKUs are repeated once per point) with evaluate_policy; the
+    cheapest point whose fill rate over both cities reaches min_fill_rate wins, or the
+    point with the best fill rate when none does.
+    Args:
+        city_inputs (dict): evaluate_policy inputs of the HUB and BRANCH cities
+        S_days_grid, threshold_grid (list): values to try
+        min_fill_rate (float): service target, e.g. 0.95
+    Returns:
+        dict: per SKU arrays 'S_days', 'pack_round_threshold', 'cost', 'fill_rate' and 'demand'.
+    Example return:
+        {'S_days': array([20., 45.]), 'pack_round_threshold': array([0.4, 0.8]), 'cost': array([812.5, 64.1]),
+         'fill_rate': array([0.97, 0.95]), 'demand': array([2510., 310.])}
+    """
+    S_days_points, threshold_points = (
+        values.ravel() for values in np.meshgrid(np.asarray(S_days_grid, float), np.asarray(threshold_grid, float))
+    )
+    n_points = len(S_days_points)
+    n_skus = city_inputs[HUB]['demand'].shape[1]
+    repeated = {
+        city: {
+            **{key: np.tile(values, n_points) if isinstance(values, np.ndarray) else values
+               for key, values in inputs.items() if key != 'demand'},
+            'demand': np.tile(inputs['demand'], (1, n_points, 1)),
+        }
+        for city, inputs in city_inputs.items()
+    }
+    results = evaluate_policy(
+        repeated, np.repeat(S_days_points, n_skus), np.repeat(threshold_points, n_skus), review_days, seed,
+    )
+    cost, sold, demand = (
+        sum(result[key].reshape(n_points, n_skus) for result in results.values()) for key in ('cost', 'sold', 'demand')
+    )
+
+    fill_rate = np.ones_like(sold)
+    np.divide(sold, demand, out=fill_rate, where=demand > 0)
+    feasible = fill_rate >= min_fill_rate
+    best = np.where(
+        feasible.any(axis=0),
+        np.where(feasible, cost, np.inf).argmin(axis=0),
+        # lexsort: best fill rate first, then the lowest cost
+        np.lexsort((cost, -fill_rate), axis=0)[0],
+    )
+    skus = np.arange(cost.shape[1])
+    return {
+        'S_days': S_days_points[best],
+        'pack_round_threshold': threshold_points[best],
+        'cost': cost[best, skus],
+        'fill_rate': fill_rate[best, skus],
+        'demand': demand[0],
+    }
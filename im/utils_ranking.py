@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+from datetime import date
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .models import DailySales, Product, ProductSalesRanking
+
+
+RANKING_BATCH_SIZE = 5000
+# Ranking criteria of get_top_products and get_abc_classes
+RANKING_FIELDS = {'value': 'sale_value', 'quantity': 'quantity', 'weight': 'weight_quantity'}
+# Cumulative shares of the ranking criterion closing the A and B classes
+ABC_THRESHOLDS = (0.8, 0.95)
+TOTAL_COLUMNS = ['quantity', 'sale_value']
+# Months of sales ranked by get_trailing_top_products
+TRAILING_MONTHS = 12
+
+
+def _monthly_totals(daily_sales) -> pd.DataFrame:
+    """Totals of a DailySales queryset per product, location, year and month, from one grouped query."""
+    totals = (
+        daily_sales.annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values('product_id', 'store__location', 'year', 'month')
+        .annotate(total=Sum('quantity'), total_value=Sum('sale_value'))
+        .values_list('product_id', 'store__location', 'year', 'month', 'total', 'total_value')
+    )
+    return pd.DataFrame(
+        list(totals), columns=['product_id', 'location', 'year', 'month', *TOTAL_COLUMNS]
+    )
+
+
+def _ranking_rows(monthly) -> list:
+    """
+    ProductSalesRanking rows of the monthly totals: every month and the whole year (month 0),
+    every location and all locations (location '').
+    """
+    periods = pd.concat([monthly, monthly.assign(month=0)], ignore_index=True)
+    by_location = periods.dropna(subset=['location']).groupby(
+        ['product_id', 'year', 'month', 'location'], as_index=False
+    )[TOTAL_COLUMNS].sum()
+    all_locations = periods.groupby(['product_id', 'year', 'month'], as_index=False)[TOTAL_COLUMNS].sum()
+    rows = pd.concat([by_location, all_locations.assign(location='')], ignore_index=True)
+
+    weights = dict(Product.objects.filter(id__in=rows['product_id'].unique().tolist()).values_list('id', 'weight'))
+    rows['weight_quantity'] = rows['quantity'] * rows['product_id'].map(weights).fillna(0)
+    return [
+        ProductSalesRanking(
+            product_id=int(product_id), year=int(year), month=int(month), location=location,
+            quantity=int(quantity or 0), sale_value=float(sale_value or 0), weight_quantity=float(weight_quantity),
+        )
+        for product_id, year, month, location, quantity, sale_value, weight_quantity in zip(
+            rows['product_id'], rows['year'], rows['month'], rows['location'],
+            rows['quantity'], rows['sale_value'], rows['weight_quantity'],
+        )
+    ]
+
+
+def refresh_sales_ranking(keys) -> int:
+    """
+    Recompute the ranking of the products and years touched by a sales import,
+    from the DailySales rollup.
+    Args:
+        keys (iterable): (product_id, date) tuples
+    Returns:
+        int: number of ranking rows written.
+    """
+    keys = {(int(product_id), day) for product_id, day in keys}
+    if not keys:
+        return 0
+    product_ids = sorted({product_id for product_id, _ in keys})
+    years = sorted({day.year for _, day in keys})
+
+    monthly = pd.concat(
+        [
+            _monthly_totals(DailySales.objects.filter(
+                product_id__in=product_ids, date__gte=date(year, 1, 1), date__lt=date(year + 1, 1, 1)
+            ))
+            for year in years
+        ],
+        ignore_index=True,
+    )
+    rows = _ranking_rows(monthly)
+    with transaction.atomic():
+        ProductSalesRanking.objects.bulk_create(
+            rows,
+            batch_size=RANKING_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['product', 'year', 'month', 'location'],
+            update_fields=['quantity', 'sale_value', 'weight_quantity'],
+        )
+    return len(rows)
+
+
+def rebuild_sales_ranking() -> int:
+    """
+    Rebuild the whole ProductSalesRanking table from DailySales, e.g. after product weights change.
+    Returns:
+        int: number of ranking rows.
+    """
+    rows = _ranking_rows(_monthly_totals(DailySales.objects.all()))
+    with transaction.atomic():
+        ProductSalesRanking.objects.all().delete()
+        ProductSalesRanking.objects.bulk_create(rows, batch_size=RANKING_BATCH_SIZE)
+    return len(rows)
+
+
+def get_top_products(n_top, year, month=0, location='', by='value'):
+    """
+    Best selling products of a period, read in index order from ProductSalesRanking.
+    Args:
+        n_top (int): number of products, None for all of them
+        year (int): year of the period
+        month (int): month of the period, 0 for the whole year
+        location (str): store location, '' for all locations
+        by (str): 'value', 'quantity' or 'weight' (quantity times product weight)
+    Returns:
+        QuerySet: dicts with 'product__id', 'product__sku', 'quantity', 'sale_value' and 'weight_quantity'.
+    """
+    if by not in RANKING_FIELDS:
+        raise ValueError(f"Unknown ranking {by!r}, use one of {', '.join(RANKING_FIELDS)}.")
+    ranking = (
+        ProductSalesRanking.objects.filter(year=year, month=month, location=location)
+        .order_by(f'-{RANKING_FIELDS[by]}', 'product_id')
+        .values('product__id', 'product__sku', 'quantity', 'sale_value', 'weight_quantity')
+    )
+    return ranking[:n_top] if n_top is not None else ranking
+
+
+def get_trailing_top_products(n_top, reference_date, n_months=TRAILING_MONTHS, location='', by='value'):
+    """
+    Best selling products of the n_months calendar months up to and including the
+    month of reference_date, summed from the monthly rows of ProductSalesRanking.
+    Args:
+        n_top (int): number of products, None for all of them
+        reference_date (date): last day of the window, its month counts in full
+        n_months (int): length of the window in months
+        location (str): store location, '' for all locations
+        by (str): 'value', 'quantity' or 'weight' (quantity times product weight)
+    Returns:
+        QuerySet: dicts with 'product__id', 'product__sku', 'quantity', 'sale_value' and 'weight_quantity'.
+    """
+    if by not in RANKING_FIELDS:
+        raise ValueError(f"Unknown ranking {by!r}, use one of {', '.join(RANKING_FIELDS)}.")
+    last = reference_date.year * 12 + reference_date.month - 1
+    first = last - n_months + 1
+    months = Q()
+    for year in range(first // 12, last // 12 + 1):
+        months |= Q(year=year, month__range=(max(first - year * 12, 0) + 1, min(last - year * 12, 11) + 1))
+    ranking = (
+        ProductSalesRanking.objects.filter(months, location=location)
+        .values('product__id', 'product__sku')
+        .annotate(quantity=Sum('quantity'), sale_value=Sum('sale_value'), weight_quantity=Sum('weight_quantity'))
+        .order_by(f'-{RANKING_FIELDS[by]}', 'product__id')
+    )
+    return ranking[:n_top] if n_top is not None else ranking
+
+
+def get_abc_classes(year, month=0, location='', by='value', thresholds=ABC_THRESHOLDS) -> dict:
+    """
+    ABC class of every product sold in a period: the best sellers making the first
+    thresholds[0] of the total are A, up to thresholds[1] B, the rest C.
+    Products without sales in the period are not in the result.
+    Example return:
+        {22: 'A', 38: 'A', 6: 'B', 14: 'C'}
+    """
+    ranking = get_top_products(None, year, month, location, by)
+    ranking = list(ranking.values_list('product_id', RANKING_FIELDS[by]))
+    if not ranking:
+        return {}
+    product_ids, values = zip(*ranking)
+    values = np.maximum(np.array(values, dtype=np.float64), 0)
+    total = values.sum()
+    # share of the total sold by the better ranked products
+    share_before = (np.cumsum(values) - values) / total if total > 0 else np.ones(len(values))
+    classes = np.where(share_before < thresholds[0], 'A', np.where(share_before < thresholds[1], 'B', 'C'))
+    return dict(zip(product_ids, classes.tolist()))
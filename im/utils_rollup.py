@@ -0,0 +1,168 @@
+import pandas as pd
+from django.db import transaction
+from django.db.models import Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Sale, DailySales, Inventory, CurrentInventory
+
+
+ROLLUP_BATCH_SIZE = 5000
+CHANGE_COLUMNS = ['product_id', 'store_id', 'date', 'old', 'new']
+
+
+def _sales_totals(sales):
+    """Daily totals of the given Sale queryset as (product, store, date, quantity, sale_value, cost) rows."""
+    return (
+        sales.values('product', 'store', 'sale_date')
+        .annotate(
+            total=Coalesce(Sum('quantity'), 0),
+            total_value=Coalesce(Sum('sale_value'), 0.0),
+            total_cost=Coalesce(Sum('cost'), 0.0),
+        )
+        .values_list('product', 'store', 'sale_date', 'total', 'total_value', 'total_cost')
+    )
+
+
+def refresh_daily_sales(keys) -> pd.DataFrame:
+    """
+    Recompute DailySales (quantity, sale_value, cost) for the (product, store, date)
+    keys touched by an import.
+    Args:
+        keys (iterable): (product_id, store_id, date) tuples
+    Returns:
+        pd.DataFrame: keys whose daily quantity changed, with the old and new quantity.
+    Example return:
+           product_id  store_id        date  old  new
+        0          12         1  2024-11-05    4    9
+    """
+    keys = {(int(product_id), int(store_id), day) for product_id, store_id, day in keys}
+    if not keys:
+        return pd.DataFrame(columns=CHANGE_COLUMNS)
+
+    dates = [day for _, _, day in keys]
+    store_ids = list({store_id for _, store_id, _ in keys})
+    date_range = (min(dates), max(dates))
+
+    totals = _sales_totals(Sale.objects.filter(sale_date__range=date_range, store_id__in=store_ids))
+    new = {(product_id, store_id, day): values for product_id, store_id, day, *values in totals}
+    existing = DailySales.objects.filter(date__range=date_range, store_id__in=store_ids).values_list(
+        'product', 'store', 'date', 'quantity', 'sale_value', 'cost'
+    )
+    old = {(product_id, store_id, day): values for product_id, store_id, day, *values in existing}
+
+    empty = [0, 0.0, 0.0]
+    rows = [
+        (*key, new.get(key, empty))
+        for key in keys
+        if old.get(key, empty) != new.get(key, empty)
+    ]
+    with transaction.atomic():
+        DailySales.objects.bulk_create(
+            [
+                DailySales(
+                    product_id=product_id, store_id=store_id, date=day,
+                    quantity=quantity, sale_value=sale_value, cost=cost,
+                )
+                for product_id, store_id, day, (quantity, sale_value, cost) in rows
+            ],
+            batch_size=ROLLUP_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['product', 'store', 'date'],
+            update_fields=['quantity', 'sale_value', 'cost'],
+        )
+    changes = [
+        (product_id, store_id, day, old.get((product_id, store_id, day), empty)[0], quantity)
+        for product_id, store_id, day, (quantity, _, _) in rows
+        if old.get((product_id, store_id, day), empty)[0] != quantity
+    ]
+    return pd.DataFrame(changes, columns=CHANGE_COLUMNS)
+
+
+def rebuild_daily_sales() -> int:
+    """
+    Rebuild the whole DailySales rollup from Sale.
+    Returns:
+        int: number of DailySales rows.
+    """
+    totals = _sales_totals(Sale.objects.all())
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailySales.objects.bulk_create(
+            (
+                DailySales(
+                    product_id=product_id, store_id=store_id, date=day,
+                    quantity=quantity, sale_value=sale_value, cost=cost,
+                )
+                for product_id, store_id, day, quantity, sale_value, cost in totals.iterator()
+            ),
+            batch_size=ROLLUP_BATCH_SIZE,
+        )
+    return DailySales.objects.count()
+
+
+def _latest_inventory(inventories):
+    """Latest row of every (product, store) of the given Inventory queryset."""
+    latest_date = (
+        Inventory.objects.filter(product=OuterRef('product'), store=OuterRef('store'))
+        .order_by('-date')
+        .values('date')[:1]
+    )
+    return inventories.filter(date=Subquery(latest_date)).values_list(
+        'product', 'store', 'date', 'inventory_level'
+    )
+
+
+def refresh_current_inventory(pairs) -> int:
+    """
+    Update CurrentInventory for the (product, store) pairs touched by an inventory import.
+    Args:
+        pairs (iterable): (product_id, store_id) tuples
+    Returns:
+        int: number of pairs whose current inventory changed.
+    """
+    pairs = {(int(product_id), int(store_id)) for product_id, store_id in pairs}
+    if not pairs:
+        return 0
+    product_ids = list({product_id for product_id, _ in pairs})
+    store_ids = list({store_id for _, store_id in pairs})
+
+    latest = _latest_inventory(Inventory.objects.filter(product_id__in=product_ids, store_id__in=store_ids))
+    existing = {
+        (product_id, store_id): (day, inventory_level)
+        for product_id, store_id, day, inventory_level in CurrentInventory.objects.filter(
+            product_id__in=product_ids, store_id__in=store_ids
+        ).values_list('product', 'store', 'date', 'inventory_level')
+    }
+    current = [
+        CurrentInventory(product_id=product_id, store_id=store_id, date=day, inventory_level=inventory_level)
+        for product_id, store_id, day, inventory_level in latest
+        if (product_id, store_id) in pairs and existing.get((product_id, store_id)) != (day, inventory_level)
+    ]
+    with transaction.atomic():
+        CurrentInventory.objects.bulk_create(
+            current,
+            batch_size=ROLLUP_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['product', 'store'],
+            update_fields=['date', 'inventory_level'],
+        )
+    return len(current)
+
+
+def rebuild_current_inventory() -> int:
+    """
+    Rebuild the whole CurrentInventory table from Inventory.
+    Returns:
+        int: number of CurrentInventory rows.
+    """
+    latest = _latest_inventory(Inventory.objects.all())
+    with transaction.atomic():
+        CurrentInventory.objects.all().delete()
+        CurrentInventory.objects.bulk_create(
+            (
+                CurrentInventory(product_id=product_id, store_id=store_id, date=day, inventory_level=inventory_level)
+                for product_id, store_id, day, inventory_level in latest.iterator()
+            ),
+            batch_size=ROLLUP_BATCH_SIZE,
+        )
+    return CurrentInventory.objects.count()
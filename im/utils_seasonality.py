@@ -1,27 +1,189 @@
-from statsmodels.tsa.seasonal import seasonal_decompose
-from scipy.stats import kruskal
-import pandas as pd
+import calendar
+from datetime import date
 
+import numpy as np
+from django.db import transaction
+from scipy.stats import chi2, rankdata
 
-def test_seasonality(sales24: list, sales23: list):
+from .models import Product, ProductSalesRanking, ProductSeasonality, WorkingDays
+from .utils_cache import bump_data_generation
+from .utils_inventory import DEFAULT_STORE_GROUPS
+
+
+SEASONALITY_PERIOD = 12
+SEASONALITY_ALPHA = 0.05
+SEASONALITY_YEARS = 2
+SEASONALITY_BATCH_SIZE = 5000
+# '' is all locations, like ProductSalesRanking
+SEASONALITY_LOCATIONS = ('', *DEFAULT_STORE_GROUPS)
+
+
+def kruskal_rows(values, groups) -> tuple:
     """
+    Kruskal-Wallis test of every row of a matrix, the columns split into groups:
+    the same H (tie corrected) and p-value as scipy.stats.kruskal on the groups of each row.
     Args:
-        sales24: (list) monthly sales for 2024
-        sales23: (list) monthly sales for 2023
-    """
-    monthly_sales = [sales23[i::11] + sales24[i::11] for i in range(11)]  # Group by month
-    stat, p_value = kruskal(*monthly_sales)
-
-    # Decomposition - to plot 
-    sales24_series = pd.Series(sales24, index=pd.date_range('2024-01-01', periods=11, freq='ME'))
-    sales23_series = pd.Series(sales23, index=pd.date_range('2023-01-01', periods=11, freq='ME'))
-    ser = pd.concat([sales24_series, sales23_series])
-    decomposition = seasonal_decompose(ser, model='additive', period=11)
-    seasonal_decomposition = decomposition.seasonal
-
-    s_dec_chart_data = {
-        "labels": seasonal_decomposition.index.strftime('%B').tolist(),
-        "data": seasonal_decomposition.tolist()
-    }
+        values (np.ndarray): (series, observations)
+        groups (np.ndarray): group label of every column, e.g. the calendar month
+    Returns:
+        (np.ndarray, np.ndarray): H and p-value of every row, nan when all values of the row are equal.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n = values.shape
+    _, groups = np.unique(groups, return_inverse=True)
+    one_hot = np.eye(groups.max() + 1)[groups]
+    counts = one_hot.sum(axis=0)
+
+    rank_sums = rankdata(values, axis=1) @ one_hot
+    h = 12 / (n * (n + 1)) * (rank_sums ** 2 / counts).sum(axis=1) - 3 * (n + 1)
+
+    # tie correction 1 - sum(t^3 - t) / (n^3 - n) over the runs of equal values of every row
+    sorted_values = np.sort(values, axis=1)
+    new_run = np.ones((n_rows, n), dtype=bool)
+    new_run[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    run_sizes = np.bincount(np.cumsum(new_run.ravel()) - 1).astype(np.float64)
+    run_rows = np.flatnonzero(new_run.ravel()) // n
+    ties = np.bincount(run_rows, weights=run_sizes ** 3 - run_sizes, minlength=n_rows)
+    correction = 1 - ties / (n ** 3 - n)
+
+    h = np.divide(h, correction, out=np.full(n_rows, np.nan), where=correction > 0)
+    return h, chi2.sf(h, len(counts) - 1)
+
+
+def seasonal_indices(values, period=SEASONALITY_PERIOD) -> np.ndarray:
+    """
+    Seasonal component of the classical additive decomposition of every row, as
+    statsmodels seasonal_decompose(model='additive'): centred moving average trend,
+    mean of the detrended values of every phase, centred on 0.
+    Args:
+        values (np.ndarray): (series, observations), at least two periods
+    Returns:
+        np.ndarray: (series, period) index of every phase, starting with the first observation.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n = values.shape
+    if n < 2 * period:
+        raise ValueError(f"Seasonal indices need two full periods ({2 * period} observations), got {n}.")
+    weights = np.r_[0.5, np.ones(period - 1), 0.5] / period if period % 2 == 0 else np.ones(period) / period
+    half = len(weights) // 2
+
+    trend = np.full((n_rows, n), np.nan)
+    trend[:, half:n - half] = sum(weight * values[:, k:k + n - 2 * half] for k, weight in enumerate(weights))
+    detrended = values - trend
+    phases = np.arange(n) % period
+    indices = np.stack([np.nanmean(detrended[:, phases == phase], axis=1) for phase in range(period)], axis=1)
+    return indices - indices.mean(axis=1, keepdims=True)
+
+
+def get_seasonality_years(reference_date, n_years=SEASONALITY_YEARS) -> list:
+    """
+    The n_years whole calendar years up to reference_date.
+    Example return:
+        [2023, 2024]
+    """
+    last_year = reference_date.year if reference_date >= date(reference_date.year, 12, 31) else reference_date.year - 1
+    return list(range(last_year - n_years + 1, last_year + 1))
+
 
-    return stat, p_value, s_dec_chart_data
+def get_monthly_sales_matrix(years) -> tuple:
+    """
+    Sales per working day of every product with sales, in every location of
+    SEASONALITY_LOCATIONS and month of the years, from the monthly rows of
+    ProductSalesRanking.
+    Returns:
+        (np.ndarray, np.ndarray): product ids and a (products, locations, months) matrix.
+    """
+    first_year, last_year = min(years), max(years)
+    n_months = (last_year - first_year + 1) * 12
+    totals = ProductSalesRanking.objects.filter(
+        year__gte=first_year, year__lte=last_year, month__gt=0, location__in=SEASONALITY_LOCATIONS,
+    ).values_list('product_id', 'location', 'year', 'month', 'quantity')
+    location_index = {location: i for i, location in enumerate(SEASONALITY_LOCATIONS)}
+    rows = np.array(
+        [(product_id, location_index[location], year, month, quantity)
+         for product_id, location, year, month, quantity in totals],
+        dtype=np.int64,
+    ).reshape(-1, 5)
+
+    product_ids, product_index = np.unique(rows[:, 0], return_inverse=True)
+    sales = np.zeros((len(product_ids), len(SEASONALITY_LOCATIONS), n_months))
+    sales[product_index, rows[:, 1], (rows[:, 2] - first_year) * 12 + rows[:, 3] - 1] = rows[:, 4]
+
+    working_days = WorkingDays.objects.filter(date__gte=date(first_year, 1, 1), date__lt=date(last_year + 1, 1, 1))
+    wd_in_month = np.bincount(
+        [(day.year - first_year) * 12 + day.month - 1 for day in working_days.values_list('date', flat=True)],
+        minlength=n_months,
+    )
+    return product_ids, np.divide(sales, wd_in_month, out=np.zeros_like(sales), where=wd_in_month > 0)
+
+
+def analyse_seasonality(years) -> dict:
+    """
+    Kruskal-Wallis test of the calendar months and seasonal indices of every product and
+    location over whole years of monthly sales per working day, computed for the whole
+    catalogue at once. The ProductSeasonality table is replaced.
+    Args:
+        years (list): consecutive years, at least two, e.g. [2023, 2024]
+    Returns:
+        dict: number of analysed series and of significantly seasonal ones.
+    Example return:
+        {'series': 120, 'seasonal': 17}
+    """
+    product_ids, sales = get_monthly_sales_matrix(years)
+    series = sales.reshape(-1, sales.shape[2])
+    months = np.arange(series.shape[1]) % SEASONALITY_PERIOD
+    stats, p_values = kruskal_rows(series, months) if len(series) else (np.zeros(0), np.zeros(0))
+    indices = seasonal_indices(series) if len(series) else np.zeros((0, SEASONALITY_PERIOD))
+
+    with transaction.atomic():
+        ProductSeasonality.objects.all().delete()
+        ProductSeasonality.objects.bulk_create(
+            (
+                ProductSeasonality(
+                    product_id=product_id, location=location,
+                    kruskal_stat=None if np.isnan(stat) else stat, p_value=None if np.isnan(p_value) else p_value,
+                    seasonal_indices=row_indices, first_year=min(years), last_year=max(years),
+                )
+                for product_id, location, stat, p_value, row_indices in zip(
+                    np.repeat(product_ids, len(SEASONALITY_LOCATIONS)).tolist(),
+                    SEASONALITY_LOCATIONS * len(product_ids),
+                    stats.tolist(), p_values.tolist(), np.round(indices, 6).tolist(),
+                )
+            ),
+            batch_size=SEASONALITY_BATCH_SIZE,
+        )
+        transaction.on_commit(bump_data_generation)
+    return {'series': len(series), 'seasonal': int((p_values < SEASONALITY_ALPHA).sum())}
+
+
+def get_seasonal_products(location='', alpha=SEASONALITY_ALPHA):
+    """
+    Products with significant monthly seasonality (p-value below alpha) in a location, '' for all locations.
+    Returns:
+        QuerySet: Product objects.
+    """
+    return Product.objects.filter(seasonality__location=location, seasonality__p_value__lt=alpha)
+
+
+def get_product_seasonality(product) -> dict:
+    """
+    Stored seasonality of a product in every location, with the chart of the seasonal
+    component over the months of the window. None and an empty chart without a result.
+    Example return:
+        {'': {'kruskal_stat': 25.1, 'p_value': 0.009, 'chart': {'labels': ['January', ...], 'data': [1.2, ...]}},
+         'novosibirsk': {...}, 'kemerovo': {...}}
+    """
+    results = {
+        location: {'kruskal_stat': None, 'p_value': None, 'chart': {'labels': [], 'data': []}}
+        for location in SEASONALITY_LOCATIONS
+    }
+    for location, stat, p_value, indices, first_year, last_year in ProductSeasonality.objects.filter(
+        product=product, location__in=SEASONALITY_LOCATIONS
+    ).values_list('location', 'kruskal_stat', 'p_value', 'seasonal_indices', 'first_year', 'last_year'):
+        n_years = last_year - first_year + 1
+        results[location] = {
+            'kruskal_stat': stat,
+            'p_value': p_value,
+            'chart': {'labels': list(calendar.month_name[1:]) * n_years, 'data': indices * n_years},
+        }
+    return results
@@ -1,8 +1,18 @@
+import math
+
 from django.db.models import Sum
 from django.db import transaction
 from django.db.models.functions import Coalesce
-from .models import Product, Sale, WorkingDays, Store, ProductStoreStatistics, ProductStatistics
+from .models import Product, WorkingDays, Store, ProductStoreStatistics, ProductStatistics, DailySales
+from .quaries import month_range
+from .utils_parallel import parallel_row_statistics, shared_zeros
 import numpy as np
+import pandas as pd
+
+
+STATISTICS_BATCH_SIZE = 2000
+# Running totals of the statistics window, see update_sales_statistics and roll_sales_statistics
+WINDOW_FIELDS = ['window_start', 'window_end', 'n_days', 'sales_sum', 'sales_sumsq']
 
 
 def get_month_sales_by_location(year: int, month: int) -> dict:
@@ -19,12 +29,10 @@ def get_month_sales_by_location(year: int, month: int) -> dict:
     # Fetch all products
     products = Product.objects.all()
 
-    # Fetch sales data grouped by product and store location
+    # Fetch sales data from the DailySales rollup, grouped by product and store location
+    start, end = month_range(year, month)
     sales_data = (
-        Sale.objects.filter(
-            sale_date__year=year,
-            sale_date__month=month
-        )
+        DailySales.objects.filter(date__gte=start, date__lt=end)
         .values('product__sku', 'store__location')  # Group by product and location
         .annotate(total_sales=Coalesce(Sum('quantity'), 0))  # Aggregate sales
     )
@@ -61,20 +69,18 @@ def get_month_sales(year: int, month: int) -> dict:
         product.sku: {store.location: 0 for store in stores} for product in products
     }
 
-    # Query sales data for the given month
+    # Query sales data for the given month, one grouped query over the DailySales rollup
+    start, end = month_range(year, month)
+    sales_data = (
+        DailySales.objects.filter(date__gte=start, date__lt=end)
+        .values('product__sku', 'store__name')
+        .annotate(total_sales=Coalesce(Sum('quantity'), 0))  # Aggregate total sales
+    )
+    totals = {(sale['product__sku'], sale['store__name']): sale['total_sales'] for sale in sales_data}
     for store in stores:
         for product in products:
-            sales_data = (
-                Sale.objects.filter(
-                    product=product,
-                    store=store,
-                    sale_date__year=year,
-                    sale_date__month=month
-                )
-                .aggregate(total_sales=Coalesce(Sum('quantity'), 0))  # Aggregate total sales
-            )
             # Update the statistics with total sales for the product at the store
-            statistics[product.sku][store.name] = sales_data['total_sales']
+            statistics[product.sku][store.name] = totals.get((product.sku, store.name), 0)
 
     return statistics
 
@@ -89,16 +95,19 @@ def calculate_sales_statistics_product(start_date, end_date):
     # Step 3: Prepare results for each product
     product_statistics = []
 
+    # Step 4: Aggregate sales data of all products from the DailySales rollup, grouped by date
+    sales_data = (
+        DailySales.objects.filter(date__range=(start_date, end_date))
+        .values('product', 'date')
+        .annotate(total_sales=Coalesce(Sum('quantity'), 0))  # Coalesce ensures no NULLs
+    )
+    product_sales = {}
+    for sale in sales_data:
+        product_sales.setdefault(sale['product'], {})[sale['date']] = sale['total_sales']
+
     for product in products:
-        # Step 4: Aggregate sales data for the product, grouped by date
-        sales_data = (
-            Sale.objects.filter(product=product, sale_date__range=(start_date, end_date))
-            .values('sale_date')
-            .annotate(total_sales=Coalesce(Sum('quantity'), 0))  # Coalesce ensures no NULLs
-        )
-        
         # Map sales data to a dictionary for easy lookup
-        sales_dict = {sale['sale_date']: sale['total_sales'] for sale in sales_data}
+        sales_dict = product_sales.get(product.id, {})
 
         # Step 5: Generate a list of sales, using 0 for missing days
         sales_list = [sales_dict.get(day, 0) for day in working_days]
@@ -117,132 +126,351 @@ def calculate_sales_statistics_product(start_date, end_date):
     
     return product_statistics
 
-def calculate_sales_statistics(start_date, end_date):
+def get_sales_matrix(products, stores, working_days, start_date, end_date, out=None) -> np.ndarray:
+    """
+    Daily sales of every product at every store on every working day,
+    loaded with one query over the DailySales rollup.
+    Args:
+        products (list): Product objects, first axis
+        stores (list): Store objects, second axis
+        working_days (list): dates, third axis
+        out (np.ndarray): zero-filled int64 matrix to fill, e.g. from shared_zeros, a new one by default
+    Returns:
+        np.ndarray: int64 matrix of shape (len(products), len(stores), len(working_days)).
+    """
+    product_index = {product.id: i for i, product in enumerate(products)}
+    store_index = {store.id: i for i, store in enumerate(stores)}
+    day_index = {day: i for i, day in enumerate(working_days)}
+
+    sales_data = DailySales.objects.filter(date__range=(start_date, end_date), store__in=stores).values_list(
+        'product', 'store', 'date', 'quantity'
+    )
+    cells = [
+        (product_index[product_id], store_index[store_id], day_index[sale_date], total_sales)
+        for product_id, store_id, sale_date, total_sales in sales_data
+        if sale_date in day_index and product_id in product_index and store_id in store_index
+    ]
+
+    matrix = np.zeros((len(products), len(stores), len(working_days)), dtype=np.int64) if out is None else out
+    if cells:
+        i, j, k, totals = np.array(cells, dtype=np.int64).T
+        matrix[i, j, k] = totals
+    return matrix
+
+
+def _moments(sales_sum, sales_sumsq, n_days):
+    """Mean and population standard deviation from the running sums of a window."""
+    if not n_days:
+        return None, None
+    mean = sales_sum / n_days
+    return mean, math.sqrt(max(sales_sumsq / n_days - mean ** 2, 0.0))
+
+def _set_moments(stat):
+    stat.sales_mean, stat.sales_std = _moments(stat.sales_sum, stat.sales_sumsq, stat.n_days)
+    if isinstance(stat, ProductStatistics):
+        stat.S = stat.sales_mean * stat.product.S_days if stat.sales_mean is not None else None
+
+def calculate_sales_statistics(start_date, end_date, mode='serial', workers=None):
+    """
+    Mean and standard deviation of the daily sales of every (product, store) over
+    the working days of the period, saved to ProductStoreStatistics with one bulk upsert.
+    Args:
+        mode (str): 'serial', 'thread' or 'process', how the SKUs are split across workers
+        workers (int): pool size of the thread and process modes, the number of CPUs by default
+    Returns:
+        dict: per product and store 'sales_mean', 'sales_std' and 'sales_list'.
+    """
     # Step 1: Get all working days in the chosen period
-    working_days = WorkingDays.objects.filter(date__range=(start_date, end_date)).values_list('date', flat=True)
+    working_days = list(WorkingDays.objects.filter(date__range=(start_date, end_date)).values_list('date', flat=True))
 
     # Step 2: Retrieve all products and stores
-    products = Product.objects.all()
-    stores = Store.objects.all()
+    products = list(Product.objects.all())
+    stores = list(Store.objects.all())
+
+    # Step 3: Daily sales of every (product, store) pair, using 0 for missing days,
+    # in shared memory for the process workers
+    out = shared_zeros((len(products), len(stores), len(working_days))) if mode == 'process' else None
+    sales = get_sales_matrix(products, stores, working_days, start_date, end_date, out=out)
+
+    # Step 4: Mean and standard deviation of every row, running sums for incremental updates
+    moments = parallel_row_statistics(sales, mode=mode, workers=workers)
+    means, stds, sums, sumsqs = moments['mean'], moments['std'], moments['sum'], moments['sumsq']
 
-    # Step 3: Prepare results for each product and store
-    statistics_to_save = []
     statistics = {product.sku: {
         store.name: {
-            'sales_mean':  None,
-            'sales_std':   None,
-            'sales_list': [],
-        } for store in stores
-    } for product in products}
+            'sales_mean': means[i, j].item(),
+            'sales_std':  stds[i, j].item(),
+            'sales_list': sales[i, j].tolist(),
+        } for j, store in enumerate(stores)
+    } for i, product in enumerate(products)}
+
+    # Step 5: One bulk upsert of ProductStoreStatistics
+    statistics_to_save = [
+        ProductStoreStatistics(
+            product=product,
+            store=store,
+            sales_mean=means[i, j].item(),
+            sales_std=stds[i, j].item(),
+            window_start=start_date,
+            window_end=end_date,
+            n_days=len(working_days),
+            sales_sum=sums[i, j].item(),
+            sales_sumsq=sumsqs[i, j].item(),
+        )
+        for i, product in enumerate(products)
+        for j, store in enumerate(stores)
+    ]
+    with transaction.atomic():
+        ProductStoreStatistics.objects.bulk_create(
+            statistics_to_save,
+            batch_size=STATISTICS_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['product', 'store'],
+            update_fields=['sales_mean', 'sales_std', *WINDOW_FIELDS],
+        )
+    return statistics
 
-    for store in stores:
-        for product in products:
-            sales_data = (
-                Sale.objects.filter(
-                    product=product,
-                    store=store,
-                    sale_date__range=(start_date, end_date)
-                )
-                .values('sale_date')
-                .annotate(total_sales=Coalesce(Sum('quantity'), 0))  # Coalesce ensures no NULLs
-            )
-            
-            # Map sales data to a dictionary for easy lookup
-            sales_dict = {sale['sale_date']: sale['total_sales'] for sale in sales_data}
-
-            # Step 5: Generate a list of sales, using 0 for missing days
-            sales_list = [sales_dict.get(day, 0) for day in working_days]
-            
-            # Step 6: Calculate mean and standard deviation
-            mean_sales = np.mean(sales_list).item()
-            std_sales = np.std(sales_list).item()
-
-            statistics[product.sku][store.name]['sales_mean'] = mean_sales
-            statistics[product.sku][store.name]['sales_std']  = std_sales
-            statistics[product.sku][store.name]['sales_list'] = sales_list    
-
-            # Prepare object for saving
-            statistics_to_save.append(
-                ProductStoreStatistics(
-                    product=product,
-                    store=store,
-                    sales_mean=mean_sales,
-                    sales_std=std_sales
-                )
-            ) 
-
-    # Step 7: Bulk create or update ProductStoreStatistics
+def calculate_sales_global_statistics(start_date, end_date, mode='serial', workers=None):
+    """
+    Same as calculate_sales_statistics for the sales of every product over all stores,
+    saved to ProductStatistics together with S = mean * S_days.
+    """
+    working_days = list(WorkingDays.objects.filter(date__range=(start_date, end_date)).values_list('date', flat=True))
+    products = list(Product.objects.all())
+    stores = list(Store.objects.all())
+
+    # Daily sales of every product over all stores, using 0 for missing days
+    out = shared_zeros((len(products), len(working_days))) if mode == 'process' else None
+    sales = get_sales_matrix(products, stores, working_days, start_date, end_date).sum(axis=1, out=out)
+    moments = parallel_row_statistics(sales, mode=mode, workers=workers)
+    means, stds, sums, sumsqs = moments['mean'], moments['std'], moments['sum'], moments['sumsq']
+
+    statistics = {product.sku: {
+        'sales_mean': means[i].item(),
+        'sales_std':  stds[i].item(),
+        'sales_list': sales[i].tolist(),
+        'S': means[i].item() * product.S_days,
+    } for i, product in enumerate(products)}
+
+    statistics_to_save = [
+        ProductStatistics(
+            product=product,
+            sales_mean=statistics[product.sku]['sales_mean'],
+            sales_std=statistics[product.sku]['sales_std'],
+            S=statistics[product.sku]['S'],
+            window_start=start_date,
+            window_end=end_date,
+            n_days=len(working_days),
+            sales_sum=sums[i].item(),
+            sales_sumsq=sumsqs[i].item(),
+        )
+        for i, product in enumerate(products)
+    ]
     with transaction.atomic():
-        for stat in statistics_to_save:
-            # Update or create ensures idempotency
-            ProductStoreStatistics.objects.update_or_create(
-                product=stat.product,
-                store=stat.store,
-                defaults={
-                    'sales_mean': stat.sales_mean,
-                    'sales_std': stat.sales_std
-                }
-            )
+        ProductStatistics.objects.bulk_create(
+            statistics_to_save,
+            batch_size=STATISTICS_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['sales_mean', 'sales_std', 'S', *WINDOW_FIELDS],
+        )
     return statistics
 
-def calculate_sales_global_statistics(start_date, end_date):
-    working_days = WorkingDays.objects.filter(date__range=(start_date, end_date)).values_list('date', flat=True)
-    products = Product.objects.all()
+def _apply_deltas(model, statistics, changes, keys) -> int:
+    """
+    Add the delta and delta_sq columns of changes to the running sums of the
+    statistics whose window contains the changed day.
+    """
+    statistics = list(statistics)
+    if not statistics or changes.empty:
+        return 0
+    windows = pd.DataFrame(
+        [(stat.id, *(getattr(stat, key) for key in keys), stat.window_start, stat.window_end) for stat in statistics],
+        columns=['id', *keys, 'window_start', 'window_end'],
+    )
+    merged = changes.merge(windows, on=keys)
+    merged = merged[(merged['date'] >= merged['window_start']) & (merged['date'] <= merged['window_end'])]
+    deltas = merged.groupby('id')[['delta', 'delta_sq']].sum()
+
+    changed = []
+    for stat in statistics:
+        if stat.id not in deltas.index:
+            continue
+        stat.sales_sum += deltas.at[stat.id, 'delta'].item()
+        stat.sales_sumsq += deltas.at[stat.id, 'delta_sq'].item()
+        _set_moments(stat)
+        changed.append(stat)
+    with transaction.atomic():
+        model.objects.bulk_update(
+            changed, ['sales_mean', 'sales_std', 'S', *WINDOW_FIELDS], batch_size=STATISTICS_BATCH_SIZE
+        )
+    return len(changed)
+
+def update_sales_statistics(changes) -> dict:
+    """
+    Apply changed daily sales to ProductStoreStatistics and ProductStatistics.
+    Only statistics of the changed products whose window contains a changed
+    working day are read and written.
+    Args:
+        changes (pd.DataFrame): output of refresh_daily_sales (product_id, store_id, date, old, new)
+    Returns:
+        dict: number of updated statistics rows.
+    Example return:
+        {'store_statistics': 42, 'global_statistics': 17}
+    """
+    updated = {'store_statistics': 0, 'global_statistics': 0}
+    if changes.empty:
+        return updated
+    date_range = (changes['date'].min(), changes['date'].max())
+    working_days = set(WorkingDays.objects.filter(date__range=date_range).values_list('date', flat=True))
+    changes = changes[changes['date'].isin(working_days)]
+    if changes.empty:
+        return updated
+    product_ids = changes['product_id'].unique().tolist()
+
+    # Per store: the change of a daily total is the change of the running sums
+    store_changes = changes.assign(
+        delta=changes['new'] - changes['old'],
+        delta_sq=changes['new'] ** 2 - changes['old'] ** 2,
+    )
+    updated['store_statistics'] = _apply_deltas(
+        ProductStoreStatistics,
+        ProductStoreStatistics.objects.filter(product_id__in=product_ids, window_start__isnull=False),
+        store_changes,
+        ['product_id', 'store_id'],
+    )
 
-    # Step 3: Prepare results for each product and store
-    statistics_to_save = []
-    statistics = {product.sku: {  
-            'sales_mean':  None,
-            'sales_std':   None,
-            'sales_list': [],
-            'S': None,   
-    } for product in products}
+    # Global: squares are taken of the daily totals over all stores, read after the refresh
+    day_changes = store_changes.groupby(['product_id', 'date'], as_index=False)['delta'].sum()
+    totals = (
+        DailySales.objects.filter(product_id__in=product_ids, date__range=date_range)
+        .values('product', 'date')
+        .annotate(total=Sum('quantity'))
+        .values_list('product', 'date', 'total')
+    )
+    totals = {(product_id, day): total for product_id, day, total in totals}
+    new = np.array([totals.get(key, 0) for key in zip(day_changes['product_id'], day_changes['date'])], dtype=np.int64)
+    old = new - day_changes['delta'].to_numpy()
+    day_changes['delta_sq'] = new ** 2 - old ** 2
+    updated['global_statistics'] = _apply_deltas(
+        ProductStatistics,
+        ProductStatistics.objects.filter(product_id__in=product_ids, window_start__isnull=False).select_related('product'),
+        day_changes,
+        ['product_id'],
+    )
+    return updated
 
-    for product in products:
-        sales_data = (
-            Sale.objects.filter(
-                product=product,
-                sale_date__range=(start_date, end_date)
+def roll_sales_statistics(start_date, end_date) -> dict:
+    """
+    Move the statistics window to [start_date, end_date].
+    Only the working days entering or leaving the window are read from DailySales.
+    The statistics are calculated in full when no common window is stored, when
+    products or stores were added, or when working days inside the window changed.
+    Returns:
+        dict: how the statistics were brought up to date.
+    Example return:
+        {'mode': 'incremental', 'days_in': 21, 'days_out': 20}
+    """
+    windows = (
+        set(ProductStoreStatistics.objects.values_list('window_start', 'window_end', 'n_days').distinct())
+        | set(ProductStatistics.objects.values_list('window_start', 'window_end', 'n_days').distinct())
+    )
+    n_products, n_stores = Product.objects.count(), Store.objects.count()
+    complete = (
+        ProductStoreStatistics.objects.count() == n_products * n_stores
+        and ProductStatistics.objects.count() == n_products
+    )
+    old_days = set()
+    if len(windows) == 1 and complete:
+        (old_start, old_end, old_n_days), = windows
+        if old_start is not None:
+            old_days = set(WorkingDays.objects.filter(date__range=(old_start, old_end)).values_list('date', flat=True))
+    if not old_days or len(old_days) != old_n_days:
+        calculate_sales_statistics(start_date, end_date)
+        calculate_sales_global_statistics(start_date, end_date)
+        return {'mode': 'full', 'days_in': 0, 'days_out': 0}
+
+    new_days = set(WorkingDays.objects.filter(date__range=(start_date, end_date)).values_list('date', flat=True))
+    days_in, days_out = new_days - old_days, old_days - new_days
+    result = {'mode': 'incremental', 'days_in': len(days_in), 'days_out': len(days_out)}
+    if (old_start, old_end) == (start_date, end_date):
+        return result
+
+    sign = {**{day: 1 for day in days_in}, **{day: -1 for day in days_out}}
+    rows = pd.DataFrame(
+        list(DailySales.objects.filter(date__in=sorted(sign)).values_list('product', 'store', 'date', 'quantity')),
+        columns=['product_id', 'store_id', 'date', 'quantity'],
+    )
+    rows['sign'] = rows['date'].map(sign).astype(np.int64)
+    rows['delta'] = rows['sign'] * rows['quantity']
+    rows['delta_sq'] = rows['sign'] * rows['quantity'] ** 2
+    store_deltas = rows.groupby(['product_id', 'store_id'])[['delta', 'delta_sq']].sum()
+
+    day_totals = rows.groupby(['product_id', 'date', 'sign'], as_index=False)['quantity'].sum()
+    day_totals['delta'] = day_totals['sign'] * day_totals['quantity']
+    day_totals['delta_sq'] = day_totals['sign'] * day_totals['quantity'] ** 2
+    product_deltas = day_totals.groupby('product_id')[['delta', 'delta_sq']].sum()
+
+    for model, statistics, deltas in (
+        (ProductStoreStatistics, ProductStoreStatistics.objects.all(), store_deltas),
+        (ProductStatistics, ProductStatistics.objects.select_related('product'), product_deltas),
+    ):
+        statistics = list(statistics)
+        for stat in statistics:
+            key = (stat.product_id, stat.store_id) if model is ProductStoreStatistics else stat.product_id
+            if key in deltas.index:
+                stat.sales_sum += deltas.at[key, 'delta'].item()
+                stat.sales_sumsq += deltas.at[key, 'delta_sq'].item()
+            stat.window_start, stat.window_end, stat.n_days = start_date, end_date, len(new_days)
+            _set_moments(stat)
+        with transaction.atomic():
+            model.objects.bulk_update(
+                statistics, ['sales_mean', 'sales_std', 'S', *WINDOW_FIELDS], batch_size=STATISTICS_BATCH_SIZE
             )
-            .values('sale_date')
-            .annotate(total_sales=Coalesce(Sum('quantity'), 0))  # Coalesce ensures no NULLs
+    return result
+
+def read_sales_statistics():
+    """
+    Stored statistics in the shape returned by calculate_sales_statistics and
+    calculate_sales_global_statistics, without the daily sales lists.
+    Returns:
+        (dict, dict): statistics per product and store, statistics per product.
+    """
+    statistics = {}
+    for sku, store, sales_mean, sales_std in ProductStoreStatistics.objects.values_list(
+        'product__sku', 'store__name', 'sales_mean', 'sales_std'
+    ):
+        statistics.setdefault(sku, {})[store] = {'sales_mean': sales_mean, 'sales_std': sales_std}
+    statistics_global = {
+        sku: {'sales_mean': sales_mean, 'sales_std': sales_std, 'S': S}
+        for sku, sales_mean, sales_std, S in ProductStatistics.objects.values_list(
+            'product__sku', 'sales_mean', 'sales_std', 'S'
         )
-        
-        # Map sales data to a dictionary for easy lookup
-        sales_dict = {sale['sale_date']: sale['total_sales'] for sale in sales_data}
+    }
+    return statistics, statistics_global
 
-        # Step 5: Generate a list of sales, using 0 for missing days
-        sales_list = [sales_dict.get(day, 0) for day in working_days]
-        
-        # Step 6: Calculate mean and standard deviation
-        mean_sales = np.mean(sales_list).item()
-        std_sales = np.std(sales_list).item()
-
-        statistics[product.sku]['sales_mean'] = mean_sales
-        statistics[product.sku]['sales_std']  = std_sales
-        statistics[product.sku]['sales_list'] = sales_list    
-        statistics[product.sku]['S'] = mean_sales * product.S_days    
-
-        # Prepare object for saving
-        statistics_to_save.append(
-            ProductStatistics(
-                product=product,
-                sales_mean=mean_sales,
-                sales_std=std_sales,
-                S=statistics[product.sku]['S'],
-            )
-        ) 
 
-    # Step 7: Bulk create or update ProductStatistics
-    with transaction.atomic():
-        for stat in statistics_to_save:
-            # Update or create ensures idempotency
-            ProductStatistics.objects.update_or_create(
-                product=stat.product,
-                defaults={
-                    'sales_mean': stat.sales_mean,
-                    'sales_std': stat.sales_std,
-                    'S': stat.S,
-                }
-            )
-    return statistics
\ No newline at end of file
+def get_demand_parameters(products=None, stores=None) -> dict:
+    """
+    Daily sales mean and standard deviation of every SKU-store pair with statistics,
+    as arrays for the demand simulator (utils.iter_demand_scenarios).
+    Args:
+        products (QuerySet or list): products to include, all of them by default
+        stores (QuerySet or list): stores to include, all of them by default
+    Example return:
+        {'product_ids': array([1, 1, 2]), 'store_ids': array([1, 4, 1]),
+         'means': array([24.2, 5.2, 0.]), 'stds': array([8.1, 2.9, 0.])}
+    """
+    statistics = ProductStoreStatistics.objects.order_by('product_id', 'store_id')
+    if products is not None:
+        statistics = statistics.filter(product__in=products)
+    if stores is not None:
+        statistics = statistics.filter(store__in=stores)
+    rows = list(statistics.values_list('product_id', 'store_id', 'sales_mean', 'sales_std'))
+    product_ids, store_ids, means, stds = zip(*rows) if rows else ((), (), (), ())
+    return {
+        'product_ids': np.array(product_ids, dtype=np.int64),
+        'store_ids': np.array(store_ids, dtype=np.int64),
+        'means': np.array([mean or 0 for mean in means], dtype=np.float64),
+        'stds': np.array([std or 0 for std in stds], dtype=np.float64),
+    }
@@ -0,0 +1,161 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from django.db import transaction
+
+from .models import Product
+from .utils_backtest import get_backtest_inputs, slice_inputs
+from .utils_parallel import partition
+from .utils_policy import sweep_policy_grid
+
+
+SWEEP_BATCH_SIZE = 500
+DEFAULT_S_DAYS_GRID = (10, 15, 20, 30, 45, 60)
+DEFAULT_THRESHOLD_GRID = (0.0, 0.2, 0.4, 0.6, 0.8)
+DEFAULT_MIN_FILL_RATE = 0.95
+SWEEP_RESULT_KEYS = ('S_days', 'pack_round_threshold', 'cost', 'fill_rate', 'demand')
+
+
+def _batch_path(checkpoint_dir, index) -> str:
+    return os.path.join(checkpoint_dir, f"batch_{index:05d}.npz")
+
+
+def _open_checkpoint(checkpoint_dir, config) -> set:
+    """
+    Indexes of the batches already in checkpoint_dir. The directory is created with the
+    sweep configuration; resuming it with another configuration raises a ValueError.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    config_path = os.path.join(checkpoint_dir, 'config.json')
+    if os.path.exists(config_path):
+        with open(config_path) as file:
+            saved = json.load(file)
+        if saved != config:
+            raise ValueError(f"Checkpoint {checkpoint_dir} belongs to another sweep: {saved}")
+    else:
+        with open(config_path, 'w') as file:
+            json.dump(config, file, indent=2)
+    return {
+        index for index in range(config['n_batches'])
+        if os.path.exists(_batch_path(checkpoint_dir, index))
+    }
+
+
+def _save_batch(checkpoint_dir, index, product_ids, result) -> None:
+    """Write a finished batch atomically, so an interrupted run never leaves half a file."""
+    path = _batch_path(checkpoint_dir, index)
+    with open(path + '.tmp', 'wb') as file:
+        np.savez(file, product_ids=product_ids, **result)
+    os.replace(path + '.tmp', path)
+
+
+def _sweep_batches(city_inputs, batches, pending, seeds, n_scenarios, workers, grid_args):
+    """
+    Yield (batch index, sweep_policy_grid result) of the pending batches as they finish.
+    At most two batches per worker wait in the pool, so the inputs in flight stay bounded.
+    """
+    def batch_args(index):
+        start, stop = batches[index]
+        # one integer seed per batch for the simulated demand and the lead times
+        batch_seed = int(seeds[index].generate_state(1)[0])
+        return slice_inputs(city_inputs, start, stop, n_scenarios, batch_seed), *grid_args, batch_seed
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for index in pending:
+            yield index, sweep_policy_grid(*batch_args(index))
+        return
+
+    queue = iter(pending)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        for index in queue:
+            running[pool.submit(sweep_policy_grid, *batch_args(index))] = index
+            if len(running) >= 2 * workers:
+                break
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield running.pop(future), future.result()
+                index = next(queue, None)
+                if index is not None:
+                    running[pool.submit(sweep_policy_grid, *batch_args(index))] = index
+
+
+def run_policy_sweep(start_date, end_date, products, source='history', n_scenarios=1, seed=None,
+                     S_days_grid=DEFAULT_S_DAYS_GRID, threshold_grid=DEFAULT_THRESHOLD_GRID,
+                     min_fill_rate=DEFAULT_MIN_FILL_RATE, review_days=1, workers=None,
+                     batch_size=SWEEP_BATCH_SIZE, checkpoint_dir=None, apply=True, progress=None) -> dict:
+    """
+    Sweep S_days and the pack rounding threshold of every product over a grid, backtesting
+    both cities (see sweep_policy_grid), and write the cheapest settings meeting min_fill_rate
+    back to Product in bulk. The products are split into batches run by a process pool.
+    With checkpoint_dir every finished batch is saved there and a rerun with the same
+    arguments skips it, so long sweeps can be interrupted and resumed.
+    Products without demand in the backtest keep their settings.
+    Args:
+        products (QuerySet): products to tune
+        source (str): 'history' or 'simulated', see backtest_oracle
+        workers (int): pool size, the number of CPUs by default; 1 runs in this process
+        apply (bool): save the settings, False to only report them
+        progress (callable): optional progress(share, message) callback
+    Returns:
+        dict: number of products, batches run now and products updated, mean fill rate and total cost.
+    Example return:
+        {'products': 10040, 'batches': 21, 'updated': 9988, 'fill_rate': 0.962, 'cost': 1840520.4}
+    """
+    products, city_inputs = get_backtest_inputs(start_date, end_date, products, source)
+    product_ids = np.array([product.id for product in products], dtype=np.int64)
+    batches = partition(len(products), max(1, -(-len(products) // batch_size)))
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    done = set()
+    if checkpoint_dir:
+        config = {
+            'start_date': str(start_date), 'end_date': str(end_date), 'source': source,
+            'n_scenarios': n_scenarios, 'seed': seed, 'S_days_grid': list(S_days_grid),
+            'threshold_grid': list(threshold_grid), 'min_fill_rate': min_fill_rate, 'review_days': review_days,
+            'n_products': len(products), 'n_batches': len(batches),
+            'first_product': int(product_ids[0]) if len(products) else None,
+        }
+        done = _open_checkpoint(checkpoint_dir, config)
+    results = {}
+    pending = [index for index in range(len(batches)) if index not in done]
+    for index, result in _sweep_batches(city_inputs, batches, pending, seeds, n_scenarios, workers, (
+        S_days_grid, threshold_grid, min_fill_rate, review_days,
+    )):
+        results[index] = result
+        if checkpoint_dir:
+            start, stop = batches[index]
+            _save_batch(checkpoint_dir, index, product_ids[start:stop], result)
+        if progress:
+            progress(len(results) / len(pending), f"{len(results)} of {len(pending)} batches swept")
+
+    for index in done:
+        start, stop = batches[index]
+        with np.load(_batch_path(checkpoint_dir, index)) as batch:
+            if not np.array_equal(batch['product_ids'], product_ids[start:stop]):
+                raise ValueError(f"Checkpoint {checkpoint_dir} was written for other products.")
+            results[index] = {key: batch[key] for key in SWEEP_RESULT_KEYS}
+    best = {
+        key: np.concatenate([results[index][key] for index in range(len(batches))]) if batches else np.zeros(0)
+        for key in SWEEP_RESULT_KEYS
+    }
+
+    tuned = [product for product, demand in zip(products, best['demand'].tolist()) if demand > 0]
+    if apply and tuned:
+        settings = dict(zip(product_ids.tolist(), zip(best['S_days'].tolist(), best['pack_round_threshold'].tolist())))
+        for product in tuned:
+            product.S_days, product.pack_round_threshold = settings[product.id]
+        with transaction.atomic():
+            Product.objects.bulk_update(tuned, ['S_days', 'pack_round_threshold'], batch_size=batch_size)
+    has_demand = best['demand'] > 0
+    return {
+        'products': len(products),
+        'batches': len(pending),
+        'updated': len(tuned) if apply else 0,
+        'fill_rate': float(best['fill_rate'][has_demand].mean()) if has_demand.any() else 1.0,
+        'cost': float(best['cost'].sum()),
+    }
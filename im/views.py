@@ -1,32 +1,35 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
-from io import BytesIO
 from datetime import datetime
 import pandas as pd
-import tempfile
 import os
-from itertools import accumulate
 import zipfile
 
 
-from .models import Product, Store, Sale, Inventory, WorkingDays
+from .models import Product, Store, Sale, Inventory, WorkingDays, CurrentInventory, Job
 from .forms import ExcelUploadForm, ExcelUploadSaleForm, ExcelUploadInventoryForm, ExcelUploadWorkingDaysForm
-from .utils import DemandGenerator  # Adjust import if DemandGenerator is in a different location
-from .utils_stat import calculate_sales_statistics, calculate_sales_global_statistics
-from .utils_place_order import place_order
-from .quaries import get_top_products_by_sales, get_product_sales, get_product_sales_all_months, get_weighted_av_inventory_all_months, get_sales_all_months, get_weighted_av_inventory_all_months_all_products
-from .utils_seasonality import test_seasonality
-from .process_excel import make_flat_table, make_flat_table_inv
+from .utils import simulate_demand_batch
+from .utils_stat import get_demand_parameters
+from .quaries import get_top_products_by_sales, get_product_timeseries, get_sales_all_months, get_weighted_av_inventory_all_months_all_products
+from .utils_seasonality import get_product_seasonality, get_seasonal_products, SEASONALITY_LOCATIONS
+from .utils_jobs import enqueue_job, get_job_status
+from .utils_cache import cached_context, bump_data_generation, get_cache_stats
 
 
-def file_iterator(data, chunk_size=512):
-    for i in range(0, len(data), chunk_size):
-        yield data[i:i+chunk_size]
+def file_iterator(file, chunk_size=64 * 1024):
+    """Read an open binary file in chunks for a StreamingHttpResponse, closing it at the end."""
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+def _enqueue_import(request, kind, title):
+    job = enqueue_job(kind, upload=request.FILES['file'])
+    messages.success(request, f"{title} queued for import as job #{job.id}.")
 
 def homepage(request):
-    today = str(datetime.today().date())
     products_form  = ExcelUploadForm()
     sales_form     = ExcelUploadSaleForm()
     inventory_form = ExcelUploadInventoryForm()
@@ -49,55 +52,21 @@ def homepage(request):
                             category=row['category'],
                         )
                         messages.success(request, f"{row['SKU']} uploaded successfully!")
+                    bump_data_generation()
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
         elif 'upload_sales' in request.POST:
             sales_form = ExcelUploadSaleForm(request.POST, request.FILES)
             if sales_form.is_valid():
-                file = request.FILES['file']
                 try:
-                    data = pd.read_excel(file, engine='openpyxl')                
-                    df = make_flat_table(data)
-                    for _, row in df.iterrows():
-                        try:
-                            product = Product.objects.get(sku=row['SKU'])
-                            store = Store.objects.get(name=row['store'])
-                        except Product.DoesNotExist:
-                            messages.error(request, f"Product with SKU {row['SKU']} not found.")
-                            continue
-                        Sale.objects.create(
-                            product=product,
-                            store=store,
-                            quantity=row['quantity'],
-                            sale_date=row['sale_date'],                            
-                            cost=row['cost'],                            
-                            sale_value=row['sale_value'],                            
-                            client_type=row['client_type'],                            
-                        )
-                    messages.success(request, "Sales data uploaded successfully!")
+                    _enqueue_import(request, Job.IMPORT_SALES, "Sales data")
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
         elif 'upload_inventory' in request.POST:
             inventory_form = ExcelUploadInventoryForm(request.POST, request.FILES)
             if inventory_form.is_valid():
-                file = request.FILES['file']
                 try:
-                    data = pd.read_excel(file, engine='openpyxl')                
-                    df = make_flat_table_inv(data)
-                    for _, row in df.iterrows():
-                        try:
-                            product = Product.objects.get(sku=row['SKU'])
-                            store = Store.objects.get(name=row['store'])
-                        except Product.DoesNotExist:
-                            messages.error(request, f"Product with SKU {row['SKU']} not found.")
-                            continue
-                        Inventory.objects.create(
-                            product=product,
-                            store=store,
-                            inventory_level=row['end'],
-                            date=row['date'],                            
-                        )
-                    messages.success(request, "Inventory data uploaded successfully!")
+                    _enqueue_import(request, Job.IMPORT_INVENTORY, "Inventory data")
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
         elif 'upload_working_days' in request.POST:
@@ -111,50 +80,16 @@ def homepage(request):
                             date=row['date'],                            
                         )
                     messages.success(request, "Working days uploaded successfully!")
+                    bump_data_generation()
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
 
         if 'place_order' in request.POST:
-            selected_months = [(2024, 10), (2024, 11), (2024, 12)]  # Replace as needed
-            df, df_nsk, df_kem = place_order(selected_months)
-
-            # Create an Excel file with multiple sheets
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                df.to_excel(writer, sheet_name='All Orders', index=False)
-                df_nsk.to_excel(writer, sheet_name='Novosibirsk', index=False)
-                df_kem.to_excel(writer, sheet_name='Kemerovo', index=False)
-            output.seek(0)
-
-            # Return the Excel file as an HTTP response
-            response = HttpResponse(
-                output.getvalue(),
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            response['Content-Disposition'] = f'attachment; filename="orders_{today}.xlsx"'
-            return response
-        
-
-        # elif 'place_order' in request.POST:
-        #     selected_months = [(2024, 10), (2024, 11), (2024, 12)]  # Replace as needed
-        #     df, df_nsk, df_kem = place_order(selected_months)
-
-        #     # Use BytesIO to create the Excel file in memory
-        #     output = BytesIO()
-        #     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        #         df.to_excel(writer, index=False)
-        #     output.seek(0)
-
-        #     # Use StreamingHttpResponse for chunked download
-        #     response = StreamingHttpResponse(
-        #         file_iterator(output.getvalue()),  # Generate chunks from the content
-        #         content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        #     )
-        #     response['Content-Disposition'] = f'attachment; filename="order_{today}.xlsx"'
-
-    
-
-        #     return response
+            # Whole catalogue, sales of the last months with data. The order is computed
+            # by the run_jobs worker, the workbook is downloaded from the jobs page
+            job = enqueue_job(Job.ORDER)
+            messages.success(request, f"Order generation queued as job #{job.id}.")
+            return redirect('im:job_list')
     
     else:
         form = ExcelUploadForm()
@@ -171,6 +106,11 @@ def homepage(request):
     return render(request, 'im/index.html', context)
 
 def sales(request):
+    # Served from the cache until the next upload
+    context = cached_context('sales', _sales_context)
+    return render(request, 'im/sales.html', context)
+
+def _sales_context():
     months = 11    
     sales24, sales_nsk24, sales_kem24 = get_sales_all_months(year=2024)
     sales23, sales_nsk23, sales_kem23 = get_sales_all_months(year=2023)
@@ -197,22 +137,35 @@ def sales(request):
         'max_y_in_store': max_y_in_store,
         'inv_sales_ratio24': inv_sales_ratio24[:-1], 'inv_sales_nsk_ratio24': inv_sales_nsk_ratio24[:-1], 'inv_sales_kem_ratio24': inv_sales_kem_ratio24[:-1]
     }
-    return render(request, 'im/sales.html', context)
+    return context
 
 
 def product_list(request):
     products = Product.objects.all()
-    return render(request, 'im/product_list.html', {'products': products})
+    # ?seasonal=<location> keeps the significantly seasonal products, an empty location for all locations
+    seasonal = request.GET.get('seasonal')
+    if seasonal is not None and seasonal in SEASONALITY_LOCATIONS:
+        products = get_seasonal_products(location=seasonal)
+    return render(request, 'im/product_list.html', {'products': products, 'seasonal': seasonal})
 
 def product_detail(request, id):
-    months = 11
     product = get_object_or_404(Product, id=id)
-    sales, sales_nsk, sales_kem = get_product_sales(product, year=2024, month=11)    
-    sales24, sales_nsk24, sales_kem24 = get_product_sales_all_months(product, year=2024, )
-    sales23, sales_nsk23, sales_kem23 = get_product_sales_all_months(product, year=2023, )
-    sales24_cum = list(accumulate(sales24)); sales23_cum = list(accumulate(sales23))
-    sales_nsk24_cum = list(accumulate(sales_nsk24['sales'])); sales_nsk23_cum = list(accumulate(sales_nsk23['sales'])); 
-    sales_kem24_cum = list(accumulate(sales_kem24['sales'])); sales_kem23_cum = list(accumulate(sales_kem23['sales'])); 
+    # Served from the cache until the next upload
+    context = cached_context('product', _product_context, product.id)
+    return render(request, 'im/product.html', context)
+
+def _product_context(id):
+    months = 11
+    product = Product.objects.get(id=id)
+    # All series of the page from one loader: daily sales, working days and inventory history
+    timeseries = get_product_timeseries(product, years=[2023, 2024])
+    ts24, ts23 = timeseries[2024], timeseries[2023]
+    sales, sales_nsk, sales_kem = (ts24[location]['sales'][10] for location in ('total', 'novosibirsk', 'kemerovo'))
+    sales24, sales_nsk24, sales_kem24 = ts24['total'], ts24['novosibirsk'], ts24['kemerovo']
+    sales23, sales_nsk23, sales_kem23 = ts23['total'], ts23['novosibirsk'], ts23['kemerovo']
+    sales24_cum = sales24['cum_sales']; sales23_cum = sales23['cum_sales']
+    sales_nsk24_cum = sales_nsk24['cum_sales']; sales_nsk23_cum = sales_nsk23['cum_sales']
+    sales_kem24_cum = sales_kem24['cum_sales']; sales_kem23_cum = sales_kem23['cum_sales']
     
     sales_nsk24_total = sum(sales_nsk24['sales'][:months]); sales_kem24_total = sum(sales_kem24['sales'][:months]); sales24_total = sum(sales24['sales'][:months])
     sales_nsk23_total = sum(sales_nsk23['sales'][:months]); sales_kem23_total = sum(sales_kem23['sales'][:months]); sales23_total = sum(sales23['sales'][:months])
@@ -221,7 +174,10 @@ def product_detail(request, id):
     dif_abs_nsk = sales_nsk24_total - sales_nsk23_total; dif_perc_nsk = (sales_nsk24_total / sales_nsk23_total - 1) * 100 if sales_nsk23_total > 0 else "-"
     dif_abs_kem = sales_kem24_total - sales_kem23_total; dif_perc_kem = (sales_kem24_total / sales_kem23_total - 1) * 100 if sales_kem23_total > 0 else "-"
 
-    inv24, inv_nsk24, inv_kem24 = get_weighted_av_inventory_all_months(product, year=2024)
+    inv24, inv_nsk24, inv_kem24 = sales24['inventory'], sales_nsk24['inventory'], sales_kem24['inventory']
+    current_stock = {'novosibirsk': 0, 'kemerovo': 0}
+    for location, inventory_level in CurrentInventory.objects.filter(product=product).values_list('store__location', 'inventory_level'):
+        current_stock[location] = current_stock.get(location, 0) + inventory_level
     max_y_in_store = max(max(sales_nsk24['sales']), max(sales_nsk23['sales']), max(sales_kem24['sales']), max(sales_kem23['sales']), 
                         max(inv_nsk24), max(inv_kem24))
     # Inventory
@@ -229,13 +185,11 @@ def product_detail(request, id):
     inv_sales_nsk_ratio24 = [a / b if b>0 else 0 for a, b in zip(inv_nsk24, sales_nsk24['sales'])]
     inv_sales_kem_ratio24 = [a / b if b>0 else 0 for a, b in zip(inv_kem24, sales_kem24['sales'])]
     
-    # seasonality
-    stat, p_value, seasonal_dec = test_seasonality(sales24['av_sales'][:-1], sales23['av_sales'][:-1])
-    stat_nsk, p_value_nsk, seasonal_dec_nsk = test_seasonality(sales_nsk24['av_sales'][:-1], sales_nsk23['av_sales'][:-1])
-    stat_kem, p_value_kem, seasonal_dec_kem = test_seasonality(sales_kem24['av_sales'][:-1], sales_kem23['av_sales'][:-1])
-    p_values = [{"i": 1, "p_value": p_value_nsk}, {"i": 2, "p_value": p_value_kem}, {"i": 3, "p_value": p_value}]
-    kruskal_stats = [{"i": 1, "kruskal": stat_nsk}, {"i": 2, "kruskal": stat_kem}, {"i": 3, "kruskal": stat}]
-    print(p_values)
+    # seasonality, precomputed for the whole catalogue by analyse_seasonality
+    seasonality = get_product_seasonality(product)
+    p_values = [{"i": i, "p_value": seasonality[location]['p_value']} for i, location in enumerate(('novosibirsk', 'kemerovo', ''), 1)]
+    kruskal_stats = [{"i": i, "kruskal": seasonality[location]['kruskal_stat']} for i, location in enumerate(('novosibirsk', 'kemerovo', ''), 1)]
+    seasonal_dec, seasonal_dec_nsk, seasonal_dec_kem = (seasonality[location]['chart'] for location in ('', 'novosibirsk', 'kemerovo'))
 
     li = [1, 2, 3]
     context = {
@@ -263,6 +217,7 @@ def product_detail(request, id):
         'dif_abs': dif_abs, 'dif_abs_nsk': dif_abs_nsk, 'dif_abs_kem': dif_abs_kem,
         'dif_perc': dif_perc, 'dif_perc_nsk': dif_perc_nsk, 'dif_perc_kem': dif_perc_kem,
         'inv24': inv24[:-1], 'inv_nsk24': inv_nsk24[:-1], 'inv_kem24': inv_kem24[:-1],
+        'current_stock': sum(current_stock.values()), 'current_stock_nsk': current_stock['novosibirsk'], 'current_stock_kem': current_stock['kemerovo'],
         'max_y_in_store': max_y_in_store,
         'inv_sales_ratio24': inv_sales_ratio24[:-1], 'inv_sales_nsk_ratio24': inv_sales_nsk_ratio24[:-1], 'inv_sales_kem_ratio24': inv_sales_kem_ratio24[:-1],
         'kruskal_stats': kruskal_stats, 'p_values': p_values,
@@ -270,7 +225,7 @@ def product_detail(request, id):
 
         'li': li,
     }
-    return render(request, 'im/product.html', context)
+    return context
 
 def store_list(request):
     stores = Store.objects.all()
@@ -278,20 +233,19 @@ def store_list(request):
 
 def simulate_demand(request):
     if request.method == "POST":
-        product_id = request.POST.get("product_id")
-        product = Product.objects.get(id=product_id)
-
-        # Define generator arguments
-        generator_args = {
-            'distribution': 'normal',  # Or another supported distribution
-            'mean': 50,               # Replace with product-specific logic if needed
-            'std': 10,                # Replace with product-specific logic if needed
-            'period_length': 200,
-        }
-
-        # Simulate demand
-        generator = DemandGenerator(generator_args)
-        demand = generator.simulate_demand()
+        product = get_object_or_404(Product, id=request.POST.get("product_id"))
+        seed = request.POST.get("seed")
+        if seed and not seed.isdecimal():
+            return JsonResponse({'error': 'The seed must be a non-negative integer'}, status=400)
+
+        # Simulate every store from the product's sales statistics and add the stores up
+        parameters = get_demand_parameters(products=[product])
+        if not len(parameters['means']):
+            return JsonResponse({'error': 'No sales statistics for this product'}, status=404)
+        demand = simulate_demand_batch(
+            parameters['means'], parameters['stds'], n_periods=200,
+            seed=int(seed) if seed else None,
+        )[0].sum(axis=0)
 
         return JsonResponse({'demand': demand.tolist()})  # Convert NumPy array to list for JSON serialization
 
@@ -319,52 +273,21 @@ def upload_excel(request):
                             manufacturer=row['manufacturer'],
                         )
                         messages.success(request, f"{row['SKU']} uploaded successfully!")
+                    bump_data_generation()
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
         elif 'upload_sales' in request.POST:
             sales_form = ExcelUploadSaleForm(request.POST, request.FILES)
             if sales_form.is_valid():
-                file = request.FILES['file']
                 try:
-                    data = pd.read_excel(file, engine='openpyxl')                
-                    df = make_flat_table(data)
-                    for _, row in df.iterrows():
-                        try:
-                            product = Product.objects.get(sku=row['SKU'])
-                            store = Store.objects.get(name=row['store'])
-                        except Product.DoesNotExist:
-                            messages.error(request, f"Product with SKU {row['SKU']} not found.")
-                            continue
-                        Sale.objects.create(
-                            product=product,
-                            store=store,
-                            quantity=row['quantity'],
-                            sale_date=row['sale_date'],                            
-                        )
-                    messages.success(request, "Sales data uploaded successfully!")
+                    _enqueue_import(request, Job.IMPORT_SALES, "Sales data")
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
         elif 'upload_inventory' in request.POST:
             inventory_form = ExcelUploadInventoryForm(request.POST, request.FILES)
             if inventory_form.is_valid():
-                file = request.FILES['file']
                 try:
-                    data = pd.read_excel(file, engine='openpyxl')                
-                    df = make_flat_table_inv(data)
-                    for _, row in df.iterrows():
-                        try:
-                            product = Product.objects.get(sku=row['SKU'])
-                            store = Store.objects.get(name=row['store'])
-                        except Product.DoesNotExist:
-                            messages.error(request, f"Product with SKU {row['SKU']} not found.")
-                            continue
-                        Inventory.objects.create(
-                            product=product,
-                            store=store,
-                            inventory_level=row['end'],
-                            date=row['date'],                            
-                        )
-                    messages.success(request, "Inventory data uploaded successfully!")
+                    _enqueue_import(request, Job.IMPORT_INVENTORY, "Inventory data")
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
         elif 'upload_working_days' in request.POST:
@@ -378,6 +301,7 @@ def upload_excel(request):
                             date=row['date'],                            
                         )
                     messages.success(request, "Working days uploaded successfully!")
+                    bump_data_generation()
                 except Exception as e:
                     messages.error(request, f"Error processing the file: {e}")
     else:
@@ -391,11 +315,20 @@ def upload_excel(request):
         }
     return render(request, 'im/upload_excel.html', context)
 
+def cache_stats(request):
+    """
+    Cache hit/miss counters and the current data generation of the dashboards.
+    """
+    return JsonResponse(get_cache_stats())
+
 ## UPDATE STATS
 @csrf_exempt
 def calculate_statistics_view(request):
     """
-    View to trigger the calculation of sales statistics.
+    View to queue the calculation of sales statistics for the run_jobs worker.
+    mode=incremental (default) moves the stored window using the DailySales rollup,
+    mode=full recalculates the statistics, execution=serial|thread|process splits the SKUs across workers.
+    Responds 202 with the job id and the URL of its status.
     """
     if request.method == "POST":
         start_date = request.POST.get('start_date')
@@ -411,11 +344,18 @@ def calculate_statistics_view(request):
         if start_date > end_date:
             return JsonResponse({'error': 'Start date must be earlier than end date.'}, status=400)
 
-        # Trigger the statistics calculation
-        statistics = calculate_sales_statistics(start_date, end_date)
-        statistics_global = calculate_sales_global_statistics(start_date, end_date)
-
-        return JsonResponse({'message': 'Statistics calculated successfully!', 'data': statistics, 'data_global': statistics_global})
+        # Queue the statistics calculation
+        job = enqueue_job(Job.STATISTICS, {
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'mode': request.POST.get('mode', 'incremental'),
+            'execution': request.POST.get('execution', 'serial'),
+        })
+        return JsonResponse({
+            'message': f'Statistics calculation queued as job #{job.id}.',
+            'job_id': job.id,
+            'status_url': reverse('im:job_status', args=[job.id]),
+        }, status=202)
 
     return JsonResponse({'error': 'Invalid HTTP method. Use POST.'}, status=405)
 
@@ -426,27 +366,63 @@ def calculate_statistics_form(request):
     return render(request, 'im/calculate_statistics.html')
 
 def place_order_view(request):
-    table_data = None  
+    """
+    Queue an order run. Optional POST fields: skus (separated by spaces, commas or
+    new lines, the whole catalogue when empty), abc_class (one or more of A, B, C)
+    and reference_date (YYYY-MM-DD).
+    """
     if request.method == 'POST':  # Triggered when the button is clicked
-        # Example: Selected months can come from a form or be predefined
-        selected_months = [(2024, 10), (2024, 11), (2024, 12)]  # Replace as needed
-        
-        # Call your function
-        df = place_order(selected_months)
-        table_data = df.to_dict(orient='records')  # Convert DataFrame to a list of dictionaries
-
-        # Save the Excel to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            temp_filename = tmp.name
-            df.to_excel(temp_filename, index=False)
-        
-        # Serve the file as a download
-        with open(temp_filename, 'rb') as f:
-            response = HttpResponse(f.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = f'attachment; filename="order.xlsx"'
-        os.remove(temp_filename)  # Clean up the temporary file
-        return response
+        params = {}
+        skus = request.POST.get('skus', '').replace(',', ' ').split()
+        if skus:
+            params['skus'] = skus
+        abc_classes = request.POST.getlist('abc_class')
+        if abc_classes:
+            params['abc_classes'] = abc_classes
+        reference_date = request.POST.get('reference_date')
+        if reference_date:
+            try:
+                params['reference_date'] = datetime.strptime(reference_date, "%Y-%m-%d").date().isoformat()
+            except ValueError:
+                messages.error(request, "Invalid date format. Use YYYY-MM-DD.")
+                return redirect('im:place_order')
+        job = enqueue_job(Job.ORDER, params)
+        messages.success(request, f"Order generation queued as job #{job.id}.")
+        return redirect('im:job_list')
     
     # Render the page for GET request
-    return render(request, 'im/place_order.html', {'table_data': table_data})
+    return render(request, 'im/place_order.html', {'table_data': None})
+
+## BACKGROUND JOBS
+def job_list(request):
+    """
+    Recent background jobs with their progress, results and order workbooks.
+    """
+    jobs = Job.objects.all()[:50]
+    running = any(job.status in (Job.QUEUED, Job.RUNNING) for job in jobs)
+    return render(request, 'im/jobs.html', {'jobs': jobs, 'running': running})
 
+def job_status(request, id):
+    """
+    Status and progress of a job as JSON, polled by the pages that queue jobs.
+    """
+    job = get_object_or_404(Job, id=id)
+    status = get_job_status(job)
+    if status['has_output']:
+        status['download_url'] = reverse('im:job_download', args=[job.id])
+    return JsonResponse(status)
+
+def job_download(request, id):
+    """
+    Download the workbook of a finished job.
+    """
+    job = get_object_or_404(Job, id=id, status=Job.DONE)
+    if not job.output_file:
+        raise Http404("The job has no workbook.")
+    response = StreamingHttpResponse(
+        file_iterator(job.output_file.open('rb')),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    response['Content-Length'] = job.output_file.size
+    response['Content-Disposition'] = f'attachment; filename="{os.path.basename(job.output_file.name)}"'
+    return response